@@ -14,6 +14,11 @@ import time
 import functools
 from mmappickle import mmapdict
 
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_extraction_scripts")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from line_index import line_count  # noqa: E402
+
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
@@ -325,12 +330,15 @@ def main():
         "1B": 1_000_000_000,
     }
 
-    for key in filelines_map:
-        if key in args.file_path:
-            file_lines = filelines_map[key]
-            break
-        else:
-            file_lines = 57_189_425_968
+    # Exact count from the sidecar of 'line_index.py build', else the known sizes of the dataset files
+    file_lines = line_count(args.file_path)
+    if file_lines is None:
+        for key in filelines_map:
+            if key in args.file_path:
+                file_lines = filelines_map[key]
+                break
+            else:
+                file_lines = 57_189_425_968
 
     processor = DataProcessor(
         file_path=args.file_path,
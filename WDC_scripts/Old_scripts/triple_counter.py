@@ -2,12 +2,24 @@ import pandas as pd
 import os
 import logging
 import argparse
+import sys
 import time
 from tqdm import tqdm
 import dask.dataframe as dd
 import numpy as np
 from dask.distributed import Client
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataset_extraction_scripts")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from gzip_index import iter_gz_range_lines, split_gz_ranges  # noqa: E402
+from hyperloglog import DEFAULT_PRECISION, HyperLogLog  # noqa: E402
+from external_distinct import DEFAULT_MEMORY, DEFAULT_PARTITIONS, ExternalDistinct  # noqa: E402
+
+# Distinct items buffered in a set before they are passed to a sketch or spill counter
+COUNTER_BATCH = 1_000_000
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -47,8 +59,63 @@ def process_chunk(chunk_data):
         return 0, set(), set(), 0.0
 
 
+def make_counter(name, precision=None, spill_dir=None, partitions=DEFAULT_PARTITIONS, memory_budget=DEFAULT_MEMORY):
+    """
+    Distinct counter for ``name``: a HyperLogLog sketch with ``precision``, an
+    external-memory counter spilling to ``spill_dir``, or a set. Bind the
+    options with ``functools.partial`` to pass it to worker processes.
+    """
+    if precision:
+        return HyperLogLog(precision)
+    if spill_dir:
+        return ExternalDistinct(spill_dir, name, partitions, n_jobs=os.cpu_count(), memory_budget=memory_budget)
+    return set()
+
+
+def process_gz_range(file_path, start, end, new_counter=None):
+    """
+    Count triples, entities and relations of one uncompressed byte range of a .gz file.
+    With ``new_counter``, the distinct entities and relations are collected in
+    batches into ``new_counter("entities")`` and ``new_counter("relations")``
+    (HyperLogLog sketches or external-memory counters) instead of sets, so
+    memory stays bounded however many there are.
+    """
+    total_triples = 0
+    unique_entities = set()
+    unique_relations = set()
+    counters = (new_counter("entities"), new_counter("relations")) if new_counter else None
+    for line in iter_gz_range_lines(file_path, start, end):
+        parts = line.split()
+        if len(parts) == 5 and parts[4] == b".":
+            total_triples += 1
+            unique_entities.add(parts[0])
+            unique_entities.add(parts[2])
+            unique_relations.add(parts[1])
+            if counters and len(unique_entities) >= COUNTER_BATCH:
+                counters[0].update(unique_entities)
+                counters[1].update(unique_relations)
+                unique_entities.clear()
+                unique_relations.clear()
+    if counters:
+        counters[0].update(unique_entities)
+        counters[1].update(unique_relations)
+        for counter in counters:
+            if isinstance(counter, ExternalDistinct):
+                # Flush in the worker, so only the spill file paths travel back to the parent
+                counter.partitioner.close()
+        return total_triples, counters[0], counters[1]
+    return total_triples, unique_entities, unique_relations
+
+
 def process_large_dataset(
-    file_path, library="pandas", chunksize=100_000_000, max_workers=128
+    file_path,
+    library="pandas",
+    chunksize=100_000_000,
+    max_workers=128,
+    precision=None,
+    spill_dir=None,
+    partitions=DEFAULT_PARTITIONS,
+    memory_budget=DEFAULT_MEMORY,
 ):
     path_parts = file_path.split(os.sep)
     relevant_path = os.sep.join(path_parts[-2:])
@@ -60,8 +127,17 @@ def process_large_dataset(
     
     logging.info(f"Script configurations: \nLibrary: {library} \nChunksize: {chunksize} \nNumber of Workers: {max_workers}")
 
-    unique_entities = set()
-    unique_relations = set()
+    # HyperLogLog sketches and external-memory counters count distinct items like sets (update/len)
+    if precision:
+        new_counter = partial(make_counter, precision=precision)
+        logging.info(f"Approximate distinct counts, relative standard error {new_counter('').relative_error:.2%}")
+    elif spill_dir:
+        new_counter = partial(make_counter, spill_dir=spill_dir, partitions=partitions, memory_budget=memory_budget)
+        logging.info(f"Exact distinct counts with {partitions} partitions spilled to {spill_dir}")
+    else:
+        new_counter = None
+    unique_entities = new_counter("entities") if new_counter else set()
+    unique_relations = new_counter("relations") if new_counter else set()
     total_triples = 0
 
     if library == "pandas":
@@ -84,9 +160,10 @@ def process_large_dataset(
             for chunk in tqdm(reader, desc="Processing chunks"):
                 chunk_count += 1
                 total_triples += len(chunk)
-                unique_entities.update(chunk["subject"].unique())
-                unique_entities.update(chunk["object"].unique())
-                unique_relations.update(chunk["relation"].unique())
+                # Short or malformed rows leave NaN, which sketches and spill counters cannot hash
+                unique_entities.update(chunk["subject"].dropna().unique())
+                unique_entities.update(chunk["object"].dropna().unique())
+                unique_relations.update(chunk["relation"].dropna().unique())
                 memory_usage = chunk.memory_usage(deep=True).sum()
                 memory_usage_mb = memory_usage / (1024**2)
                 chunk_mem.append(memory_usage_mb)
@@ -100,6 +177,8 @@ def process_large_dataset(
             logging.error(f"An error occurred: {str(e)}")
             
     elif library == "dask":
+        if new_counter:
+            logging.warning("The dask library counts with its own dataframes; --approximate and --spill_dir are ignored.")
         try:
             scheduler_file = "scheduler.json"
             while not os.path.exists(scheduler_file):
@@ -132,6 +211,19 @@ def process_large_dataset(
         except Exception as e:
             logging.error(f"An error occurred: {str(e)}")
 
+    elif library == "gzip":
+        # split_gz_ranges builds the seek-point index once; every worker process then opens its own
+        # IndexedGzipFile from the cached .gzidx, so splitting and counting run in parallel outside the GIL
+        ranges = split_gz_ranges(file_path, max_workers)
+        logging.info(f"Number of chunks: {len(ranges)}")
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+            futures = [executor.submit(process_gz_range, file_path, start, end, new_counter) for start, end in ranges]
+            for future in tqdm(futures, desc="Collecting results"):
+                result = future.result()
+                total_triples += result[0]
+                unique_entities.update(result[1])
+                unique_relations.update(result[2])
+
     elif library == "numpy":
         chunk_size_lines = chunksize
         chunk_size_bytes = None
@@ -195,6 +287,9 @@ def process_large_dataset(
     logging.info(f"Total number of triples: {total_triples}")
     logging.info(f"Number of unique entities: {len(unique_entities)}")
     logging.info(f"Number of unique relations: {len(unique_relations)}")
+    for counter in (unique_entities, unique_relations):
+        if isinstance(counter, ExternalDistinct):
+            counter.cleanup()
 
 
 def main():
@@ -207,7 +302,7 @@ def main():
     parser.add_argument(
         "--library",
         type=str,
-        choices=["pandas", "dask", "numpy"],
+        choices=["pandas", "dask", "numpy", "gzip"],
         default="pandas",
         help="Specify the library to use for processing the dataset.",
     )
@@ -223,6 +318,35 @@ def main():
         default=128,
         help="Maximum number of workers to use for processing.",
     )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Count distinct entities and relations with HyperLogLog sketches instead of sets.",
+    )
+    parser.add_argument(
+        "--precision",
+        type=int,
+        default=DEFAULT_PRECISION,
+        help="log2 of the register count of the sketches (14: 0.81%% relative standard error).",
+    )
+    parser.add_argument(
+        "--spill_dir",
+        type=str,
+        default=None,
+        help="Count distinct entities and relations exactly by hash-partitioning them into spill files here.",
+    )
+    parser.add_argument(
+        "--partitions",
+        type=int,
+        default=DEFAULT_PARTITIONS,
+        help="Number of spill partitions for --spill_dir.",
+    )
+    parser.add_argument(
+        "--memory_mb",
+        type=int,
+        default=DEFAULT_MEMORY >> 20,
+        help="Memory budget for deduplicating the partitions of --spill_dir; larger partitions are split.",
+    )
     args = parser.parse_args()
 
     process_large_dataset(
@@ -230,6 +354,10 @@ def main():
         library=args.library,
         chunksize=args.chunksize,
         max_workers=args.max_workers,
+        precision=args.precision if args.approximate else None,
+        spill_dir=args.spill_dir,
+        partitions=args.partitions,
+        memory_budget=args.memory_mb << 20,
     )
 
 
@@ -0,0 +1,453 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from itertools import compress
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from external_distinct import (
+    DEFAULT_MEMORY,
+    DEFAULT_PARTITIONS,
+    HashPartitioner,
+    iter_fitting_partitions,
+    partition_block,
+    partition_files,
+)
+from transform_triples import BLOCK_SIZE, imap_bounded, iter_blocks
+
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from file_assembly import concatenate  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+DEFAULT_FINGERPRINT_BITS = 128
+# Estimated peak memory of np.unique over a fingerprint bucket, per byte of the bucket file
+UNIQUE_OVERHEAD = 4
+MAX_SPLIT_DEPTH = 3
+
+
+def _split_lines(block):
+    lines = block.split(b"\n")
+    if block.endswith(b"\n"):
+        lines.pop()
+    return lines
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class PeakSize:
+    """Polls the size of a directory in a background thread and keeps the peak."""
+
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, _directory_size(self.path))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, _directory_size(self.path))
+
+
+class DedupStats:
+    """Line and byte counts, temp space and phase timings of one deduplication."""
+
+    def __init__(self):
+        self.lines_in = 0
+        self.lines_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.temp_bytes = 0
+        self.phases = {}
+
+    def log(self):
+        total = sum(self.phases.values())
+        mb = self.bytes_in / (1 << 20)
+        logging.info(
+            f"{self.lines_in} lines in, {self.lines_out} unique lines out, "
+            f"{self.lines_in - self.lines_out} duplicates removed"
+        )
+        logging.info(
+            f"{mb:.1f} MB in {total:.1f}s ({mb / total if total else 0:.1f} MB/s), "
+            f"peak temp space {self.temp_bytes / (1 << 20):.1f} MB; "
+            + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in self.phases.items())
+        )
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+# Bucket order: lines are grouped by hash partition, in their first-seen order within a partition
+
+
+def _dedup_partition(task):
+    """
+    Write the distinct lines of one partition to ``output`` and remove its
+    spill files. Only one group that fits the memory budget is held at a time,
+    and only the counts travel back to the parent.
+    """
+    paths, memory_budget, spill_dir, name, output = task
+    lines = size = 0
+    with open(output, "wb") as out:
+        for group, temporary in iter_fitting_partitions(paths, memory_budget, spill_dir, name):
+            distinct = {}
+            for path in group:
+                with open(path, "rb") as f:
+                    distinct.update(dict.fromkeys(f))
+            out.writelines(distinct)
+            lines += len(distinct)
+            size += sum(map(len, distinct))
+            del distinct
+            if temporary:
+                for path in group:
+                    os.remove(path)
+    for path in paths:
+        os.remove(path)
+    return output, lines, size
+
+
+def dedup_by_partition(input_path, output_path, spill_dir, workers, n_partitions, memory_budget, stats):
+    """
+    Deduplicate in two passes: spread the lines over hash partitions on disk,
+    then deduplicate the partitions in memory in parallel, each worker into its
+    own file. The files are joined in partition order with kernel-side copies,
+    so the output is grouped by partition, in first-seen order within each.
+    """
+    name = "lines"
+    partitioner = HashPartitioner(spill_dir, name, n_partitions)
+    start = time.perf_counter()
+    with Pool(workers) as pool, tqdm(unit="B", unit_scale=True, desc="Partitioning") as progress:
+        blocks = ((block, n_partitions) for block in iter_blocks(input_path, BLOCK_SIZE))
+        for groups in imap_bounded(pool, partition_block, _counted(blocks, stats, progress), 2 * workers):
+            for partition, data in groups.items():
+                partitioner.extend(partition, data)
+    partitioner.close()
+    stats.phases["partition"] = time.perf_counter() - start
+    stats.temp_bytes = _directory_size(spill_dir)
+
+    start = time.perf_counter()
+    files = partition_files(spill_dir, name)
+    budget = memory_budget // max(1, workers)
+    tasks = [
+        (paths, budget, spill_dir, f"{name}-{partition:05d}", os.path.join(spill_dir, f"unique.{partition:05d}"))
+        for partition, paths in files.items()
+    ]
+    outputs = {}
+    with Pool(workers) as pool:
+        results = pool.imap_unordered(_dedup_partition, tasks)
+        for output, lines, size in tqdm(results, total=len(tasks), desc="Deduplicating"):
+            outputs[output] = size
+            stats.lines_out += lines
+            stats.bytes_out += size
+    stats.phases["deduplicate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    concatenate([(task[-1], 0, outputs[task[-1]]) for task in tasks], output_path)
+    stats.phases["join"] = time.perf_counter() - start
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _counted(tasks, stats, progress):
+    """Pass ``(block, ...)`` tasks through, counting the lines and bytes read."""
+    for task in tasks:
+        block = task[0]
+        stats.lines_in += block.count(b"\n") + (not block.endswith(b"\n"))
+        stats.bytes_in += len(block)
+        progress.update(len(block))
+        yield task
+
+
+# Input order: fingerprints pick the first occurrence of every line, a second pass copies them
+
+
+def _fingerprints(block, bits):
+    digest_size = bits // 8
+    digests = b"".join(hashlib.blake2b(line, digest_size=digest_size).digest() for line in _split_lines(block))
+    return np.frombuffer(digests, dtype="<u8").reshape(-1, bits // 64)
+
+
+class FingerprintBuckets:
+    """Appends ``(fingerprint, line index)`` records to one file per bucket of the fingerprint."""
+
+    def __init__(self, spill_dir, n_buckets, bits, buffer_records=1 << 20):
+        self.spill_dir = spill_dir
+        self.n_buckets = n_buckets
+        self.dtype = np.dtype([("fingerprint", "<u8", (bits // 64,)), ("index", "<u8")])
+        self.buffer_records = buffer_records
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def path(self, bucket):
+        return os.path.join(self.spill_dir, f"fingerprints.{bucket:05d}")
+
+    def add(self, fingerprints, first_index):
+        records = np.empty(len(fingerprints), dtype=self.dtype)
+        records["fingerprint"] = fingerprints
+        records["index"] = np.arange(first_index, first_index + len(fingerprints), dtype=np.uint64)
+        buckets = fingerprints[:, 0] % np.uint64(self.n_buckets)
+        order = np.argsort(buckets, kind="stable")
+        bounds = np.searchsorted(buckets[order], np.arange(self.n_buckets + 1))
+        for bucket in np.flatnonzero(np.diff(bounds)):
+            self.buffers[bucket].append(records[order[bounds[bucket]:bounds[bucket + 1]]])
+        self.buffered += len(records)
+        if self.buffered >= self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        for bucket, parts in self.buffers.items():
+            with open(self.path(bucket), "ab") as f:
+                np.concatenate(parts).tofile(f)
+        self.buffers.clear()
+        self.buffered = 0
+
+
+def _split_bucket(path, dtype, n_split, level, memory_budget):
+    """
+    Re-split an oversized bucket file by other bits of the fingerprint, reading
+    it in pieces of ``memory_budget``. Equal fingerprints stay together and
+    records keep their line order within each part. Returns the part paths.
+    """
+    shift = np.uint64(64 - 16 * level)
+    parts = [f"{path}.{level}.{part:05d}" for part in range(n_split)]
+    chunk_records = max(1, memory_budget // (2 * dtype.itemsize))
+    with open(path, "rb") as f:
+        while True:
+            records = np.fromfile(f, dtype=dtype, count=chunk_records)
+            if not len(records):
+                break
+            keys = (records["fingerprint"][:, 0] >> shift) % np.uint64(n_split)
+            order = np.argsort(keys, kind="stable")
+            bounds = np.searchsorted(keys[order], np.arange(n_split + 1))
+            for part in np.flatnonzero(np.diff(bounds)):
+                with open(parts[part], "ab") as out:
+                    records[order[bounds[part]:bounds[part + 1]]].tofile(out)
+    os.remove(path)
+    return [part for part in parts if os.path.exists(part)]
+
+
+def _first_occurrences(task):
+    """
+    Sorted line indexes of the first occurrences in one bucket. A bucket whose
+    ``np.unique`` would exceed ``memory_budget`` is re-split first, up to
+    ``MAX_SPLIT_DEPTH`` levels (a bucket of mostly one line does not shrink).
+    """
+    path, dtype, memory_budget, level = task
+    size = os.path.getsize(path)
+    if size * UNIQUE_OVERHEAD > memory_budget and level < MAX_SPLIT_DEPTH:
+        n_split = min(1 << 16, -(-size * UNIQUE_OVERHEAD // memory_budget) + 1)
+        parts = _split_bucket(path, dtype, n_split, level + 1, memory_budget)
+        if len(parts) > 1:
+            return np.concatenate([_first_occurrences((part, dtype, memory_budget, level + 1)) for part in parts])
+        path = parts[0]
+    records = np.fromfile(path, dtype=dtype)
+    keys = np.ascontiguousarray(records["fingerprint"]).view(np.dtype((np.void, dtype["fingerprint"].itemsize)))
+    # Records are appended in line order, so the first index of a fingerprint is its first occurrence
+    _, first = np.unique(keys.ravel(), return_index=True)
+    os.remove(path)
+    return records["index"][first]
+
+
+def dedup_keep_order(input_path, output_path, spill_dir, workers, n_buckets, bits, memory_budget, stats):
+    """
+    Deduplicate keeping the first occurrence of every line in input order. The
+    temp space holds only ``bits / 8 + 8`` bytes per line: lines are
+    identified by their fingerprint (a collision among 10^11 distinct lines
+    has probability ~10^-17 at 128 bits, ~0.3 at 64 bits), a bitmap marks the
+    first occurrences, and a second pass over the input copies them. Buckets
+    too large for ``memory_budget / workers`` are re-split before ``np.unique``.
+    """
+    buckets = FingerprintBuckets(spill_dir, n_buckets, bits)
+    start = time.perf_counter()
+    with Pool(workers) as pool, tqdm(unit="B", unit_scale=True, desc="Fingerprinting") as progress:
+        blocks = ((block, bits) for block in iter_blocks(input_path, BLOCK_SIZE))
+        index = 0
+        for fingerprints in imap_bounded(pool, _fingerprints, _counted(blocks, stats, progress), 2 * workers):
+            buckets.add(fingerprints, index)
+            index += len(fingerprints)
+    buckets.flush()
+    stats.phases["fingerprint"] = time.perf_counter() - start
+    stats.temp_bytes = _directory_size(spill_dir)
+
+    start = time.perf_counter()
+    # One bit per input line; the bitmap is a file in spill_dir, so the OS pages it instead of it
+    # counting against the memory budget of the workers
+    keep = np.memmap(
+        os.path.join(spill_dir, "keep.bitmap"), dtype=np.uint8, mode="w+", shape=(stats.lines_in + 8) // 8
+    )
+    budget = memory_budget // max(1, workers)
+    tasks = [
+        (buckets.path(bucket), buckets.dtype, budget, 0)
+        for bucket in range(n_buckets)
+        if os.path.exists(buckets.path(bucket))
+    ]
+    with Pool(workers) as pool:
+        for first in tqdm(pool.imap_unordered(_first_occurrences, tasks), total=len(tasks), desc="Deduplicating"):
+            np.bitwise_or.at(keep, first >> np.uint64(3), np.left_shift(1, first & np.uint64(7)).astype(np.uint8))
+            stats.lines_out += len(first)
+    stats.temp_bytes += keep.nbytes
+    stats.phases["deduplicate"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = 0
+    with open(output_path, "wb") as out:
+        for block in tqdm(iter_blocks(input_path, BLOCK_SIZE), desc="Writing", unit=" blocks"):
+            lines = _split_lines(block)
+            first_byte, last_byte = index >> 3, (index + len(lines) + 7) >> 3
+            flags = np.unpackbits(keep[first_byte:last_byte], bitorder="little")[index & 7:(index & 7) + len(lines)]
+            kept = list(compress(lines, flags.tolist()))
+            if kept:
+                data = b"\n".join(kept) + b"\n"
+                out.write(data)
+                stats.bytes_out += len(data)
+            index += len(lines)
+    stats.phases["write"] = time.perf_counter() - start
+    del keep
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def dedup(input_path, output_path, spill_dir, workers=1, n_partitions=DEFAULT_PARTITIONS,
+          memory_budget=DEFAULT_MEMORY, keep_order=False, bits=DEFAULT_FINGERPRINT_BITS):
+    """Write the distinct lines of ``input_path`` to ``output_path``; returns the ``DedupStats``."""
+    stats = DedupStats()
+    if keep_order:
+        dedup_keep_order(input_path, output_path, spill_dir, workers, n_partitions, bits, memory_budget, stats)
+    else:
+        dedup_by_partition(input_path, output_path, spill_dir, workers, n_partitions, memory_budget, stats)
+    stats.log()
+    return stats
+
+
+def compare_with_sort(input_path, work_dir, workers, sort_buffer=None, **dedup_args):
+    """
+    Run ``LC_ALL=C sort -u`` and ``dedup`` on the same input, report time and
+    peak temp space of both, and check that they produce the same set of lines.
+    ``sort_buffer`` (e.g. ``"1G"``) limits the memory of ``sort`` to emulate
+    inputs much larger than memory, where it spills sorted runs to disk.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    sort_output = os.path.join(work_dir, "sort_unique.txt")
+    sort_temp = os.path.join(work_dir, "sort_tmp")
+    os.makedirs(sort_temp, exist_ok=True)
+    start = time.perf_counter()
+    with PeakSize(sort_temp) as sort_peak:
+        subprocess.run(
+            ["sort", "-u", f"--parallel={workers}", "-T", sort_temp, "-o", sort_output, input_path]
+            + ([f"--buffer-size={sort_buffer}"] if sort_buffer else []),
+            check=True,
+            env={**os.environ, "LC_ALL": "C"},
+        )
+    sort_seconds = time.perf_counter() - start
+
+    dedup_output = os.path.join(work_dir, "dedup_unique.txt")
+    stats = dedup(input_path, dedup_output, os.path.join(work_dir, "dedup_tmp"), workers, **dedup_args)
+    dedup_seconds = sum(stats.phases.values())
+
+    check = subprocess.run(
+        f"sort {shlex.quote(dedup_output)} | cmp -s - {shlex.quote(sort_output)}",
+        shell=True,
+        env={**os.environ, "LC_ALL": "C"},
+    )
+    mb = os.path.getsize(input_path) / (1 << 20)
+    logging.info(
+        f"sort -u: {sort_seconds:.1f}s ({mb / sort_seconds:.1f} MB/s), peak temp space {sort_peak.peak / (1 << 20):.1f} MB"
+    )
+    logging.info(
+        f"dedup: {dedup_seconds:.1f}s ({mb / dedup_seconds:.1f} MB/s), peak temp space {stats.temp_bytes / (1 << 20):.1f} MB"
+    )
+    logging.info("Same set of lines as sort -u" if check.returncode == 0 else "Output DIFFERS from sort -u")
+    return check.returncode == 0
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Remove duplicate lines of a large file with hash partitioning.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (
+        ("dedup", "Write the distinct lines of a file."),
+        ("compare", "Compare time, temp space and output with LC_ALL=C sort -u."),
+    ):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("input", help="Input file (.gz or plain).")
+        sub.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes.")
+        sub.add_argument(
+            "--partitions", type=int, default=DEFAULT_PARTITIONS, help="Number of hash partitions (buckets) on disk."
+        )
+        sub.add_argument(
+            "--memory_mb",
+            type=int,
+            default=DEFAULT_MEMORY >> 20,
+            help="Memory budget of all processes for deduplicating partitions or fingerprint buckets; "
+            "larger ones are split.",
+        )
+        sub.add_argument("--keep_order", action="store_true", help="Keep the first occurrences in input order.")
+        sub.add_argument(
+            "--fingerprint_bits",
+            type=int,
+            choices=[64, 128],
+            default=DEFAULT_FINGERPRINT_BITS,
+            help="Fingerprint size for --keep_order.",
+        )
+        if command == "dedup":
+            sub.add_argument("-o", "--output", required=True, help="Output file.")
+            sub.add_argument("--spill_dir", help="Directory for temporary partitions (default: next to the output).")
+            sub.add_argument("--stats", help="Write the statistics as JSON.")
+        else:
+            sub.add_argument("--work_dir", default="dedup_compare", help="Directory for outputs and temp files.")
+            sub.add_argument("--sort_buffer", help="Memory limit of sort -u, e.g. 1G (sort's default otherwise).")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    dedup_args = dict(
+        n_partitions=args.partitions,
+        memory_budget=args.memory_mb << 20,
+        keep_order=args.keep_order,
+        bits=args.fingerprint_bits,
+    )
+    if args.command == "dedup":
+        spill_dir = args.spill_dir or f"{args.output}.partitions"
+        stats = dedup(args.input, args.output, spill_dir, args.workers, **dedup_args)
+        if args.stats:
+            with open(args.stats, "w", encoding="utf-8") as f:
+                json.dump(stats.as_dict(), f, indent=1)
+    elif not compare_with_sort(args.input, args.work_dir, args.workers, args.sort_buffer, **dedup_args):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
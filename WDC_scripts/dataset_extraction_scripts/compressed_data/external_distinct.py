@@ -0,0 +1,263 @@
+import argparse
+import glob
+import hashlib
+import logging
+import math
+import os
+import uuid
+import zlib
+from collections import defaultdict
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+DEFAULT_PARTITIONS = 256
+DEFAULT_BUFFER = 64 << 20
+DEFAULT_MEMORY = 4 << 30
+# Estimated peak memory of a Python set of the lines of a spill file, per byte of the file
+SET_OVERHEAD = 3
+MAX_DEPTH = 4
+
+
+def partition_of(key, n_partitions, level=0):
+    """
+    Partition of ``key`` (bytes). The top level uses crc32 for speed; splitting
+    an oversized partition needs a hash independent of it, so deeper levels
+    use a salted blake2b.
+    """
+    if level == 0:
+        return zlib.crc32(key) % n_partitions
+    digest = hashlib.blake2b(key, digest_size=8, salt=level.to_bytes(16, "little")).digest()
+    return int.from_bytes(digest, "little") % n_partitions
+
+
+class HashPartitioner:
+    """
+    Spreads byte-string lines over ``n_partitions`` spill files by a hash of
+    their key, so that all lines with the same key end up in the same, much
+    smaller, partition. Lines are buffered in memory and appended to the
+    partition files whenever ``buffer_bytes`` are buffered.
+
+    Several partitioners, e.g. one per worker, may write to the same
+    ``spill_dir`` and ``name``: each writes its own files,
+    ``{name}.{partition:05d}.{uid}``, and ``partition_files`` collects them all.
+    """
+
+    def __init__(self, spill_dir, name, n_partitions=DEFAULT_PARTITIONS, buffer_bytes=DEFAULT_BUFFER, level=0):
+        self.spill_dir = spill_dir
+        self.name = name
+        self.n_partitions = n_partitions
+        self.buffer_bytes = buffer_bytes
+        self.level = level
+        self.uid = uuid.uuid4().hex[:12]
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.paths = {}
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def add(self, line, key=None):
+        """Add ``line`` (bytes without newline), partitioned by ``key`` or by the line itself."""
+        partition = partition_of(line if key is None else key, self.n_partitions, self.level)
+        self.buffers[partition].append(line)
+        self.buffered += len(line) + 1
+        if self.buffered >= self.buffer_bytes:
+            self.flush()
+
+    def extend(self, partition, data):
+        """Add lines already assigned to ``partition``, joined by newlines (see ``partition_block``)."""
+        self.buffers[partition].append(data)
+        self.buffered += len(data) + 1
+        if self.buffered >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        for partition, lines in self.buffers.items():
+            path = self.paths.get(partition)
+            if path is None:
+                path = self.paths[partition] = os.path.join(
+                    self.spill_dir, f"{self.name}.{partition:05d}.{self.uid}"
+                )
+            with open(path, "ab") as f:
+                f.write(b"\n".join(lines) + b"\n")
+        self.buffers.clear()
+        self.buffered = 0
+
+    def close(self):
+        """Flush the buffers; returns ``{partition: path}`` of the files written."""
+        self.flush()
+        return self.paths
+
+
+def partition_block(block, n_partitions, level=0):
+    """
+    Group the distinct lines of a block of newline-separated lines by
+    partition, as ``{partition: lines joined by newlines}`` for
+    ``HashPartitioner.extend``. Runs in workers, so the main process only
+    appends the groups to the spill files.
+    """
+    groups = defaultdict(list)
+    for line in dict.fromkeys(block.split(b"\n")[:-1] if block.endswith(b"\n") else block.split(b"\n")):
+        groups[partition_of(line, n_partitions, level)].append(line)
+    return {partition: b"\n".join(lines) for partition, lines in groups.items()}
+
+
+def partition_files(spill_dir, name):
+    """``{partition: [paths]}`` of all spill files of ``name`` in ``spill_dir``."""
+    files = defaultdict(list)
+    for path in glob.glob(os.path.join(glob.escape(spill_dir), f"{glob.escape(name)}.*.*")):
+        partition = os.path.basename(path)[len(name) + 1:].split(".", 1)[0]
+        if partition.isdigit():
+            files[int(partition)].append(path)
+    return dict(sorted(files.items()))
+
+
+def split_partition(paths, spill_dir, name, n_partitions, level, key=None):
+    """
+    Re-partition the lines of ``paths`` with the independent hash of ``level``.
+    ``key(line)`` gives the partition key (the whole line by default).
+    Returns ``{partition: path}`` of the new files.
+    """
+    partitioner = HashPartitioner(spill_dir, name, n_partitions, level=level)
+    for path in paths:
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.rstrip(b"\n")
+                partitioner.add(line, None if key is None else key(line))
+    return partitioner.close()
+
+
+def iter_fitting_partitions(paths, memory_budget, spill_dir, name, level=0, key=None):
+    """
+    Yield ``(paths, temporary)`` for groups of spill files whose lines fit into
+    ``memory_budget`` as a set, splitting oversized partitions recursively.
+    Temporary groups are files of such a split, which the caller removes after
+    use. A partition that does not shrink when split, i.e. mostly copies of a
+    few keys, is yielded as it is, since its set stays small.
+    """
+    size = sum(os.path.getsize(path) for path in paths)
+    if size * SET_OVERHEAD <= memory_budget or level >= MAX_DEPTH:
+        yield paths, level > 0
+        return
+    n_split = max(2, math.ceil(size * SET_OVERHEAD / memory_budget) + 1)
+    split_name = f"{name}-split{level + 1}"
+    split = split_partition(paths, spill_dir, split_name, n_split, level + 1, key)
+    if level > 0:
+        for path in paths:
+            os.remove(path)
+    if len(split) == 1:
+        yield list(split.values()), True
+        return
+    for partition, path in sorted(split.items()):
+        yield from iter_fitting_partitions([path], memory_budget, spill_dir, f"{split_name}.{partition}", level + 1, key)
+
+
+def _count_partition(task):
+    paths, memory_budget, spill_dir, name = task
+    count = 0
+    for group, temporary in iter_fitting_partitions(paths, memory_budget, spill_dir, name):
+        distinct = set()
+        for path in group:
+            with open(path, "rb") as f:
+                distinct.update(f)
+        count += len(distinct)
+        if temporary:
+            for path in group:
+                os.remove(path)
+    return count
+
+
+def count_distinct(spill_dir, name, n_jobs=1, memory_budget=DEFAULT_MEMORY):
+    """
+    Exact number of distinct lines in the spill files of ``name``. The
+    partitions are deduplicated in memory by ``n_jobs`` processes, each within
+    ``memory_budget / n_jobs``.
+    """
+    files = partition_files(spill_dir, name)
+    budget = memory_budget // max(1, n_jobs)
+    tasks = [(paths, budget, spill_dir, f"{name}-{partition:05d}") for partition, paths in files.items()]
+    if n_jobs <= 1:
+        counts = map(_count_partition, tasks)
+        return sum(tqdm(counts, total=len(tasks), desc=f"Counting {name}"))
+    with Pool(n_jobs) as pool:
+        return sum(tqdm(pool.imap_unordered(_count_partition, tasks), total=len(tasks), desc=f"Counting {name}"))
+
+
+class ExternalDistinct:
+    """
+    Exact distinct count of str or bytes items without holding them in memory.
+
+    Items are hash-partitioned into spill files while streaming; ``len``
+    deduplicates each partition in memory, in parallel and within
+    ``memory_budget`` bytes, and sums the counts. ``add``, ``update`` and
+    ``len`` follow ``set``, so a counter can stand in for a set that is only
+    used to count its distinct elements. ``update`` with another counter of the
+    same ``name`` takes over its spill files, so workers can count separately
+    and combine their counters at the end. Items must not contain newlines.
+    """
+
+    def __init__(
+        self,
+        spill_dir,
+        name,
+        n_partitions=DEFAULT_PARTITIONS,
+        buffer_bytes=DEFAULT_BUFFER,
+        n_jobs=1,
+        memory_budget=DEFAULT_MEMORY,
+    ):
+        self.spill_dir = os.path.join(spill_dir, name)
+        self.name = name
+        self.n_jobs = n_jobs
+        self.memory_budget = memory_budget
+        self.partitioner = HashPartitioner(self.spill_dir, name, n_partitions, buffer_bytes)
+        self.count = None
+
+    def add(self, item):
+        self.partitioner.add(item.encode("utf-8") if isinstance(item, str) else item)
+        self.count = None
+
+    def update(self, items):
+        if isinstance(items, ExternalDistinct):
+            if items.spill_dir != self.spill_dir:
+                raise ValueError(f"Cannot combine the counters of {items.spill_dir} and {self.spill_dir}")
+            # Counters of the same name share the spill directory, so flushing is enough
+            items.partitioner.close()
+            self.count = None
+            return
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        if self.count is None:
+            self.partitioner.close()
+            self.count = count_distinct(self.spill_dir, self.name, self.n_jobs, self.memory_budget)
+        return self.count
+
+    def cleanup(self):
+        """Remove the spill files of every counter of this name."""
+        for paths in partition_files(self.spill_dir, self.name).values():
+            for path in paths:
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Count the distinct lines of files exactly in bounded memory.")
+    parser.add_argument("files", nargs="+", help="Input files (.gz or plain), one key per line.")
+    parser.add_argument("--spill_dir", required=True, help="Directory for the partition files.")
+    parser.add_argument("--partitions", type=int, default=DEFAULT_PARTITIONS, help="Number of partitions.")
+    parser.add_argument("--n_jobs", type=int, default=os.cpu_count(), help="Processes deduplicating partitions.")
+    parser.add_argument("--memory_mb", type=int, default=DEFAULT_MEMORY >> 20, help="Memory budget of all processes.")
+    args = parser.parse_args()
+
+    from transform_triples import iter_blocks
+
+    counter = ExternalDistinct(
+        args.spill_dir, "lines", args.partitions, n_jobs=args.n_jobs, memory_budget=args.memory_mb << 20
+    )
+    for path in args.files:
+        for block in iter_blocks(path):
+            counter.update(block.rstrip(b"\n").split(b"\n"))
+    logging.info(f"Distinct lines: {len(counter)}")
+    counter.cleanup()
@@ -0,0 +1,240 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+
+import numpy as np
+
+DEFAULT_PRECISION = 14
+TOTAL = "all"
+FORMAT_PATTERN = re.compile(r"dpef\.(.+?)\.nq")
+
+
+def hash_items(items):
+    """64-bit hashes of str or bytes items, stable across processes and machines."""
+    digests = b"".join(
+        hashlib.blake2b(item.encode("utf-8") if isinstance(item, str) else item, digest_size=8).digest()
+        for item in items
+    )
+    return np.frombuffer(digests, dtype="<u8")
+
+
+class HyperLogLog:
+    """
+    HyperLogLog estimate of the number of distinct items, with ``2 ** precision``
+    one-byte registers. Sketches of the same precision merge by taking the
+    register-wise maximum, so per-rank sketches combine into the sketch of the
+    union without access to the items.
+
+    The relative standard error is ``1.04 / sqrt(2 ** precision)``: 0.81% for
+    the default precision 14 (16 KB per sketch), 0.41% for 16 (64 KB). About
+    95% of the estimates fall within two standard errors. Small cardinalities
+    use linear counting and are nearly exact; the 64-bit hashes make the
+    large-range correction of 32-bit HyperLogLog unnecessary up to ~10^18
+    items.
+
+    ``update`` and ``len`` follow ``set``, so a sketch can stand in for a set
+    that is only used to count its distinct elements.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        # The rank computation below needs at most 53 bits after the register index
+        if not 11 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 11 and 18, got {precision}")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8) if registers is None else registers
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return
+        width = 64 - self.precision
+        index = (hashes >> np.uint64(width)).astype(np.intp)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Position of the leftmost 1 bit of the remaining bits; frexp is exact below 2**53
+        rank = (width + 1 - np.frexp(rest.astype(np.float64))[1]).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def update(self, items, batch_size=1 << 16):
+        if isinstance(items, HyperLogLog):
+            self.merge(items)
+            return
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self.add_hashes(hash_items(batch))
+                batch = []
+        self.add_hashes(hash_items(batch))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError(f"Cannot merge HyperLogLog sketches of precision {self.precision} and {other.precision}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int64)).sum()
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return raw
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+
+class TripleSketch:
+    """Exact triple count and HyperLogLog sketches of the entities (columns 1 and 3) and relations (column 2)."""
+
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.triples = 0
+        self.entities = HyperLogLog(precision)
+        self.relations = HyperLogLog(precision)
+
+    def add_block(self, block):
+        """Add a block of newline-terminated triple lines, split into fields like ``awk``."""
+        entities, relations = set(), set()
+        for line in block.split(b"\n"):
+            fields = line.split(None, 3)
+            if not fields:
+                continue
+            self.triples += 1
+            entities.add(fields[0])
+            if len(fields) > 1:
+                relations.add(fields[1])
+            if len(fields) > 2:
+                entities.add(fields[2])
+        self.entities.update(entities)
+        self.relations.update(relations)
+
+    def merge(self, other):
+        self.triples += other.triples
+        self.entities.merge(other.entities)
+        self.relations.merge(other.relations)
+        return self
+
+
+def file_format(path):
+    """WDC format of a file, e.g. ``html-embedded-jsonld`` for ``dpef.html-embedded-jsonld.nq-00000.gz``."""
+    match = FORMAT_PATTERN.search(os.path.basename(path))
+    return match.group(1) if match else os.path.basename(path).split(".")[0]
+
+
+def merge_sketches(target, sketches):
+    """Merge ``{format: TripleSketch}`` into ``target`` in place."""
+    for name, sketch in sketches.items():
+        if name in target:
+            target[name].merge(sketch)
+        else:
+            target[name] = sketch
+    return target
+
+
+def save_sketches(path, sketches):
+    """Store ``{format: TripleSketch}`` in one small ``.npz``."""
+    arrays = {}
+    for name, sketch in sketches.items():
+        arrays[f"triples/{name}"] = np.array(sketch.triples, dtype=np.int64)
+        arrays[f"entities/{name}"] = sketch.entities.registers
+        arrays[f"relations/{name}"] = sketch.relations.registers
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def load_sketches(path):
+    sketches = {}
+    with np.load(path) as data:
+        for key in data.files:
+            kind, name = key.split("/", 1)
+            if kind != "triples":
+                continue
+            entities = data[f"entities/{name}"]
+            sketch = TripleSketch(int(entities.size).bit_length() - 1)
+            sketch.triples = int(data[key])
+            sketch.entities.registers = entities.copy()
+            sketch.relations.registers = data[f"relations/{name}"].copy()
+            sketches[name] = sketch
+    return sketches
+
+
+def summarize(sketches):
+    """Per-format and total counts with the standard error of the estimates."""
+    total = None
+    summary = {}
+    for name in sorted(sketches):
+        sketch = sketches[name]
+        total = TripleSketch(sketch.entities.precision).merge(sketch) if total is None else total.merge(sketch)
+        summary[name] = _counts(sketch)
+    if total is not None:
+        summary[TOTAL] = _counts(total)
+    return summary
+
+
+def _counts(sketch):
+    return {
+        "triples": sketch.triples,
+        "unique_entities": len(sketch.entities),
+        "unique_relations": len(sketch.relations),
+        "relative_standard_error": round(sketch.entities.relative_error, 5),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Sketch and merge approximate distinct entity/relation counts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sketch_parser = subparsers.add_parser("sketch", help="Sketch triple files; the format is taken from each file name.")
+    sketch_parser.add_argument("files", nargs="+", help="Triple files (.gz or plain).")
+    sketch_parser.add_argument("-o", "--output", required=True, help="Output sketch file (.npz).")
+    sketch_parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION, help="log2 of the register count.")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge sketch files and report the counts.")
+    merge_parser.add_argument("files", nargs="+", help="Sketch files or glob patterns.")
+    merge_parser.add_argument("-o", "--output", help="Write the counts as JSON.")
+    merge_parser.add_argument("--merged_sketch", help="Also store the merged sketch.")
+
+    args = parser.parse_args()
+    if args.command == "sketch":
+        from transform_triples import iter_blocks
+
+        sketches = {}
+        for path in args.files:
+            sketch = TripleSketch(args.precision)
+            for block in iter_blocks(path):
+                sketch.add_block(block)
+            merge_sketches(sketches, {file_format(path): sketch})
+        save_sketches(args.output, sketches)
+    else:
+        sketches = {}
+        paths = sorted(path for pattern in args.files for path in glob.glob(pattern))
+        for path in paths:
+            merge_sketches(sketches, load_sketches(path))
+        summary = summarize(sketches)
+        logging.info(f"Merged {len(paths)} sketch files")
+        for name, counts in summary.items():
+            logging.info(
+                f"{name}: {counts['triples']} triples, ~{counts['unique_entities']} unique entities, "
+                f"~{counts['unique_relations']} unique relations "
+                f"(relative standard error {counts['relative_standard_error']:.2%})"
+            )
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(summary, f, indent=1)
+        if args.merged_sketch:
+            save_sketches(args.merged_sketch, sketches)
@@ -0,0 +1,212 @@
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+from tqdm import tqdm
+
+INDEX_SUFFIX = ".lineidx"
+DEFAULT_STRIDE = 1 << 16
+READ_SIZE = 64 << 20
+COPY_SIZE = 16 << 20
+
+
+def index_path(path, index_dir=None):
+    """Location of the line-offset sidecar of ``path``."""
+    if index_dir is None:
+        return path + INDEX_SUFFIX
+    return os.path.join(index_dir, os.path.basename(path) + INDEX_SUFFIX)
+
+
+class LineIndex:
+    """
+    Byte offsets of every ``stride``-th line of a text file (``offsets[k]`` is
+    where line ``k * stride`` starts, counting from 0), with the exact line
+    count and the size and modification time the index was built for. A final
+    line without a trailing newline is counted as a line.
+    """
+
+    def __init__(self, offsets, stride, lines, size, mtime_ns):
+        self.offsets = offsets
+        self.stride = stride
+        self.lines = lines
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def matches(self, path):
+        stat = os.stat(path)
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime_ns
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                offsets=self.offsets,
+                meta=np.array([self.stride, self.lines, self.size, self.mtime_ns], dtype=np.int64),
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            stride, lines, size, mtime_ns = (int(value) for value in data["meta"])
+            return cls(data["offsets"], stride, lines, size, mtime_ns)
+
+    def offset(self, f, line):
+        """Byte offset where ``line`` starts in the open binary file ``f`` (the file size past the last line)."""
+        if line >= self.lines:
+            return self.size
+        k = line // self.stride
+        return _skip_lines(f, int(self.offsets[k]), line - k * self.stride)
+
+
+def _skip_lines(f, offset, n_lines):
+    """Offset reached by skipping ``n_lines`` lines from ``offset``."""
+    f.seek(offset)
+    while n_lines > 0:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        newlines = data.count(b"\n")
+        if newlines < n_lines:
+            offset += len(data)
+            n_lines -= newlines
+            continue
+        positions = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+        return offset + int(positions[n_lines - 1]) + 1
+    return offset
+
+
+def build_index(path, index_dir=None, stride=DEFAULT_STRIDE):
+    """
+    Record the offset of every ``stride``-th line of ``path`` in one sequential
+    pass and store it as a sidecar next to the file, or in ``index_dir``. A
+    sidecar built for the current size and modification time is reused.
+    """
+    sidecar = index_path(path, index_dir)
+    if os.path.exists(sidecar):
+        index = LineIndex.load(sidecar)
+        if index.stride == stride and index.matches(path):
+            return index
+    stat = os.stat(path)
+    offsets = [np.zeros(1, dtype=np.int64)]
+    lines = 0
+    position = 0
+    last = b"\n"
+    with open(path, "rb") as f, tqdm(total=stat.st_size, unit="B", unit_scale=True, desc="Indexing lines") as progress:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            newlines = data.count(b"\n")
+            # Lines lines + 1 ... lines + newlines start after the newlines of this block
+            first = -lines % stride or stride
+            if first <= newlines:
+                positions = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+                offsets.append(position + positions[first - 1::stride].astype(np.int64) + 1)
+            lines += newlines
+            position += len(data)
+            last = data[-1:]
+            progress.update(len(data))
+    offsets = np.concatenate(offsets)
+    if last != b"\n":
+        lines += 1
+    # An offset at the very end of the file does not start a line
+    offsets = offsets[offsets < max(position, 1)]
+    index = LineIndex(offsets, stride, lines, stat.st_size, stat.st_mtime_ns)
+    if index_dir is not None:
+        os.makedirs(index_dir, exist_ok=True)
+    index.save(sidecar)
+    logging.info(f"Indexed {lines} lines of {path} with {len(offsets)} offsets")
+    return index
+
+
+def load_index(path, index_dir=None):
+    """The sidecar index of ``path``, or None if there is none or it is out of date."""
+    sidecar = index_path(path, index_dir)
+    if not os.path.exists(sidecar):
+        return None
+    index = LineIndex.load(sidecar)
+    if not index.matches(path):
+        logging.warning(f"Ignoring the line index {sidecar}, which is older than {path}")
+        return None
+    return index
+
+
+def line_count(path, index_dir=None):
+    """Exact line count of ``path`` from its sidecar, or None without an up-to-date sidecar."""
+    index = load_index(path, index_dir)
+    return None if index is None else index.lines
+
+
+def line_range(path, start_line, n_lines, index_dir=None):
+    """
+    Byte range ``(start, end)`` of lines ``[start_line, start_line + n_lines)``.
+    With a sidecar only the lines after the nearest indexed ones are read;
+    without one the file is scanned from the start.
+    """
+    index = load_index(path, index_dir)
+    with open(path, "rb") as f:
+        if index is None:
+            logging.warning(f"No line index for {path}; scanning from the start (build one with 'line_index.py build')")
+            start = _skip_lines(f, 0, start_line)
+            return start, _skip_lines(f, start, n_lines)
+        return index.offset(f, start_line), index.offset(f, start_line + n_lines)
+
+
+def copy_range(path, start, end, output):
+    """Copy bytes ``[start, end)`` of ``path`` to the binary file ``output``."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(remaining, COPY_SIZE))
+            if not data:
+                break
+            output.write(data)
+            remaining -= len(data)
+
+
+def extract_lines(path, start_line, n_lines, output_path, index_dir=None):
+    """Write lines ``[start_line, start_line + n_lines)`` of ``path`` to ``output_path``."""
+    start, end = line_range(path, start_line, n_lines, index_dir)
+    with open(output_path, "wb") as out:
+        copy_range(path, start, end, out)
+    return end - start
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Sparse line-offset index for seeking to line ranges of large files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index a file once, writing the sidecar next to it.")
+    build_parser.add_argument("file", help="Text file.")
+    build_parser.add_argument("--stride", type=int, default=DEFAULT_STRIDE, help="Record every stride-th line.")
+    build_parser.add_argument("--index_dir", default=None, help="Directory for the sidecar.")
+
+    count_parser = subparsers.add_parser("count", help="Print the exact line count from the sidecar.")
+    count_parser.add_argument("file", help="Text file.")
+    count_parser.add_argument("--index_dir", default=None, help="Directory of the sidecar.")
+
+    extract_parser = subparsers.add_parser("extract", help="Write a range of lines to a file.")
+    extract_parser.add_argument("file", help="Text file.")
+    extract_parser.add_argument("start_line", type=int, help="First line, counting from 0.")
+    extract_parser.add_argument("n_lines", type=int, help="Number of lines.")
+    extract_parser.add_argument("-o", "--output", required=True, help="Output file.")
+    extract_parser.add_argument("--index_dir", default=None, help="Directory of the sidecar.")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.file, args.index_dir, args.stride)
+    elif args.command == "count":
+        lines = line_count(args.file, args.index_dir)
+        if lines is None:
+            sys.exit(f"No up-to-date line index for {args.file}; run 'line_index.py build' first")
+        print(lines)
+    else:
+        size = extract_lines(args.file, args.start_line, args.n_lines, args.output, args.index_dir)
+        logging.info(f"Extracted {size / (1 << 20):.1f} MB of lines {args.start_line}+{args.n_lines} to {args.output}")
@@ -14,6 +14,9 @@ fi
 wget -i http://webdatacommons.org/structureddata/2023-12/files/file.list -P "$SOURCE_DIR"
 
 TARGET_DIR="compressed_data"
+# Directory of the Python helpers (next to the data, relative to the working directory); under
+# sbatch $0 is a copy in the spool directory, so it cannot be used to find them
+SCRIPT_DIR="${SCRIPT_DIR:-$TARGET_DIR}"
 LOG_DIR="$TARGET_DIR/logs"
 TEMP_DIR="$TARGET_DIR/temps"
 COUNT_DIR="$TARGET_DIR/counts"
@@ -22,6 +25,15 @@ LOG_FILE="$LOG_DIR/mpi_process_$SLURM_PROCID.log"
 ENTITY_FILE="$COUNT_DIR/entities_$SLURM_PROCID.txt"
 RELATION_FILE="$COUNT_DIR/relations_$SLURM_PROCID.txt"
 TRIPLE_COUNT_FILE="$COUNT_DIR/triple_count_$SLURM_PROCID.txt"
+TRANSFORM_WORKERS="${SLURM_CPUS_PER_TASK:-1}"
+SKETCH_FILE="$COUNT_DIR/sketch_$SLURM_PROCID.npz"
+# exact: sorted lists of unique entities and relations; approximate: HyperLogLog
+# sketches built while transforming (~0.8% relative standard error, no lists)
+COUNT_MODE="${COUNT_MODE:-exact}"
+SKETCH_ARGS=()
+if [ "$COUNT_MODE" = "approximate" ]; then
+  SKETCH_ARGS=(--sketch "$SKETCH_FILE")
+fi
 
 # Create directories if they don't exist
 mkdir -p "$LOG_DIR"
@@ -53,23 +65,26 @@ temp_file="$TEMP_DIR/combined_file_$SLURM_PROCID.txt"
 : > "$ENTITY_FILE"
 : > "$RELATION_FILE"
 : > "$TRIPLE_COUNT_FILE"
+rm -f "$SKETCH_FILE"
 
 # Process the files assigned to this process
 for ((i=$start_index; i<$end_index; i++)); do
   gz_file="${all_files[$i]}"
   echo "Process $SLURM_PROCID processing file: $gz_file" >> "$LOG_FILE"
-  uncompressed_size=$(gzip -l "$gz_file" | awk 'NR==2 {print $2}')
-  gunzip -c "$gz_file" | \
-  pv -s $uncompressed_size | \
-  sed -e "/['\"][^'\"]*['\"]/d" \
-      -e 's/\([[:space:]]\|^\)_:\([a-zA-Z0-9]*\)/\1<http:\/\/whale.data.dice-research.org\/resource#\2>/g' | \
-  awk '{if (NF > 3) print $0 | "sed -e \"s/ <[^>]*>\\s*.$/ ./g\""; else print $0}' >> "$temp_file"
+  # Drops literals, skolemizes blank nodes and strips the graph label in one pass,
+  # byte-identical to the former gunzip | sed | awk | sed chain. Per CPU second it is
+  # slower than the chain (about 13 against 30 MB on a sample with many literals and
+  # blank nodes), so it only finishes sooner with several SLURM_CPUS_PER_TASK workers
+  python "$SCRIPT_DIR/transform_triples.py" transform "$gz_file" -o "$temp_file" --append \
+    --workers "$TRANSFORM_WORKERS" "${SKETCH_ARGS[@]}"
 done
 
-# Count unique entities (from 1st and 3rd columns), unique relations (from 2nd column), and total triples
-awk '{print $1 "\n" $3}' $temp_file | sort | uniq > "$ENTITY_FILE"    # Extract and count unique entities
-awk '{print $2}' $temp_file | sort | uniq > "$RELATION_FILE"          # Extract and count unique relations
-awk 'END {print NR}' $temp_file > "$TRIPLE_COUNT_FILE"                # Count total triples
+if [ "$COUNT_MODE" != "approximate" ]; then
+  # Count unique entities (from 1st and 3rd columns), unique relations (from 2nd column), and total triples
+  awk '{print $1 "\n" $3}' $temp_file | sort | uniq > "$ENTITY_FILE"    # Extract and count unique entities
+  awk '{print $2}' $temp_file | sort | uniq > "$RELATION_FILE"          # Extract and count unique relations
+  awk 'END {print NR}' $temp_file > "$TRIPLE_COUNT_FILE"                # Count total triples
+fi
 
 echo "Process $SLURM_PROCID completed processing file" >> "$LOG_FILE"
 
@@ -77,7 +92,27 @@ echo "Process $SLURM_PROCID completed processing file" >> "$LOG_FILE"
 wait
 
 # Combine results into the final file by the root process
-if [ $SLURM_PROCID -eq 0 ]; then
+if [ $SLURM_PROCID -eq 0 ] && [ "$COUNT_MODE" = "approximate" ]; then
+  echo "Combining files by process $SLURM_PROCID" >> "$LOG_FILE"
+  : > "$COMBINED_FILE"
+  for proc in $(seq 0 $((SLURM_NTASKS - 1))); do
+    if [ -f "$TEMP_DIR/combined_file_$proc.txt" ]; then
+      cat "$TEMP_DIR/combined_file_$proc.txt" >> "$COMBINED_FILE"
+    fi
+  done
+
+  # Merging the per-rank sketches replaces sorting the entity and relation lists;
+  # the counts of every format and of all formats are logged and stored as JSON
+  python "$SCRIPT_DIR/hyperloglog.py" merge "$COUNT_DIR/sketch_*.npz" \
+    -o "$TARGET_DIR/approximate_counts.json" 2>> "$LOG_FILE"
+  total_triples=$(python -c "import json, sys; print(json.load(open(sys.argv[1]))['all']['triples'])" \
+    "$TARGET_DIR/approximate_counts.json")
+  echo $total_triples > "$TARGET_DIR/total_triples.txt"
+
+  echo "Extraction, editing, and combination completed." >> "$LOG_FILE"
+  echo "Total number of files processed: $total_files" >> "$LOG_FILE"
+  echo "Total number of triples: $total_triples" >> "$LOG_FILE"
+elif [ $SLURM_PROCID -eq 0 ]; then
   echo "Combining files by process $SLURM_PROCID" >> "$LOG_FILE"
   : > "$COMBINED_FILE"
   : > "$TARGET_DIR/unique_entities.txt"
@@ -2,6 +2,12 @@
 
 # Assumes SOURCE_FILE is exported or defined in the environment
 SOURCE_FILE="mpi_combined_file.txt"
+# Index SOURCE_FILE once before submitting, so each rank seeks to its range instead of reading all lines before it:
+#   python line_index.py build mpi_combined_file.txt
+# Directory of the Python helpers (the working directory, like SOURCE_FILE); under sbatch
+# $0 is a copy in the spool directory, so it cannot be used to find them
+SCRIPT_DIR="${SCRIPT_DIR:-.}"
+LINE_INDEX_SCRIPT="${LINE_INDEX_SCRIPT:-$SCRIPT_DIR/line_index.py}"
 OUTPUT_DIR="extract_triples"
 LOG_DIR="${OUTPUT_DIR}/logs"
 mkdir -p "$LOG_DIR" "$OUTPUT_DIR"
@@ -14,12 +20,12 @@ extract_triples() {
     local log_file="${LOG_DIR}/extract_${index_suffix}.log"
 
     echo "Starting extraction of ranges from $start_line to $((start_line + num_lines - 1)) at $(date)" > "$log_file"
-    tail -n +$((start_line + 1)) "$SOURCE_FILE" | head -n $num_lines > "$output_file"
+    python "$LINE_INDEX_SCRIPT" extract "$SOURCE_FILE" $start_line $num_lines -o "$output_file" 2>> "$log_file"
     echo "Completed extraction at $(date)" >> "$log_file"
 }
 
 export -f extract_triples
-export SOURCE_FILE OUTPUT_DIR LOG_DIR
+export SOURCE_FILE OUTPUT_DIR LOG_DIR LINE_INDEX_SCRIPT
 
 ROWS_PER_FILE=500000000
 
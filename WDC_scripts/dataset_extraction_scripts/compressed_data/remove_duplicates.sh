@@ -4,17 +4,29 @@ INPUT_FILE="mpi_combined_file.txt"
 OUTPUT_FILE="mpi_combined_file_unique.txt"
 TEMP_FILE="temp_sorted_file.txt"
 LOG_FILE="remove_duplicates.log"
+STATS_FILE="remove_duplicates_stats.json"
+# Directory of the Python helpers (the working directory, like the input); under sbatch
+# $0 is a copy in the spool directory, so it cannot be used to find them
+SCRIPT_DIR="${SCRIPT_DIR:-.}"
+DEDUP_SCRIPT="${DEDUP_SCRIPT:-$SCRIPT_DIR/dedup_lines.py}"
+DEDUP_WORKERS="${SLURM_CPUS_PER_TASK:-$(nproc)}"
+# Set KEEP_ORDER=1 to keep the first occurrences in input order (two passes, 24 bytes of temp space per line)
+DEDUP_ARGS=()
+if [ -n "$KEEP_ORDER" ]; then
+    DEDUP_ARGS=(--keep_order)
+fi
 
 echo "Starting deduplication process at $(date)" > "$LOG_FILE"
 echo "Input file: $INPUT_FILE" >> "$LOG_FILE"
 
-echo "Sorting and removing duplicates..." >> "$LOG_FILE"
-pv "$INPUT_FILE" | LC_ALL=C sort -u > "$TEMP_FILE" && mv "$TEMP_FILE" "$OUTPUT_FILE"
+echo "Removing duplicates with hash partitioning..." >> "$LOG_FILE"
+python "$DEDUP_SCRIPT" dedup "$INPUT_FILE" -o "$TEMP_FILE" --workers "$DEDUP_WORKERS" \
+    --stats "$STATS_FILE" "${DEDUP_ARGS[@]}" && mv "$TEMP_FILE" "$OUTPUT_FILE"
 
 if [ $? -eq 0 ]; then
     echo "Deduplication completed successfully at $(date)" >> "$LOG_FILE"
     echo "Output file: $OUTPUT_FILE" >> "$LOG_FILE"
-    wc -l "$OUTPUT_FILE" >> "$LOG_FILE"
+    cat "$STATS_FILE" >> "$LOG_FILE"
 else
     echo "An error occurred during the deduplication process" >> "$LOG_FILE"
 fi
@@ -0,0 +1,292 @@
+import argparse
+import gzip
+import logging
+import os
+import re
+import resource
+import shlex
+import subprocess
+import sys
+import time
+from collections import deque
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+from hyperloglog import DEFAULT_PRECISION, TripleSketch, file_format, load_sketches, merge_sketches, save_sketches
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+SKOLEM_PREFIX = "http://whale.data.dice-research.org/resource#"
+BLOCK_SIZE = 16 << 20
+
+# The sed/awk chain of mpi_extract_and_combine.sh that this script replaces. There,
+# awk prints lines with at most three fields itself and pipes all others into a
+# second sed whose output races with awk's for the same file, which can splice
+# lines together. The reference below applies the same expressions in one pipe:
+# awk tags each line with its branch and the second sed only edits tagged lines.
+SHELL_CHAIN = (
+    "sed -e \"/['\\\"][^'\\\"]*['\\\"]/d\" "
+    "-e 's/\\([[:space:]]\\|^\\)_:\\([a-zA-Z0-9]*\\)/\\1<http:\\/\\/whale.data.dice-research.org\\/resource#\\2>/g' | "
+    "awk '{if (NF > 3) print \"1\" $0; else print \"0\" $0}' | "
+    "sed -e '/^1/s/ <[^>]*>\\s*.$/ ./g' -e 's/^.//'"
+)
+
+# sed: /['"][^'"]*['"]/d, i.e. every line with at least two quote characters
+QUOTED_LINE = re.compile(rb"""^[^'"\n]*['"][^'"\n]*['"].*\n""", re.M)
+# sed: s/\([[:space:]]\|^\)_:\([a-zA-Z0-9]*\)/\1<prefix\2>/g. Blocks start at a
+# line start and a newline before "_:" is kept, so no line-wise split is needed.
+BLANK_NODE = re.compile(rb"(\s|^)_:([a-zA-Z0-9]*)")
+# awk: NF > 3 with the default field separator, then sed: s/ <[^>]*>\s*.$/ ./
+CONTEXT = re.compile(
+    rb"^(?=[ \t]*[^ \t\n]+(?:[ \t]+[^ \t\n]+){3})(.*?) <[^>\n]*>[^\S\n]*.$", re.M
+)
+
+
+class TripleTransformer:
+    """
+    Byte-level equivalent of the ``sed | awk | sed`` chain that turns WDC
+    N-Quads into the triples of the combined file, applied to whole blocks of
+    lines at once:
+
+    * ``drop_literals``: drop every line with two or more quote characters,
+    * ``skolemize``: rewrite blank nodes ``_:id`` to ``<skolem_prefix + id>``,
+    * ``strip_context``: on lines with more than three fields, replace the
+      last IRI before the final character (the graph label and the dot) by ``.``.
+
+    Like ``awk``, the output terminates every line with a newline. Matching is
+    bytewise, as with ``LC_ALL=C``.
+    """
+
+    def __init__(self, drop_literals=True, skolemize=True, strip_context=True, skolem_prefix=SKOLEM_PREFIX):
+        self.drop_literals = drop_literals
+        self.skolemize = skolemize
+        self.strip_context = strip_context
+        self.skolem_replacement = b"\\1<" + skolem_prefix.encode("utf-8").replace(b"\\", b"\\\\") + b"\\2>"
+
+    def transform(self, block):
+        """Transform a block of complete lines."""
+        if block and not block.endswith(b"\n"):
+            block += b"\n"
+        if self.drop_literals:
+            block = QUOTED_LINE.sub(b"", block)
+        if self.skolemize and b"_:" in block:
+            block = BLANK_NODE.sub(self.skolem_replacement, block)
+        if self.strip_context:
+            block = CONTEXT.sub(rb"\1 .", block)
+        return block
+
+
+def iter_blocks(path, block_size=BLOCK_SIZE):
+    """Yield the decompressed content of ``path`` in blocks of whole lines."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        tail = b""
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            data = tail + data
+            cut = data.rfind(b"\n") + 1
+            if cut == 0:
+                tail = data
+                continue
+            tail = data[cut:]
+            yield data[:cut]
+        if tail:
+            yield tail
+
+
+def imap_bounded(pool, function, iterable, max_pending):
+    """
+    Like ``pool.imap``, but reads ``iterable`` at most ``max_pending`` items
+    ahead of the consumer, so large blocks never pile up in memory.
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+_transformer = None
+_precision = None
+
+
+def _init_worker(transformer, precision=None):
+    global _transformer, _precision
+    _transformer = transformer
+    _precision = precision
+
+
+def _transform(name, block):
+    result = _transformer.transform(block)
+    sketch = None
+    if _precision is not None:
+        sketch = TripleSketch(_precision)
+        sketch.add_block(result)
+    return len(block), result, name, sketch
+
+
+def transform_files(
+    paths, output, transformer, workers=1, block_size=BLOCK_SIZE, append=False, sketch_path=None, precision=DEFAULT_PRECISION
+):
+    """
+    Transform ``paths`` in order into ``output``. Blocks are transformed by a
+    pool of ``workers`` processes; at most ``2 * workers`` blocks are in flight
+    and results are written in input order. With ``sketch_path``, the workers
+    also sketch the output triples of each block, and the per-format sketches
+    are saved there (see ``hyperloglog.py``). Returns the number of input bytes.
+    """
+    blocks = ((file_format(path), block) for path in paths for block in iter_blocks(path, block_size))
+    initargs = (transformer, precision if sketch_path else None)
+    # Appending to the output also extends the sketches of the earlier files
+    sketches = load_sketches(sketch_path) if append and sketch_path and os.path.exists(sketch_path) else {}
+    consumed = 0
+    with open(output, "ab" if append else "wb") as out, tqdm(unit="B", unit_scale=True, desc="Transforming") as progress:
+
+        def write(size, result, name, sketch):
+            nonlocal consumed
+            out.write(result)
+            if sketch is not None:
+                merge_sketches(sketches, {name: sketch})
+            consumed += size
+            progress.update(size)
+
+        if workers <= 1:
+            _init_worker(*initargs)
+            for block in blocks:
+                write(*_transform(*block))
+        else:
+            with Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+                for result in imap_bounded(pool, _transform, blocks, 2 * workers):
+                    write(*result)
+    if sketch_path:
+        save_sketches(sketch_path, sketches)
+    return consumed
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _self_cpu():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_shell_chain(path, output):
+    """Run the original ``gunzip | sed | awk | sed`` chain on ``path`` (without ``pv``)."""
+    cat = "gunzip -c" if path.endswith(".gz") else "cat"
+    command = f"{cat} {shlex.quote(path)} | {SHELL_CHAIN} > {shlex.quote(output)}"
+    subprocess.run(["bash", "-c", command], check=True, env={**os.environ, "LC_ALL": "C"})
+
+
+def verify(paths, transformer, workers, work_dir):
+    """
+    Compare the output of the Python stage with the shell chain on sample files
+    and report the throughput of both per CPU second. Returns True if every
+    output matches.
+
+    The reference is the deterministic form of the shell chain in
+    ``SHELL_CHAIN``, so the outputs have to be byte-identical.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    ok = True
+    for path in paths:
+        name = os.path.basename(path)
+        shell_output = os.path.join(work_dir, f"{name}.shell.txt")
+        python_output = os.path.join(work_dir, f"{name}.python.txt")
+        size = sum(len(block) for block in iter_blocks(path))
+
+        cpu, start = _children_cpu(), time.perf_counter()
+        run_shell_chain(path, shell_output)
+        shell_wall, shell_cpu = time.perf_counter() - start, _children_cpu() - cpu
+
+        cpu, start = _children_cpu() + _self_cpu(), time.perf_counter()
+        transform_files([path], python_output, transformer, workers=workers)
+        python_wall, python_cpu = time.perf_counter() - start, _children_cpu() + _self_cpu() - cpu
+
+        with open(shell_output, "rb") as f:
+            expected = f.read()
+        with open(python_output, "rb") as f:
+            actual = f.read()
+        if expected == actual:
+            result = "identical"
+        else:
+            result = "DIFFERENT"
+            ok = False
+        mb = size / (1 << 20)
+        logging.info(
+            f"{name}: {mb:.1f} MB, output {result}; "
+            f"shell {mb / shell_wall:.1f} MB/s wall, {mb / shell_cpu:.1f} MB per CPU second; "
+            f"python ({workers} workers) {mb / python_wall:.1f} MB/s wall, {mb / python_cpu:.1f} MB per CPU second"
+        )
+    return ok
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Turn WDC N-Quads into combined-file triples: drop literals, skolemize blank nodes, strip the graph."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command, help_text in (
+        ("transform", "Transform .gz (or plain) files in order into one output file."),
+        ("verify", "Compare the output and throughput with the sed/awk chain on sample files."),
+    ):
+        sub = subparsers.add_parser(command, help=help_text)
+        sub.add_argument("files", nargs="+", help="Input N-Quads files.")
+        sub.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of transforming processes.")
+        sub.add_argument("--keep_literals", action="store_true", help="Keep the lines with quoted literals.")
+        sub.add_argument("--keep_blank_nodes", action="store_true", help="Do not skolemize _: blank nodes.")
+        sub.add_argument("--keep_context", action="store_true", help="Keep the graph label of quads.")
+        sub.add_argument("--skolem_prefix", default=SKOLEM_PREFIX, help="IRI prefix of skolemized blank nodes.")
+        if command == "transform":
+            sub.add_argument("-o", "--output", required=True, help="Output file.")
+            sub.add_argument("--append", action="store_true", help="Append to the output file.")
+            sub.add_argument(
+                "--sketch", help="Also write HyperLogLog sketches of the output entities and relations per format."
+            )
+            sub.add_argument(
+                "--precision", type=int, default=DEFAULT_PRECISION, help="log2 of the register count of the sketches."
+            )
+        else:
+            sub.add_argument("--work_dir", default="transform_verify", help="Directory for both outputs.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    transformer = TripleTransformer(
+        drop_literals=not args.keep_literals,
+        skolemize=not args.keep_blank_nodes,
+        strip_context=not args.keep_context,
+        skolem_prefix=args.skolem_prefix,
+    )
+    if args.command == "transform":
+        start = time.perf_counter()
+        size = transform_files(
+            args.files,
+            args.output,
+            transformer,
+            workers=args.workers,
+            append=args.append,
+            sketch_path=args.sketch,
+            precision=args.precision,
+        )
+        elapsed = time.perf_counter() - start
+        logging.info(f"Transformed {size / (1 << 20):.1f} MB in {elapsed:.1f}s ({size / (1 << 20) / elapsed:.1f} MB/s)")
+    else:
+        if args.keep_literals or args.keep_blank_nodes or args.keep_context or args.skolem_prefix != SKOLEM_PREFIX:
+            sys.exit("verify compares against the default shell chain; drop the --keep_* and --skolem_prefix options")
+        if not verify(args.files, transformer, args.workers, args.work_dir):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
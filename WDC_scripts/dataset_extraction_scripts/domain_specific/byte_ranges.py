@@ -0,0 +1,69 @@
+import os
+
+BLOCK_SIZE = 8 << 20
+
+
+def split_byte_ranges(path, n_ranges, min_range_size=1 << 20):
+    """Split a file into at most ``n_ranges`` contiguous (start, end) byte ranges."""
+    size = os.path.getsize(path)
+    n_ranges = max(1, min(n_ranges, size // min_range_size))
+    step = size // n_ranges
+    bounds = [i * step for i in range(n_ranges)] + [size]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def iter_range_lines(path, start, end):
+    """
+    Yield the lines (bytes) of ``path`` that start inside ``[start, end)``.
+
+    A line belongs to the range its first byte falls into, so consecutive
+    ranges together yield every line exactly once and in file order.
+    """
+    with open(path, "rb") as f:
+        pos = start
+        if start > 0:
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def iter_file_blocks(f, start=0, end=None, block_size=BLOCK_SIZE):
+    """
+    Yield blocks of whole lines (bytes, each ending in a newline) from a binary
+    file object positioned at ``max(start - 1, 0)``, covering the lines that
+    start inside ``[start, end)``. ``end=None`` reads to the end of the file; a
+    final line without a newline gets one appended.
+    """
+    pos = start
+    if start > 0:
+        pos = start - 1 + len(f.readline())
+    carry = b""
+    while end is None or pos < end:
+        data = f.read(block_size)
+        if not data:
+            if carry:
+                yield carry + b"\n"
+            return
+        data = carry + data
+        cut = data.rfind(b"\n") + 1
+        if cut == 0:
+            carry = data
+            continue
+        block, carry = data[:cut], data[cut:]
+        if end is not None and pos + len(block) > end:
+            yield block[:block.find(b"\n", end - pos - 1) + 1]
+            return
+        pos += len(block)
+        yield block
+
+
+def iter_range_blocks(path, start=0, end=None, block_size=BLOCK_SIZE):
+    """Block-wise variant of ``iter_range_lines``."""
+    with open(path, "rb") as f:
+        f.seek(max(start - 1, 0))
+        yield from iter_file_blocks(f, start, end, block_size)
@@ -2,17 +2,28 @@ import os
 from tqdm import tqdm
 import argparse
 
+from domain_container import DomainDataset
+from domain_counts import load_dataset_counts
+
 def count_file_rows(directory):
-    """Count the number of rows in each text file in the specified directory."""
+    """Count the number of rows in each text file of a domain directory or container."""
     file_row_counts = {}
+    counts = load_dataset_counts(directory)
+    if counts is not None:
+        # Counts kept by the extraction scripts, no need to read the files again
+        for filename, (num_rows, _) in counts.items():
+            if filename.endswith('.txt'):
+                file_row_counts[os.path.splitext(filename)[0]] = num_rows
+        return file_row_counts
 
-    for filename in tqdm(os.listdir(directory), desc="Creating domain logs"):
-        file_path = os.path.join(directory, filename)
+    dataset = DomainDataset(directory)
 
-        if os.path.isfile(file_path) and filename.endswith('.txt'):
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-                num_rows = sum(1 for _ in file)
-                file_row_counts[os.path.splitext(filename)[0]] = num_rows
+    for filename in tqdm(dataset.domain_names(), desc="Creating domain logs"):
+        if filename.endswith('.txt'):
+            # Sub-shards of a heavy domain are counted under the domain's own name
+            file_row_counts[os.path.splitext(filename)[0]] = sum(
+                dataset.line_count(record) for record in dataset.shard_records(filename)
+            )
 
     return file_row_counts
 
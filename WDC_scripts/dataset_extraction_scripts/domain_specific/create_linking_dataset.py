@@ -1,8 +1,14 @@
 import os
+import json
 import logging
-import shutil
 from tqdm import tqdm
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from domain_container import DomainDataset
+from domain_profile import DatasetProfile, profile_dir, write_profiles
+from domain_shards import write_manifest
+from file_assembly import LINK_MODES, concatenate
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s", filename="linking_dataset_logs.log", filemode="a")
@@ -10,17 +16,16 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Process dataset folder for linking.")
     parser.add_argument('dataset_folder', type=str, help='Name of the dataset folder to process')
+    parser.add_argument('--link_mode', choices=LINK_MODES, default='copy',
+                        help='How the large files are placed in the linking dataset; links fall back to copies.')
+    parser.add_argument('--workers', type=int, default=16, help='Number of threads for joining and copying files.')
+    parser.add_argument('--plan', choices=['log', 'sketch'], default='log',
+                        help="'log': split the full *_domains.log at the 99th percentile; 'sketch': count only the "
+                             "heavy-hitter candidates of *_heavy_hitters.json exactly and truncate all other domains.")
     return parser.parse_args()
 
-def main():
-    args = parse_arguments()
-    dataset_folder = args.dataset_folder
-
-    link_dir = f'domain_specific/linking_dataset/{dataset_folder}'
-    log_file = f'domain_specific/domain_logs/{dataset_folder}_domains.log'
-    domain_dir = f'domain_specific/domain_dataset/{dataset_folder}_dataset'
-    link_file = f"{dataset_folder}_link.txt"
-
+def plan_from_log(log_file):
+    """Split the domains of a full count log into the truncate and approval lists."""
     log_dict = {}
     with open(log_file, 'r') as f:
         for line in f:
@@ -38,6 +43,53 @@ def main():
     # Split the items into truncate_list and approval_list based on the threshold
     truncate_list = {key for key, value in sorted_log_items[:threshold]}
     approval_list = {key for key, value in sorted_log_items[threshold:]}
+    return threshold, truncate_list, approval_list
+
+def plan_from_sketch(plan_file, dataset):
+    """
+    Choose the approval list among the heavy-hitter candidates of the extraction
+    sketch by counting only their lines; every other domain file is truncated.
+    """
+    with open(plan_file, 'r') as f:
+        plan = json.load(f)
+    exact = {}
+    for candidate in plan['candidates']:
+        record = dataset.resolve(candidate['domain'])
+        if record is not None:
+            exact[record] = sum(dataset.line_count(shard) for shard in dataset.shard_records(record))
+    ranked = sorted(exact.items(), key=lambda item: item[1], reverse=True)
+    approval_list = {record for record, _ in ranked[:plan['n_top']]}
+    truncate_list = set(dataset.domain_names()) - approval_list
+    logging.info(f"Counted {len(exact)} sketch candidates for the top {plan['n_top']} of ~{plan['distinct_domains']} domains")
+    return len(truncate_list), truncate_list, approval_list
+
+def resolve_records(dataset, names, missing):
+    """Records of ``dataset`` for ``names`` (with all sub-shards), sorted; unknown names are added to ``missing``."""
+    records = []
+    for name in sorted(names):
+        record = dataset.resolve(name)
+        if record is None:
+            missing.append(name)
+        else:
+            records.extend(dataset.shard_records(record))
+    return records
+
+def main():
+    args = parse_arguments()
+    dataset_folder = args.dataset_folder
+
+    link_dir = f'domain_specific/linking_dataset/{dataset_folder}'
+    log_file = f'domain_specific/domain_logs/{dataset_folder}_domains.log'
+    domain_dir = f'domain_specific/domain_dataset/{dataset_folder}_dataset'
+    link_file = f"{dataset_folder}_link.txt"
+
+    plan_file = f'domain_specific/domain_logs/{dataset_folder}_heavy_hitters.json'
+    dataset = DomainDataset(domain_dir)
+
+    if args.plan == 'sketch':
+        threshold, truncate_list, approval_list = plan_from_sketch(plan_file, dataset)
+    else:
+        threshold, truncate_list, approval_list = plan_from_log(log_file)
 
     logging.info(f"Threshold set to {threshold}")
     logging.info(f"Truncate list: {len(truncate_list)}")
@@ -51,28 +103,43 @@ def main():
         os.makedirs(link_dir)
         logging.info(f"Created directory {link_dir}")
 
-    with open(os.path.join(link_dir, link_file), 'w', encoding='utf-8') as outfile:
-        for file in tqdm(truncate_list, desc="Joining files"):
-            file_path = os.path.join(domain_dir, file)
-            if os.path.isfile(file_path):
-                with open(file_path, 'r', encoding='utf-8') as infile:
-                    outfile.write(infile.read())
-                    logging.info(f"Wrote contents of {file_path} to {link_file}")
-            else:
-                logging.warning(f"File {file_path} does not exist and will be skipped.")
-
-    copied = 0
-    skipped = 0
-    for file in tqdm(approval_list, desc="Copying files"):
-        source = os.path.join(domain_dir, file)
-        if os.path.isfile(source):
-            destination = os.path.join(link_dir, file)
-            shutil.copy2(source, destination)
-            copied += 1
-            logging.info(f"Copied {source} to {destination}")
-        else:
-            skipped += 1
-            logging.warning(f"File {source} does not exist and will be skipped.")
+    missing = []
+
+    # Sorted names keep the reads sequential for containers, whose segments are sorted by name
+    truncate_records = resolve_records(dataset, truncate_list, missing)
+    if dataset.compressed:
+        # zstd records have to pass through the decompressor, so they cannot be copied by the kernel
+        with open(os.path.join(link_dir, link_file), 'wb') as out:
+            for record in tqdm(truncate_records, desc="Decompressing files"):
+                dataset.copy_to(record, out)
+    else:
+        concatenate(
+            (dataset.location(record) for record in truncate_records),
+            os.path.join(link_dir, link_file),
+            workers=args.workers,
+        )
+
+    approval_records = resolve_records(dataset, approval_list, missing)
+
+    def place(record):
+        dataset.extract(record, os.path.join(link_dir, record), mode=args.link_mode)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(tqdm(executor.map(place, approval_records), total=len(approval_records), desc="Copying files"))
+    copied = len(approval_records)
+    manifest = {record: dataset.shard_records(record) for record in approval_records if len(dataset.shard_records(record)) > 1}
+    if manifest:
+        write_manifest(link_dir, manifest)
+    # Carry the extraction profiles over, so the LIMES configuration does not have to load the graphs
+    profile = DatasetProfile(domain_dir)
+    if profile:
+        link_profiles = {record: profile.counts(record) for record in approval_records if profile.resolve(record)}
+        link_profiles[link_file] = profile.combined(truncate_records)
+        write_profiles(os.path.join(profile_dir(link_dir), "link.npz"), link_profiles)
+        logging.info(f"Wrote profiles of {len(link_profiles)} files to {profile_dir(link_dir)}")
+    skipped = len(missing)
+    if missing:
+        logging.warning(f"{skipped} files do not exist in {domain_dir} and were skipped, e.g. {missing[:20]}")
 
     logging.info(f"Copied {copied} files and skipped {skipped} files")
     print(f"Copied {copied} files and skipped {skipped} files")
@@ -0,0 +1,125 @@
+import fcntl
+import hashlib
+import logging
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+RUN_HEADER = np.dtype("<u8")
+
+
+def line_hash(line):
+    """64-bit fingerprint of a line (str or bytes)."""
+    if isinstance(line, str):
+        line = line.encode("utf-8", errors="surrogateescape")
+    return int.from_bytes(hashlib.blake2b(line, digest_size=8).digest(), "little")
+
+
+def hash_lines(lines):
+    return np.fromiter((line_hash(line) for line in lines), dtype=np.uint64, count=len(lines))
+
+
+class DedupIndex:
+    """
+    Persistent per-domain index of 64-bit line fingerprints.
+
+    Each domain has one ``<domain>.idx`` file holding a short list of sorted
+    runs (an 8-byte length followed by the sorted hashes). New hashes are
+    appended as a new run and the tail runs are merged whenever a run is not at
+    least twice the size of the one after it, so a domain keeps O(log n) runs
+    and each hash is rewritten O(log n) times in total. Lookups binary-search
+    the memory-mapped runs, so an append costs O(new lines * log n) instead of
+    re-reading the whole domain file.
+
+    Two different lines collide with probability ~n^2 / 2^65 for n lines of a
+    domain, in which case the second one is treated as a duplicate.
+
+    ``add`` rewrites the tail of the index in place, so processes sharing an
+    index must hold ``lock(domain)`` around each select/append/add sequence.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+
+    def path(self, domain):
+        return os.path.join(self.index_dir, f"{domain}.idx")
+
+    @contextmanager
+    def lock(self, domain):
+        """Exclusive lock on the index (and, by convention, the data file) of ``domain`` across processes."""
+        with open(os.path.join(self.index_dir, f"{domain}.lock"), "ab") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _runs(self, path):
+        """Return the (header offset, sorted hashes) runs of an index file."""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return []
+        data = np.memmap(path, dtype=np.uint64, mode="r")
+        runs = []
+        pos = 0
+        while pos < len(data):
+            count = int(data[pos])
+            runs.append((pos, data[pos + 1:pos + 1 + count]))
+            pos += 1 + count
+        return runs
+
+    def build(self, domain, data_file):
+        """Create the index of an existing domain file that predates the index."""
+        with open(data_file, "rb") as f:
+            hashes = np.unique(np.fromiter((line_hash(line) for line in f), dtype=np.uint64))
+        self.add(domain, hashes)
+        logging.info(f"Built dedup index for {domain} with {len(hashes)} lines")
+
+    def select_new(self, domain, lines, data_file=None):
+        """
+        Return the lines (first occurrence, original order) whose fingerprint is
+        neither in the index nor earlier in ``lines``, and their hashes.
+        """
+        path = self.path(domain)
+        if data_file and not os.path.exists(path) and os.path.exists(data_file):
+            self.build(domain, data_file)
+        if not lines:
+            return [], np.empty(0, dtype=np.uint64)
+
+        hashes = hash_lines(lines)
+        _, first = np.unique(hashes, return_index=True)
+        keep = np.zeros(len(hashes), dtype=bool)
+        keep[first] = True
+        for _, run in self._runs(path):
+            if len(run) == 0:
+                continue
+            idx = np.searchsorted(run, hashes)
+            idx[idx == len(run)] = len(run) - 1
+            keep &= run[idx] != hashes
+        selected = np.flatnonzero(keep)
+        return [lines[i] for i in selected], hashes[selected]
+
+    def add(self, domain, hashes):
+        """Persist new hashes as a run and merge tail runs to keep the run count logarithmic."""
+        if len(hashes) == 0:
+            return
+        path = self.path(domain)
+        runs = self._runs(path)
+        new_run = np.sort(np.asarray(hashes, dtype=np.uint64))
+        merge_from = len(runs)
+        while merge_from > 0 and len(runs[merge_from - 1][1]) < 2 * (
+            len(new_run) + sum(len(run) for _, run in runs[merge_from:])
+        ):
+            merge_from -= 1
+        if merge_from < len(runs):
+            offset = runs[merge_from][0]
+            new_run = np.unique(np.concatenate([run for _, run in runs[merge_from:]] + [new_run]))
+        else:
+            offset = sum(1 + len(run) for _, run in runs)
+        del runs
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(offset * RUN_HEADER.itemsize)
+            f.write(np.asarray([len(new_run)], dtype=np.uint64).tobytes())
+            f.write(new_run.tobytes())
+            f.truncate()
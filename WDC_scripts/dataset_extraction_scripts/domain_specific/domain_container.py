@@ -0,0 +1,430 @@
+import argparse
+import bisect
+import io
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+from tqdm import tqdm
+
+from domain_shards import ShardSplitter, load_manifest, shard_name, write_manifest
+from domain_writer import read_spill_records
+from file_assembly import copy_to_file, place_file
+from zstd_records import (
+    DEFAULT_DICT_SIZE,
+    DEFAULT_LEVEL,
+    SAMPLE_BYTES,
+    collect_samples,
+    compressor,
+    decompressor,
+    load_dictionary,
+    train_dictionary,
+    write_dictionary,
+)
+
+INDEX_FILE = "index.tsv"
+SEGMENT_DIR = "segments"
+DEFAULT_SEGMENT_SIZE = 1 << 30
+COPY_SIZE = 16 << 20
+# Per-record metadata of domain_counts, domain_profile and heavy_hitters, valid for any layout
+METADATA_DIRS = (".counts", ".profile", ".sketches")
+
+
+def is_container(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class ContainerWriter:
+    """
+    Writes a domain dataset as a few large segment files plus an index.
+
+    Every record (the lines of one domain file) is stored contiguously in one
+    segment; a new segment is started once the current one exceeds
+    ``segment_size`` bytes. ``close`` writes ``index.tsv`` with one
+    ``name, segment, offset, length, lines`` row per record, sorted by name.
+
+    With a zstd ``dictionary`` (see ``zstd_records``) every record is stored as
+    one zstd frame compressed with it at ``level``; ``offset`` and ``length``
+    then refer to the frame, and a sixth column holds the uncompressed size.
+    """
+
+    def __init__(self, dataset_dir, segment_size=DEFAULT_SEGMENT_SIZE, dictionary=None, level=DEFAULT_LEVEL):
+        self.dataset_dir = dataset_dir
+        self.segment_size = segment_size
+        self.dictionary = dictionary
+        self.compressor = compressor(dictionary, level) if dictionary is not None else None
+        self.segment_dir = os.path.join(dataset_dir, SEGMENT_DIR)
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.entries = []
+        self.record = None
+        self.segment = -1
+        self.segment_file = None
+        self._next_segment()
+
+    def _next_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+        self.segment += 1
+        path = os.path.join(self.segment_dir, f"segment-{self.segment:05d}.nq")
+        self.segment_file = open(path, "wb")
+
+    def add(self, name, chunks, max_bytes=None):
+        """
+        Append the record ``name`` made of the byte strings in ``chunks``. With
+        ``max_bytes`` the record is split into sub-shard records of bounded
+        size (see ``domain_shards``); returns the names of the written records.
+        """
+        if not max_bytes:
+            self._begin(name)
+            for chunk in chunks:
+                self._write(chunk)
+            self._end()
+            return [name]
+        splitter = ShardSplitter(max_bytes)
+        current = 0
+        self._begin(name)
+        for chunk in chunks:
+            for index, piece in splitter.split(chunk):
+                if index != current:
+                    self._end()
+                    self._begin(shard_name(name, index))
+                    current = index
+                self._write(piece)
+        self._end()
+        return splitter.names(name)
+
+    def _begin(self, name):
+        if self.segment_file.tell() >= self.segment_size:
+            self._next_segment()
+        self.record = [name, self.segment_file.tell(), 0, 0]
+        self.frame = self.compressor.compressobj() if self.compressor is not None else None
+
+    def _write(self, chunk):
+        self.segment_file.write(chunk if self.frame is None else self.frame.compress(chunk))
+        self.record[2] += chunk.count(b"\n")
+        self.record[3] += len(chunk)
+
+    def _end(self):
+        if self.frame is not None:
+            self.segment_file.write(self.frame.flush())
+        name, offset, lines, size = self.record
+        length = self.segment_file.tell() - offset
+        entry = (name, self.segment, offset, length, lines)
+        self.entries.append(entry if self.frame is None else entry + (size,))
+
+    def close(self):
+        self.segment_file.close()
+        if self.dictionary is not None:
+            write_dictionary(self.dataset_dir, self.dictionary)
+        self.entries.sort()
+        index_path = os.path.join(self.dataset_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            for entry in self.entries:
+                f.write("\t".join(map(str, entry)) + "\n")
+        os.replace(index_path + ".tmp", index_path)
+        logging.info(f"Wrote {len(self.entries)} records into {self.segment + 1} segments of {self.dataset_dir}")
+
+
+def read_chunks(path, offset=0, length=None):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        remaining = float("inf") if length is None else length
+        while remaining > 0:
+            chunk = f.read(int(min(remaining, COPY_SIZE)))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def pack_spills(
+    spill_paths,
+    dataset_dir,
+    filename_fn,
+    segment_size=DEFAULT_SEGMENT_SIZE,
+    max_file_bytes=None,
+    profile_writer=None,
+    zstd_level=None,
+):
+    """
+    Container counterpart of ``domain_writer.merge_spills``. With
+    ``zstd_level`` the records are compressed with a dictionary trained on a
+    sample of them.
+    """
+    segments = OrderedDict()
+    for spill_path in spill_paths:
+        for domain, offset, length in read_spill_records(spill_path):
+            segments.setdefault(filename_fn(domain), []).append((spill_path, offset, length))
+
+    def read_head(name, n):
+        head = b""
+        for spill_path, offset, length in segments[name]:
+            for chunk in read_chunks(spill_path, offset, length):
+                head += chunk
+                if len(head) >= n:
+                    return head
+        return head
+
+    dictionary = None
+    if zstd_level is not None:
+        dictionary = train_dictionary(collect_samples(segments, read_head))
+    writer = ContainerWriter(dataset_dir, segment_size, dictionary=dictionary, level=zstd_level or DEFAULT_LEVEL)
+    shards = {}
+    for name in sorted(segments):
+        chunks = (
+            chunk for spill_path, offset, length in segments[name]
+            for chunk in read_chunks(spill_path, offset, length)
+        )
+        if profile_writer is not None:
+            chunks = profile_writer.track(name, chunks)
+        shards[name] = writer.add(name, chunks, max_bytes=max_file_bytes)
+    writer.close()
+    if max_file_bytes:
+        write_manifest(dataset_dir, shards)
+
+
+def copy_metadata(source_dir, dataset_dir):
+    """Copy the shard manifest and the metadata directories of a dataset to its converted copy."""
+    write_manifest(dataset_dir, load_manifest(source_dir))
+    for name in METADATA_DIRS:
+        if os.path.isdir(os.path.join(source_dir, name)):
+            shutil.copytree(os.path.join(source_dir, name), os.path.join(dataset_dir, name), dirs_exist_ok=True)
+
+
+def pack_directory(source_dir, dataset_dir, segment_size=DEFAULT_SEGMENT_SIZE):
+    """Convert a directory of per-domain files (and its sub-shard manifest) into a container."""
+    names = sorted(f for f in os.listdir(source_dir) if f.endswith(".txt") or f.endswith(".nt"))
+    writer = ContainerWriter(dataset_dir, segment_size)
+    for name in tqdm(names, desc="Packing files"):
+        writer.add(name, read_chunks(os.path.join(source_dir, name)))
+    writer.close()
+    copy_metadata(source_dir, dataset_dir)
+
+
+def compress_dataset(
+    source_path,
+    dataset_dir,
+    level=DEFAULT_LEVEL,
+    dict_size=DEFAULT_DICT_SIZE,
+    sample_bytes=SAMPLE_BYTES,
+    segment_size=DEFAULT_SEGMENT_SIZE,
+):
+    """
+    Convert a domain dataset (directory or container) into a container of zstd
+    frames sharing one dictionary trained on a sample of its records. Small
+    domain files of one format repeat the same vocabulary, which the
+    dictionary stores once instead of once per record.
+    """
+    source = DomainDataset(source_path)
+
+    def read_head(name, n):
+        head = b""
+        for chunk in source.iter_chunks(name):
+            head += chunk
+            if len(head) >= n:
+                break
+        return head
+
+    dictionary = train_dictionary(collect_samples(source.names(), read_head, sample_bytes), dict_size)
+    writer = ContainerWriter(dataset_dir, segment_size, dictionary=dictionary, level=level)
+    for name in tqdm(source.names(), desc="Compressing records"):
+        writer.add(name, source.iter_chunks(name))
+    writer.close()
+    copy_metadata(source_path, dataset_dir)
+    stored = sum(entry[3] for entry in writer.entries)
+    original = sum(entry[5] for entry in writer.entries)
+    logging.info(f"Compressed {original / 1e9:.2f} GB into {stored / 1e9:.2f} GB ({original / max(stored, 1):.1f}x)")
+
+
+class DomainDataset:
+    """
+    Read access to a domain dataset, either a directory of per-domain files or
+    a container written by ``ContainerWriter``. Records are addressed by file
+    name (``example.com.txt``); the name without extension is accepted too.
+    Domains split into sub-shards are listed in the ``shards.json`` manifest;
+    ``domain_names`` and ``shard_records`` group their records. Records of a
+    zstd-compressed container are decompressed transparently by all readers
+    except ``location``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.container = is_container(path)
+        self.manifest = load_manifest(path)
+        self.dictionary = load_dictionary(path) if self.container else None
+        self.compressed = self.dictionary is not None
+        if self.container:
+            self._names = []
+            self._entries = []
+            with open(os.path.join(path, INDEX_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    name, segment, offset, length, lines, *size = line.rstrip("\n").split("\t")
+                    self._names.append(name)
+                    self._entries.append(
+                        (int(segment), int(offset), int(length), int(lines), int(size[0]) if size else int(length))
+                    )
+        else:
+            self._names = sorted(
+                f for f in os.listdir(path)
+                if (f.endswith(".txt") or f.endswith(".nt")) and os.path.isfile(os.path.join(path, f))
+            )
+
+    def names(self):
+        return list(self._names)
+
+    def domain_names(self):
+        """Record names without the extra sub-shards, one per domain file."""
+        extra = {shard for shards in self.manifest.values() for shard in shards[1:]}
+        return [name for name in self._names if name not in extra]
+
+    def shard_records(self, name):
+        """All records of the domain file ``name``, in order."""
+        return self.manifest.get(name, [name])
+
+    def resolve(self, name):
+        """The record name for ``name`` or its ``.txt`` variant, or None if neither exists."""
+        for candidate in (name, f"{name}.txt"):
+            i = bisect.bisect_left(self._names, candidate)
+            if i < len(self._names) and self._names[i] == candidate:
+                return candidate
+        return None
+
+    def _entry(self, name):
+        i = bisect.bisect_left(self._names, name)
+        if i == len(self._names) or self._names[i] != name:
+            raise KeyError(name)
+        return self._entries[i]
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, SEGMENT_DIR, f"segment-{segment:05d}.nq")
+
+    def local_path(self, name):
+        """Path of the record as a standalone file, None inside a container."""
+        return None if self.container else os.path.join(self.path, name)
+
+    def location(self, name):
+        """``(path, offset, length)`` of the record's bytes on disk (a zstd frame if ``compressed``)."""
+        if self.container:
+            segment, offset, length = self._entry(name)[:3]
+            return self._segment_path(segment), offset, length
+        path = self.local_path(name)
+        return path, 0, os.path.getsize(path)
+
+    def size(self, name):
+        """Uncompressed size of the record."""
+        if self.container:
+            return self._entry(name)[4]
+        return os.path.getsize(self.local_path(name))
+
+    def line_count(self, name):
+        if self.container:
+            return self._entry(name)[3]
+        return sum(chunk.count(b"\n") for chunk in read_chunks(self.local_path(name)))
+
+    def iter_chunks(self, name):
+        if self.compressed:
+            return self._iter_decompressed(name)
+        if self.container:
+            segment, offset, length = self._entry(name)[:3]
+            return read_chunks(self._segment_path(segment), offset, length)
+        return read_chunks(self.local_path(name))
+
+    def _iter_decompressed(self, name):
+        frame = decompressor(self.dictionary).decompressobj()
+        for chunk in read_chunks(*self.location(name)):
+            data = frame.decompress(chunk)
+            if data:
+                yield data
+
+    def read_bytes(self, name):
+        return b"".join(self.iter_chunks(name))
+
+    def open(self, name):
+        """Binary file object with the record's content (e.g. for ``rdflib.Graph.parse``)."""
+        if self.container:
+            return io.BytesIO(self.read_bytes(name))
+        return open(self.local_path(name), "rb")
+
+    def copy_to(self, name, out):
+        for chunk in self.iter_chunks(name):
+            out.write(chunk)
+
+    def extract(self, name, destination, mode="copy"):
+        """
+        Write the record to ``destination`` as a standalone file. Files of a
+        directory dataset can be hard linked or reflinked instead (``mode``).
+        """
+        if not self.container:
+            place_file(self.local_path(name), destination, mode)
+            return
+        if self.compressed:
+            with open(destination, "wb") as out:
+                self.copy_to(name, out)
+            return
+        copy_to_file(*self.location(name), destination)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Pack, list and extract single-container domain datasets.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack_parser = subparsers.add_parser("pack", help="Convert a directory of domain files into a container.")
+    pack_parser.add_argument("source_dir", help="Directory with one .txt file per domain.")
+    pack_parser.add_argument("dataset_dir", help="Output container directory.")
+    pack_parser.add_argument(
+        "--segment_size_mb", type=int, default=DEFAULT_SEGMENT_SIZE >> 20, help="Target size of a segment file."
+    )
+
+    compress_parser = subparsers.add_parser(
+        "compress", help="Convert a dataset into a container of zstd frames with a trained dictionary."
+    )
+    compress_parser.add_argument("source_dir", help="Directory or container of one format.")
+    compress_parser.add_argument("dataset_dir", help="Output container directory.")
+    compress_parser.add_argument("--level", type=int, default=DEFAULT_LEVEL, help="zstd compression level.")
+    compress_parser.add_argument(
+        "--dict_size_kb", type=int, default=DEFAULT_DICT_SIZE >> 10, help="Size of the trained dictionary."
+    )
+    compress_parser.add_argument(
+        "--sample_mb", type=int, default=SAMPLE_BYTES >> 20, help="Amount of record data to train the dictionary on."
+    )
+    compress_parser.add_argument(
+        "--segment_size_mb", type=int, default=DEFAULT_SEGMENT_SIZE >> 20, help="Target size of a segment file."
+    )
+
+    list_parser = subparsers.add_parser("list", help="Print name, size and line count of every record.")
+    list_parser.add_argument("dataset_dir", help="Container or directory.")
+
+    extract_parser = subparsers.add_parser("extract", help="Extract records as standalone files.")
+    extract_parser.add_argument("dataset_dir", help="Container or directory.")
+    extract_parser.add_argument("names", nargs="*", help="Records to extract, all if omitted.")
+    extract_parser.add_argument("-o", "--output_dir", default=".", help="Directory for the extracted files.")
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack_directory(args.source_dir, args.dataset_dir, args.segment_size_mb << 20)
+    elif args.command == "compress":
+        compress_dataset(
+            args.source_dir,
+            args.dataset_dir,
+            level=args.level,
+            dict_size=args.dict_size_kb << 10,
+            sample_bytes=args.sample_mb << 20,
+            segment_size=args.segment_size_mb << 20,
+        )
+    elif args.command == "list":
+        dataset = DomainDataset(args.dataset_dir)
+        for name in dataset.names():
+            print(f"{name}\t{dataset.size(name)}\t{dataset.line_count(name)}")
+    else:
+        dataset = DomainDataset(args.dataset_dir)
+        os.makedirs(args.output_dir, exist_ok=True)
+        for name in tqdm(args.names or dataset.names(), desc="Extracting files"):
+            record = dataset.resolve(name)
+            if record is None:
+                logging.warning(f"{name} is not part of {args.dataset_dir} and will be skipped.")
+                continue
+            dataset.extract(record, os.path.join(args.output_dir, record))
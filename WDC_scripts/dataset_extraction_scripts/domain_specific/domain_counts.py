@@ -0,0 +1,72 @@
+import argparse
+import glob
+import logging
+import os
+
+COUNTS_DIR = ".counts"
+
+
+def counts_dir(dataset_dir):
+    return os.path.join(dataset_dir, COUNTS_DIR)
+
+
+def add_counts(counts, name, lines, size):
+    """Add ``lines`` and ``size`` bytes to the ``[lines, bytes]`` entry of ``name``."""
+    entry = counts.get(name)
+    if entry is None:
+        counts[name] = [lines, size]
+    else:
+        entry[0] += lines
+        entry[1] += size
+
+
+def write_counts(path, counts):
+    """Write a partial count file with one ``name, lines, bytes`` row per output file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for name, (lines, size) in counts.items():
+            f.write(f"{name}\t{lines}\t{size}\n")
+    os.replace(path + ".tmp", path)
+
+
+def read_counts(path, counts=None):
+    counts = {} if counts is None else counts
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            name, lines, size = line.rstrip("\n").split("\t")
+            add_counts(counts, name, int(lines), int(size))
+    return counts
+
+
+def load_dataset_counts(dataset_dir):
+    """Sum all partial count files of a dataset, or None if extraction did not write any."""
+    paths = sorted(glob.glob(os.path.join(counts_dir(dataset_dir), "*.tsv")))
+    if not paths:
+        return None
+    counts = {}
+    for path in paths:
+        read_counts(path, counts)
+    return counts
+
+
+def write_domain_log(log_path, counts):
+    """Write ``<domain>: <lines>`` rows, largest first, in the ``*_domains.log`` format."""
+    with open(log_path, "w", encoding="utf-8") as log_file:
+        for name, (lines, _) in sorted(counts.items(), key=lambda item: item[1][0], reverse=True):
+            log_file.write(f"{os.path.splitext(name)[0]}: {lines}\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Reduce partial domain count files into a domain log.")
+    parser.add_argument("dataset_dir", type=str, help="Domain dataset directory containing .counts.")
+    parser.add_argument("log_file", type=str, help="Path of the *_domains.log file to write.")
+    args = parser.parse_args()
+
+    counts = load_dataset_counts(args.dataset_dir)
+    if counts is None:
+        raise SystemExit(f"No partial count files in {counts_dir(args.dataset_dir)}")
+    write_domain_log(args.log_file, counts)
+    logging.info(f"Wrote counts of {len(counts)} domains to {args.log_file}")
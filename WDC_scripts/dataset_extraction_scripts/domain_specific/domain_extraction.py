@@ -1,26 +1,60 @@
+import argparse
 import os
 import logging
-from urllib.parse import urlparse
+import shutil
 
+from joblib import Parallel, delayed
 from tqdm import tqdm
 
+from byte_ranges import iter_range_blocks, split_byte_ranges
+from domain_container import pack_spills
+from domain_counts import add_counts, counts_dir, write_counts
+from domain_matcher import DomainMatcher
+from domain_profile import DomainProfiler, ProfileWriter, clear_profiles
+from domain_writer import DomainWriter, SpillWriter, merge_spills
+from heavy_hitters import DomainSketch, sketch_dir, write_plan
+
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
 
 class DomainProcessor:
-    def __init__(self, data_path, domain_file, output_dir):
+    def __init__(
+        self,
+        data_path,
+        domain_file,
+        output_dir,
+        memory_budget=1 << 30,
+        max_open_files=512,
+        max_file_bytes=None,
+        profile=False,
+        zstd_level=None,
+    ):
         self.data_path = data_path
         self.domain_file = domain_file
         self.output_dir = output_dir
-        self.output_dict = {}
-        self.no_domain_lines = []
+        self.memory_budget = memory_budget
+        self.max_file_bytes = max_file_bytes
+        self.profile = profile
+        # Profiles of the sequential run by file name, fed with the runs as they are routed
+        self.profilers = {}
+        self.zstd_level = zstd_level
+        self.domain_counts = {}
+        self.no_domain_count = 0
+        self.writer = DomainWriter(
+            output_dir,
+            self.get_filename,
+            memory_budget=memory_budget,
+            max_open_files=max_open_files,
+            max_file_bytes=max_file_bytes,
+        )
         log_dir = "domain_logs"
 
         base_name = os.path.basename(self.domain_file)
         format_name, _ = os.path.splitext(base_name)
         log_file = os.path.join(log_dir, f"{format_name}.log")
+        self.plan_file = os.path.join(log_dir, f"{format_name}_heavy_hitters.json")
         self.count_logger = logging.getLogger("DomainCountLogger")
         handler = logging.FileHandler(log_file, mode="w")
         formatter = logging.Formatter("%(message)s")
@@ -32,71 +66,147 @@ class DomainProcessor:
         try:
             with open(self.domain_file, "r") as f:
                 self.domains = [line.strip() for line in f]
+            self.matcher = DomainMatcher(self.domains)
             logging.info(f"Loaded domains from {self.domain_file}")
         except Exception as e:
             logging.error(f"Failed to read domain file: {e}")
             raise
 
-    def get_base_url(self, url):
-        url = url.strip("<>")
-        parsed_url = urlparse(url)
-        base_url = parsed_url.netloc
-
-        if base_url.startswith("www."):
-            base_url = base_url[4:]
-        return base_url
+    @staticmethod
+    def get_filename(domain):
+        return f"{domain.replace(':', '').replace('/', '_')}.txt"
 
     def process_data(self):
         try:
             total_size = os.path.getsize(self.data_path)
             logging.info(f"Start processing file of size {total_size} bytes.")
 
-            with open(self.data_path, "r", encoding="utf-8") as file, tqdm(
+            with tqdm(
                 total=total_size, unit="B", unit_scale=True, desc="Processing File"
             ) as progress_bar:
-                for line in file:
-                    line_size = len(line.encode("utf-8"))
-                    parts = line.split()
-                    part = parts[-2]
-                    found_domain = False
-                    for domain in self.domains:
-                        if domain in part:
-
-                            if domain not in self.output_dict:
-                                self.output_dict[domain] = []
-                            self.output_dict[domain].append(line)
-
-                            found_domain = True
-                            break
-                    if not found_domain:
-                        logging.debug(f"Domain not found: {part} in line str: {line}")
-                        self.no_domain_lines.append(part)
-                        base_url = self.get_base_url(part)
-                        if base_url not in self.output_dict:
-                            self.output_dict[base_url] = []
-                        self.output_dict[base_url].append(line)
-                    progress_bar.update(line_size)
+                for block in iter_range_blocks(self.data_path):
+                    self.no_domain_count += self.process_block(
+                        block, self.writer, self.domain_counts, self.profilers if self.profile else None
+                    )
+                    progress_bar.update(len(block))
             logging.info("Data processing completed successfully.")
         except Exception as e:
             logging.error(f"Error during data processing: {e}")
             raise
 
+    def process_block(self, block, writer, domain_counts, profilers=None):
+        """
+        Route the lines of a byte block to their domains; returns the number of
+        unmatched lines. With ``profilers`` the runs are also fed to the
+        ``DomainProfiler`` of their file.
+        """
+        no_domain_count = 0
+        for domain, found_domain, data, n_lines in self.matcher.iter_runs(block):
+            if not found_domain:
+                logging.debug(f"Domain not found for {n_lines} lines, using base URL: {domain}")
+                no_domain_count += n_lines
+            writer.write(domain, data)
+            add_counts(domain_counts, domain, n_lines, len(data))
+            if profilers is not None:
+                name = self.get_filename(domain)
+                profiler = profilers.get(name)
+                if profiler is None:
+                    profiler = profilers[name] = DomainProfiler()
+                profiler.feed(data)
+        return no_domain_count
+
+    def file_stem_counts(self, domain_counts):
+        """Line counts keyed like the domain logs, by output file name without extension."""
+        stem_counts = {}
+        for domain, (lines, _) in domain_counts.items():
+            stem = os.path.splitext(self.get_filename(domain))[0]
+            stem_counts[stem] = stem_counts.get(stem, 0) + lines
+        return stem_counts
+
+    def process_range(self, part_index, start, end, spill_dir, memory_budget):
+        spill_path = os.path.join(spill_dir, f"part-{part_index:05d}.bin")
+        writer = SpillWriter(spill_path, memory_budget=memory_budget)
+        domain_counts = {}
+        no_domain_count = 0
+        for block in iter_range_blocks(self.data_path, start, end):
+            no_domain_count += self.process_block(block, writer, domain_counts)
+        writer.close()
+        # Sketches of finished ranges allow planning the linking dataset before the merge is done
+        DomainSketch.from_counts(self.file_stem_counts(domain_counts)).save(
+            os.path.join(sketch_dir(self.output_dir), f"part-{part_index:05d}.json")
+        )
+        return spill_path, domain_counts, no_domain_count
+
+    def process_data_parallel(self, n_workers, container=False):
+        """
+        Process newline-aligned byte ranges in parallel and merge the per-range
+        spills in order, into per-domain files or a single container.
+        """
+        ranges = split_byte_ranges(self.data_path, n_workers * 4)
+        logging.info(f"Processing {len(ranges)} byte ranges with {n_workers} workers.")
+        spill_dir = os.path.join(self.output_dir, ".spills")
+        os.makedirs(spill_dir, exist_ok=True)
+        os.makedirs(sketch_dir(self.output_dir), exist_ok=True)
+        results = Parallel(n_jobs=n_workers)(
+            delayed(self.process_range)(i, start, end, spill_dir, self.memory_budget // n_workers)
+            for i, (start, end) in enumerate(ranges)
+        )
+        for _, domain_counts, no_domain_count in results:
+            for domain, (lines, size) in domain_counts.items():
+                add_counts(self.domain_counts, domain, lines, size)
+            self.no_domain_count += no_domain_count
+        spill_paths = [spill_path for spill_path, _, _ in results]
+        profile_writer = None
+        if self.profile:
+            clear_profiles(self.output_dir)
+            profile_writer = ProfileWriter(self.output_dir, "extract")
+        if container:
+            pack_spills(
+                spill_paths,
+                self.output_dir,
+                self.get_filename,
+                max_file_bytes=self.max_file_bytes,
+                profile_writer=profile_writer,
+                zstd_level=self.zstd_level,
+            )
+        else:
+            merge_spills(
+                spill_paths,
+                self.output_dir,
+                self.get_filename,
+                max_file_bytes=self.max_file_bytes,
+                profile_writer=profile_writer,
+            )
+        if profile_writer is not None:
+            profile_writer.close()
+        shutil.rmtree(spill_dir)
+        logging.info("Data processing completed successfully.")
+
     def save_results(self):
-        for key, lines in self.output_dict.items():
-            filename = f"{key.replace(':', '').replace('/', '_')}.txt"
-            filepath = os.path.join(self.output_dir, filename)
-            with open(filepath, "w", encoding="utf-8") as f:
-                for line in lines:
-                    f.write(line)
+        self.writer.close()
+        if self.profilers:
+            clear_profiles(self.output_dir)
+            profile_writer = ProfileWriter(self.output_dir, "extract")
+            for name, profiler in self.profilers.items():
+                profile_writer.add(name, profiler)
+            profile_writer.close()
+        # Per-file line and byte counts, so create_domain_logs.py does not have to rescan the output
+        file_counts = {}
+        for domain, (lines, size) in self.domain_counts.items():
+            add_counts(file_counts, self.get_filename(domain), lines, size)
+        write_counts(os.path.join(counts_dir(self.output_dir), "counts.tsv"), file_counts)
+        # The counts are exact here, so the range sketches are replaced by one without error
+        shutil.rmtree(sketch_dir(self.output_dir), ignore_errors=True)
+        os.makedirs(sketch_dir(self.output_dir))
+        sketch = DomainSketch.from_counts(self.file_stem_counts(self.domain_counts))
+        sketch.save(os.path.join(sketch_dir(self.output_dir), "counts.json"))
+        write_plan(sketch, self.plan_file)
         print(f"Files have been created in the '{self.output_dir}' directory.")
 
     def display_counts(self, files_saved=False):
         if not files_saved:
-            domain_counts = {
-                domain: len(lines) for domain, lines in self.output_dict.items()
-            }
-            for domain, count in sorted(
-                domain_counts.items(), key=lambda item: item[1], reverse=True
+            for domain, (count, _) in sorted(
+                self.domain_counts.items(), key=lambda item: item[1][0], reverse=True
             ):
                 self.count_logger.info(f"{domain}: {count}")
         else:
@@ -104,14 +214,52 @@ class DomainProcessor:
 
 
 if __name__ == "__main__":
-    import sys
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_path", type=str, help="Path to the .nq-all data file.")
+    parser.add_argument("domain_file", type=str, help="Path to the domain file.")
+    parser.add_argument("output_dir", type=str, help="Path to the output directory.")
+    parser.add_argument(
+        "--memory_budget_mb",
+        type=int,
+        default=1024,
+        help="Memory for buffered output lines before the largest buffers are flushed.",
+    )
+    parser.add_argument(
+        "--max_open_files", type=int, default=512, help="Maximum number of open output files."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes; more than 1 splits the file into byte ranges.",
+    )
+    parser.add_argument(
+        "--container",
+        action="store_true",
+        help="Write segment files with an index.tsv instead of one file per domain.",
+    )
+    parser.add_argument(
+        "--max_shard_mb",
+        type=int,
+        default=0,
+        help="Split domain files larger than this into numbered sub-shards listed in shards.json "
+        "(default 0: one file per domain).",
+    )
+    parser.add_argument(
+        "--zstd_level",
+        type=int,
+        default=None,
+        help="With --container, compress every record with a zstd dictionary trained on a sample, at this level.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Also write the class/property profile of every domain file to .profile (see domain_profile.py); "
+        "a sequential run holds the profiles of all domains in memory until the end.",
+    )
 
-    if len(sys.argv) != 4:
-        print("Usage: python3 script.py <data_path> <domain_file> <output_dir>")
-    else:
-        data_dir = sys.argv[1]
-
-        data_path, domain_file, output_dir = sys.argv[1], sys.argv[2], sys.argv[3]
+    args = parser.parse_args()
+    data_path, domain_file, output_dir = args.data_path, args.domain_file, args.output_dir
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         logging.info(
@@ -119,8 +267,20 @@ if __name__ == "__main__":
         )
     else:
         logging.info(f"Output directory '{output_dir}' already exists.")
-    processor = DomainProcessor(data_path, domain_file, output_dir)
+    processor = DomainProcessor(
+        data_path,
+        domain_file,
+        output_dir,
+        memory_budget=args.memory_budget_mb * 1024 * 1024,
+        max_open_files=args.max_open_files,
+        max_file_bytes=args.max_shard_mb * 1024 * 1024 or None,
+        profile=args.profile,
+        zstd_level=args.zstd_level,
+    )
     processor.read_domains()
-    processor.process_data()
+    if args.workers > 1 or args.container:
+        processor.process_data_parallel(args.workers, container=args.container)
+    else:
+        processor.process_data()
     processor.save_results()
     processor.display_counts()
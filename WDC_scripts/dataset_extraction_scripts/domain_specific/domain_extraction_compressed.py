@@ -2,114 +2,323 @@ import argparse
 import glob
 import os
 import logging
-import gzip
-from urllib.parse import urlparse
 import psutil
+import shutil
+import time
 from tqdm import tqdm
-from joblib import Parallel, delayed
+from joblib import Parallel, delayed, effective_n_jobs
+
+from dedup_index import DedupIndex
+from domain_counts import add_counts, counts_dir, load_dataset_counts, write_counts, write_domain_log
+from domain_matcher import DomainMatcher
+from domain_profile import DomainProfiler, ProfileWriter, drop_profiles
+from gzip_index import build_index, indexed_gzip, iter_gz_range_blocks, split_gz_ranges
+from heavy_hitters import DomainSketch, merge_sketch_dir, sketch_dir, write_plan
+from pipeline import AsyncWorker, StageTimings, prefetch
+from shard_merge import merge_shards, write_shard
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+# Decompressed blocks read ahead of the matcher, and finished chunks queued or being written
+READ_QUEUE_SIZE = 4
+WRITE_QUEUE_SIZE = 1
+# In append mode the matched runs are handed to the writer in batches of about this size
+WRITE_BATCH_BYTES = 64 << 20
+MERGED_COUNTS = "merged.tsv"
+
 
 class DomainProcessor:
-    def __init__(self, domain_file, output_dir):
+    def __init__(
+        self,
+        domain_file,
+        output_dir,
+        index_dir=None,
+        resume=False,
+        merge_mode="shard",
+        max_file_bytes=None,
+        profile=False,
+    ):
         self.domain_file = domain_file
         self.output_dir = output_dir
-        self.domains = set()
+        self.index_dir = index_dir
+        self.resume = resume
+        self.merge_mode = merge_mode
+        self.max_file_bytes = max_file_bytes
+        self.profile = profile
+        self.progress_dir = os.path.join(output_dir, ".progress")
+        self.shards_dir = os.path.join(output_dir, ".shards")
+        # In append mode the partial count files of every run are kept, since each run appends to the domain files
+        self.run_id = time.strftime("%Y%m%d-%H%M%S")
+        self.domains = []
         self.no_domain_lines = []
+        # Counts and profiles of the chunk whose batches the writer thread is appending
+        self.chunk_counts = {}
+        self.chunk_profilers = {}
 
         base_name = os.path.basename(self.domain_file)
         format_name, _ = os.path.splitext(base_name)
         log_dir = "domain_logs"
         os.makedirs(log_dir, exist_ok=True)
         self.log_file = os.path.join(log_dir, f"{format_name}.log")
+        self.plan_file = os.path.join(log_dir, f"{format_name}_heavy_hitters.json")
 
     def read_domains(self):
         try:
             with open(self.domain_file, "r") as f:
-                self.domains.update(line.strip() for line in f)
+                self.domains = [line.strip() for line in f]
+            self.matcher = DomainMatcher(self.domains)
             logging.info(f"Loaded domains from {self.domain_file}")
         except Exception as e:
             logging.error(f"Failed to read domain file: {e}")
             raise
 
-    def get_base_url(self, url):
-        url = url.strip("<>")
-        parsed_url = urlparse(url)
-        base_url = parsed_url.netloc
+    @staticmethod
+    def get_filename(domain):
+        return f"{domain}.txt"
+
+    def chunk_marker(self, file_path, part_index):
+        return os.path.join(self.progress_dir, f"{os.path.basename(file_path)}.{part_index:05d}.done")
+
+    def shard_dir(self, file_path, part_index):
+        return os.path.join(self.shards_dir, f"{os.path.basename(file_path)}.{part_index:05d}")
+
+    def plan_chunks(self, file_paths, chunks_per_file, n_jobs=-1):
+        """Split every file into (file_path, part_index, start, end) chunks of its uncompressed data."""
+        if chunks_per_file > 1 and indexed_gzip is not None:
+            Parallel(n_jobs=n_jobs)(delayed(build_index)(file, self.index_dir) for file in file_paths)
+        elif chunks_per_file > 1:
+            logging.warning("indexed_gzip is not installed, every file is processed as a single chunk")
+        chunks = []
+        for file_path in file_paths:
+            ranges = split_gz_ranges(file_path, chunks_per_file, self.index_dir)
+            chunks.extend((file_path, i, start, end) for i, (start, end) in enumerate(ranges))
+        return chunks
 
-        if base_url.startswith("www."):
-            base_url = base_url[4:]
-        return base_url
+    def process_data(self, file_path, part_index=0, start=0, end=None):
+        self.process_chunks([(file_path, part_index, start, end)])
 
-    def process_data(self, file_path):
-        process_id = os.getpid()
-        logging.info(f"Process ID {process_id} is processing {file_path}")
+    def process_chunks(self, chunks):
+        """
+        Process consecutive chunks in a three-stage pipeline: a thread
+        decompresses blocks ahead of the matcher, the calling thread matches
+        them, and a writer thread saves what was matched. In append mode the
+        runs are handed over in batches of ``WRITE_BATCH_BYTES``, so writing
+        overlaps matching within a chunk as well. A shard needs the whole
+        chunk to be sorted, so in shard mode a chunk is written while the next
+        one is matched. Bounded queues limit the blocks read ahead and the
+        batches waiting to be written. Returns the ``StageTimings`` of the
+        pipeline, which show the bottleneck.
+        """
+        pending = []
+        for chunk in chunks:
+            if self.resume and os.path.exists(self.chunk_marker(chunk[0], chunk[1])):
+                logging.info(f"Skipping chunk {chunk[1]} of {chunk[0]}, already processed")
+            else:
+                pending.append(chunk)
+        timings = StageTimings()
+        if not pending:
+            return timings
+        logging.info(f"Process ID {os.getpid()} is processing {len(pending)} chunks starting at {pending[0][1]} of {pending[0][0]}")
+        streaming = self.merge_mode == "append"
+        if not streaming and len(pending) == 1:
+            logging.info("A task of one chunk in shard mode cannot overlap writing with matching")
+        writer = AsyncWorker(self.save_chunk, timings, "write", max_pending=WRITE_QUEUE_SIZE)
         local_output_dict = {}
-        with gzip.open(file_path, "rt") as file:
-            progress = tqdm(
-                total=1_510_000_000,
-                unit="B",
-                unit_scale=True,
-                desc=f"Processing {os.path.basename(file_path)}",
+        buffered = 0
+        progress = tqdm(
+            total=sum(1_510_000_000 if end is None else end - start for _, _, start, end in pending),
+            unit="B",
+            unit_scale=True,
+            desc=f"Processing {os.path.basename(pending[0][0])}:{pending[0][1]}",
+        )
+        for chunk, block in prefetch(self.iter_chunk_blocks(pending), READ_QUEUE_SIZE, timings, "decompress", "match"):
+            if block is None:
+                # Handing the chunk over blocks while the writer is still busy with the previous ones
+                with timings.measure("match", "wait"):
+                    writer.submit(chunk, local_output_dict, True)
+                local_output_dict = {}
+                buffered = 0
+                continue
+            with timings.measure("match"):
+                for domain, found_domain, data, n_lines in self.matcher.iter_runs(block):
+                    if not found_domain:
+                        self.no_domain_lines.append(domain)
+                    if domain not in local_output_dict:
+                        local_output_dict[domain] = []
+                    local_output_dict[domain].append(data)
+                    buffered += len(data)
+            if streaming and buffered >= WRITE_BATCH_BYTES:
+                with timings.measure("match", "wait"):
+                    writer.submit(chunk, local_output_dict, False)
+                local_output_dict = {}
+                buffered = 0
+            progress.update(len(block))
+        progress.close()
+        writer.close()
+        timings.log(f"Stage timings of {len(pending)} chunks")
+        return timings
+
+    def iter_chunk_blocks(self, chunks):
+        """Yield ``(chunk, block)`` pairs of the decompressed blocks, with a ``None`` block after each chunk."""
+        for chunk in chunks:
+            file_path, _, start, end = chunk
+            for block in iter_gz_range_blocks(file_path, start, end, self.index_dir):
+                yield chunk, block
+            yield chunk, None
+
+    def save_chunk(self, chunk, local_output_dict, last=True):
+        """
+        Save matched runs of ``chunk``. In append mode a chunk arrives in
+        several batches; its counts, sketch, profile and progress marker are
+        written with the ``last`` one.
+        """
+        file_path, part_index, _, _ = chunk
+        logging.info(f"Current Memory Usage {psutil.Process(os.getpid()).memory_info().rss / 1000000: .5} in MB")
+        if self.merge_mode == "shard":
+            line_counts = write_shard(self.shard_dir(file_path, part_index), local_output_dict, self.get_filename)
+        else:
+            self.save_results(
+                local_output_dict,
+                os.path.basename(file_path),
+                self.chunk_counts,
+                self.chunk_profilers if self.profile else None,
             )
-            for line in file:
-                line_size = len(line.encode("utf-8"))
-                parts = line.split()
-                part = parts[-2]
-                found_domain = False
-                for domain in self.domains:
-                    if domain in part:
-
-                        if domain not in local_output_dict:
-                            local_output_dict[domain] = []
-                        local_output_dict[domain].append(line)
-                        found_domain = True
-                        break
-                if not found_domain:
-                    self.no_domain_lines.append(part)
-                    base_url = self.get_base_url(part)
-                    if base_url not in local_output_dict:
-                        local_output_dict[base_url] = []
-                    local_output_dict[base_url].append(line)
-                progress.update(line_size)
-            logging.info(f"Current Memory Usage {psutil.Process(os.getpid()).memory_info().rss / 1000000: .5} in MB")
-            self.save_results(local_output_dict, os.path.basename(file_path))
-            del local_output_dict
-        logging.info(f"Finished processing and saving {file_path}")
-
-    def save_results(self, local_output_dict, base_file_name):
+            if not last:
+                return
+            file_counts, self.chunk_counts = self.chunk_counts, {}
+            write_counts(
+                os.path.join(counts_dir(self.output_dir), f"{self.run_id}.{os.path.basename(file_path)}.{part_index:05d}.tsv"),
+                file_counts,
+            )
+            if self.chunk_profilers:
+                profiles = ProfileWriter(
+                    self.output_dir, f"append-{self.run_id}.{os.path.basename(file_path)}.{part_index:05d}"
+                )
+                for name, profiler in self.chunk_profilers.items():
+                    profiles.add(name, profiler)
+                profiles.close()
+                self.chunk_profilers = {}
+            line_counts = {name: lines for name, (lines, _) in file_counts.items()}
+        # Deduplicated line counts; in shard mode a line repeated in other chunks is counted once per
+        # chunk, so the sketch can over-estimate domains whose triples recur across files
+        os.makedirs(sketch_dir(self.output_dir), exist_ok=True)
+        stem_counts = {os.path.splitext(name)[0]: lines for name, lines in line_counts.items()}
+        DomainSketch.from_counts(stem_counts, overlapping=self.merge_mode == "shard").save(
+            os.path.join(sketch_dir(self.output_dir), f"{os.path.basename(file_path)}.{part_index:05d}.json")
+        )
+        # The marker is written only after the chunk is saved, so a restart redoes unfinished chunks
+        os.makedirs(self.progress_dir, exist_ok=True)
+        open(self.chunk_marker(file_path, part_index), "w").close()
+        logging.info(f"Finished processing and saving chunk {part_index} of {file_path}")
+
+    def save_results(self, local_output_dict, base_file_name, file_counts=None, profilers=None):
+        """
+        Append the new lines of every domain through the dedup index and add
+        their counts to ``file_counts``. With ``profilers`` the appended lines
+        are also fed to the ``DomainProfiler`` of their file; the profile of a
+        domain file is the sum over the chunks that appended to it, so an
+        instance whose lines were appended by several chunks is counted once
+        per chunk.
+        """
         logging.info(f'Saving data from {base_file_name}')
-        for domain, lines in tqdm(local_output_dict.items(), desc="Saving results", unit="domain"):
-            file_path = os.path.join(self.output_dir, f"{domain}.txt")
-            existing_lines = set()
-            
-            if os.path.exists(file_path):
-                with open(file_path, 'r', encoding='utf-8', errors="ignore") as f:
-                    existing_lines = set(f.readlines())
-                
-            with open(file_path, 'a', encoding='utf-8') as f:
-                for line in lines:
-                    if line not in existing_lines:
-                        f.write(line)
-            del existing_lines
+        dedup_index = DedupIndex(os.path.join(self.output_dir, ".dedup_index"))
+        if file_counts is None:
+            file_counts = {}
+        for domain, runs in tqdm(local_output_dict.items(), desc="Saving results", unit="domain"):
+            file_path = os.path.join(self.output_dir, self.get_filename(domain))
+            lines = [line + b"\n" for line in b"".join(runs).split(b"\n")[:-1]]
+            # Workers of other files may append to the same domain; the lock keeps the index consistent
+            with dedup_index.lock(domain):
+                new_lines, new_hashes = dedup_index.select_new(domain, lines, data_file=file_path)
+
+                with open(file_path, 'ab') as f:
+                    f.writelines(new_lines)
+                # Only index lines once they are on disk, so a crash can at worst leave duplicates
+                dedup_index.add(domain, new_hashes)
+            if new_lines:
+                add_counts(file_counts, os.path.basename(file_path), len(new_lines), sum(map(len, new_lines)))
+                if profilers is not None:
+                    name = os.path.basename(file_path)
+                    if name not in profilers:
+                        profilers[name] = DomainProfiler()
+                    profilers[name].feed(b"".join(new_lines))
         logging.info("Files have been written in the output directory.")
+        return file_counts
+
+    def check_output_dir(self):
+        """
+        Shard mode merges new lines into the domain files of earlier runs,
+        which must be sorted and unique, i.e. written by an earlier shard merge
+        (or by the interrupted merge of a first run, whose shards still exist).
+        """
+        if self.merge_mode != "shard" or not glob.glob(os.path.join(self.output_dir, "*.txt")):
+            return
+        count_files = [os.path.basename(path) for path in glob.glob(os.path.join(counts_dir(self.output_dir), "*.tsv"))]
+        if count_files != [MERGED_COUNTS] and (count_files or not os.path.isdir(self.shards_dir)):
+            raise ValueError(
+                f"{self.output_dir} holds domain files that no shard merge wrote; "
+                "continue it with --merge_mode append or use a new output directory"
+            )
+
+    def merge_results(self, chunks, n_jobs=-1):
+        """
+        Merge the shards of all chunks of this run into the domain files, which
+        keep the lines of earlier runs; every domain file is written once. The
+        shards are removed once the merge has finished. Chunks whose shard is
+        gone were merged by an earlier run that ``--resume`` continues.
+        """
+        shard_dirs = [self.shard_dir(file_path, part_index) for file_path, part_index, _, _ in chunks]
+        shard_dirs = [shard_dir for shard_dir in shard_dirs if os.path.isdir(shard_dir)]
+        if not shard_dirs:
+            logging.info("No shards left to merge")
+            return
+        profile_prefix = f"merge-{self.run_id}"
+        counts = merge_shards(
+            shard_dirs,
+            self.output_dir,
+            n_jobs=n_jobs,
+            max_file_bytes=self.max_file_bytes,
+            profile=self.profile,
+            profile_prefix=profile_prefix,
+        )
+        # Profiles of the rewritten files from earlier runs are out of date
+        drop_profiles(self.output_dir, counts, profile_prefix)
+        # Files this run did not touch keep the counts of the earlier runs
+        merged_counts = load_dataset_counts(self.output_dir) or {}
+        merged_counts.update(counts)
+        write_counts(os.path.join(counts_dir(self.output_dir), MERGED_COUNTS), merged_counts)
+        for path in glob.glob(os.path.join(counts_dir(self.output_dir), "*.tsv")):
+            if os.path.basename(path) != MERGED_COUNTS:
+                os.remove(path)
+        # The merged counts are exact, so they replace the chunk sketches
+        shutil.rmtree(sketch_dir(self.output_dir), ignore_errors=True)
+        os.makedirs(sketch_dir(self.output_dir))
+        DomainSketch.from_counts({os.path.splitext(name)[0]: lines for name, (lines, _) in merged_counts.items()}).save(
+            os.path.join(sketch_dir(self.output_dir), "merged.json")
+        )
+        # Every shard is now part of the domain files; keeping them would double the disk used
+        shutil.rmtree(self.shards_dir)
+        logging.info(f"Merged shards into {len(counts)} domain files")
+
+    def plan_heavy_hitters(self, fraction=0.01):
+        """Merge the chunk sketches into the approximate list of the heaviest domains."""
+        sketch = merge_sketch_dir(sketch_dir(self.output_dir))
+        if sketch is not None:
+            write_plan(sketch, self.plan_file, fraction)
+            logging.info(f"Heavy-hitter candidates written to {self.plan_file}")
+
+    def display_counts(self, recount=False):
+        """Reduce the partial count files into the domain log, or rescan the output with ``recount``."""
+        domain_counts = None if recount else load_dataset_counts(self.output_dir)
+        if domain_counts is None:
+            domain_counts = {}
+            for filename in glob.glob(f"{self.output_dir}/*.txt"):
+                with open(filename, "rb") as file:
+                    add_counts(domain_counts, os.path.basename(filename), sum(1 for _ in file), os.path.getsize(filename))
 
-    def display_counts(self):
-        domain_counts = {}
-        for filename in glob.glob(f"{self.output_dir}/*.txt"):
-            with open(filename, "r", encoding="utf-8") as file:
-                count = sum(1 for _ in file)
-                domain = os.path.basename(filename).replace(".txt", "")
-                domain_counts[domain] = count
-
-        with open(self.log_file, "w") as log_file:
-            for domain, count in sorted(
-                domain_counts.items(), key=lambda item: item[1], reverse=True
-            ):
-                log_file.write(f"{domain}: {count}\n")
+        write_domain_log(self.log_file, domain_counts)
         logging.info(f"Domain counts written to {self.log_file}")
 
 
@@ -120,6 +329,60 @@ if __name__ == "__main__":
     )
     parser.add_argument("domain_file", type=str, help="Path to the domain file.")
     parser.add_argument("output_dir", type=str, help="Path to the output directory.")
+    parser.add_argument(
+        "--chunks_per_file",
+        type=int,
+        default=1,
+        help="Split every .gz file into this many chunks using seek-point indexes (requires indexed_gzip).",
+    )
+    parser.add_argument(
+        "--index_dir", type=str, default=None, help="Directory for the .gzidx files, default next to the data."
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip chunks that a previous run already saved."
+    )
+    parser.add_argument(
+        "--merge_mode",
+        choices=["shard", "append"],
+        default="shard",
+        help="'shard': workers write sorted, deduplicated shards that are merged once at the end, together "
+        "with the domain files of earlier shard runs; "
+        "'append': workers append to the domain files through the dedup index.",
+    )
+    parser.add_argument("--n_jobs", type=int, default=-1, help="Number of worker processes.")
+    parser.add_argument(
+        "--chunks_per_task",
+        type=int,
+        default=None,
+        help="Chunks processed one after another by a worker; in shard mode the writing of one overlaps with "
+        "matching the next, append mode overlaps them within a chunk too "
+        "(default: as many as still leave four tasks per worker, at least 1).",
+    )
+    parser.add_argument(
+        "--max_shard_mb",
+        type=int,
+        default=0,
+        help="In shard mode, split merged domain files larger than this into numbered sub-shards "
+        "listed in shards.json (default 0: one file per domain).",
+    )
+    parser.add_argument(
+        "--recount",
+        action="store_true",
+        help="Count lines by rescanning the output files instead of reducing the partial count files.",
+    )
+    parser.add_argument(
+        "--top_fraction",
+        type=float,
+        default=0.01,
+        help="Share of heaviest domains listed as candidates in domain_logs/<format>_heavy_hitters.json.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Also write the class/property profile of every domain file to .profile (see domain_profile.py); "
+        "in append mode it sums the profiles of the lines each chunk appended, so an instance spread over "
+        "several chunks is counted once per chunk.",
+    )
 
     args = parser.parse_args()
     data_path, domain_file, output_dir = (
@@ -135,12 +398,33 @@ if __name__ == "__main__":
         )
     else:
         logging.info(f"Output directory '{output_dir}' already exists.")
-    processor = DomainProcessor(domain_file, output_dir)
+    processor = DomainProcessor(
+        domain_file,
+        output_dir,
+        index_dir=args.index_dir,
+        resume=args.resume,
+        merge_mode=args.merge_mode,
+        max_file_bytes=args.max_shard_mb * 1024 * 1024 or None,
+        profile=args.profile,
+    )
     processor.read_domains()
+    processor.check_output_dir()
 
     file_paths = sorted([os.path.join(data_path, f) for f in os.listdir(data_path) if f.endswith('.gz')])
-    Parallel(n_jobs=-1)(delayed(processor.process_data)(file) for file in file_paths)
+    chunks = processor.plan_chunks(file_paths, args.chunks_per_file, n_jobs=args.n_jobs)
+    # Consecutive chunks of a task share a pipeline, so one is written while the next is matched;
+    # grouping only kicks in once there are enough chunks to keep every worker busy
+    chunks_per_task = args.chunks_per_task or max(1, len(chunks) // (4 * effective_n_jobs(args.n_jobs)))
+    logging.info(f"{len(chunks)} chunks in tasks of {chunks_per_task}")
+    tasks = [chunks[i:i + chunks_per_task] for i in range(0, len(chunks), chunks_per_task)]
+    timings = StageTimings()
+    for task_timings in Parallel(n_jobs=args.n_jobs)(delayed(processor.process_chunks)(task) for task in tasks):
+        timings.merge(task_timings)
+    timings.log("Stage timings summed over all workers")
+    if args.merge_mode == "shard":
+        processor.merge_results(chunks, n_jobs=args.n_jobs)
+    processor.plan_heavy_hitters(args.top_fraction)
     # for file in tqdm(file_paths, desc="Files processed"):
         # processor.process_data(file)
     # processor.process_data(data_path)
-    processor.display_counts()
+    processor.display_counts(recount=args.recount)
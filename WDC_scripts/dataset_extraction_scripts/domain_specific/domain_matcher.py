@@ -0,0 +1,203 @@
+import argparse
+import functools
+import time
+from urllib.parse import urlparse
+
+NO_MATCH = float("inf")
+
+
+def base_url(url):
+    """Host of a graph IRI without a leading ``www.``, the fallback key for unknown domains."""
+    url = url.strip("<>")
+    netloc = urlparse(url).netloc
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return netloc
+
+
+class DomainMatcher:
+    """
+    Aho-Corasick automaton over the domains of a ``*_domains.txt`` list.
+
+    ``match`` returns the same domain as the linear scan
+    ``for domain in domains: if domain in part`` (the first domain of the list
+    that occurs as a substring), but visits every character of ``part`` only
+    once instead of testing thousands of substrings. ``lookup`` adds an LRU
+    cache keyed by graph IRI, which is effective because the lines of one page
+    share their graph IRI. ``lookup_bytes`` and ``iter_runs`` do the same on raw
+    bytes for the binary hot loop, decoding a graph IRI only on a cache miss.
+    """
+
+    def __init__(self, domains, cache_size=1 << 20):
+        self.domains = []
+        seen = set()
+        for domain in domains:
+            if domain not in seen:
+                seen.add(domain)
+                self.domains.append(domain)
+        self.cache_size = cache_size
+        self._build()
+        self._make_caches()
+
+    def _make_caches(self):
+        self.lookup = functools.lru_cache(maxsize=self.cache_size)(self._lookup)
+        self.lookup_bytes = functools.lru_cache(maxsize=self.cache_size)(self._lookup_bytes)
+
+    def __getstate__(self):
+        # The cache wrappers cannot be pickled; joblib workers get fresh ones
+        state = self.__dict__.copy()
+        del state["lookup"], state["lookup_bytes"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_caches()
+
+    def _build(self):
+        goto = [{}]
+        best = [NO_MATCH]
+        for priority, domain in enumerate(self.domains):
+            state = 0
+            for char in domain:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto[state][char] = next_state
+                    goto.append({})
+                    best.append(NO_MATCH)
+                state = next_state
+            best[state] = min(best[state], priority)
+
+        # Breadth-first construction of the failure links; every state also
+        # inherits the best (lowest) priority reachable through its failure chain.
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0)
+                best[next_state] = min(best[next_state], best[fail[next_state]])
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def match(self, part):
+        """The first domain of the list contained in ``part``, or None."""
+        goto, fail, best = self._goto, self._fail, self._best
+        state = 0
+        found = best[0]
+        for char in part:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if best[state] < found:
+                found = best[state]
+                if found == 0:
+                    break
+        return None if found == NO_MATCH else self.domains[found]
+
+    def _lookup(self, part):
+        """Return ``(key, matched)``: the matched domain, or the base URL of ``part`` as fallback."""
+        domain = self.match(part)
+        if domain is not None:
+            return domain, True
+        return base_url(part), False
+
+    def _lookup_bytes(self, part):
+        return self._lookup(part.decode("utf-8"))
+
+    def iter_runs(self, block):
+        """
+        Yield ``(domain, matched, data, n_lines)`` for the maximal runs of
+        consecutive lines of ``block`` (bytes of whole lines) that map to the
+        same domain; ``data`` is the raw slice of ``block`` holding the run.
+
+        The graph IRI is the second to last whitespace-separated field, as in
+        ``line.split()[-2]``, and is only looked up when it differs from the
+        one of the previous line.
+        """
+        lookup = self.lookup_bytes
+        run_key = None
+        run_start = 0
+        n_lines = 0
+        offset = 0
+        previous_graph = None
+        for line in block.split(b"\n")[:-1]:
+            graph = line.rsplit(None, 2)[-2]
+            if graph != previous_graph:
+                previous_graph = graph
+                key = lookup(graph)
+                if key != run_key:
+                    if n_lines:
+                        yield run_key[0], run_key[1], block[run_start:offset], n_lines
+                    run_key = key
+                    run_start = offset
+                    n_lines = 0
+            n_lines += 1
+            offset += len(line) + 1
+        if n_lines:
+            yield run_key[0], run_key[1], block[run_start:offset], n_lines
+
+
+def linear_match(domains, part):
+    for domain in domains:
+        if domain in part:
+            return domain
+    return None
+
+
+def read_graph_iris(data_path, max_lines):
+    parts = []
+    with open(data_path, "r", encoding="utf-8") as file:
+        for line in file:
+            parts.append(line.split()[-2])
+            if len(parts) == max_lines:
+                break
+    return parts
+
+
+def benchmark(domain_file, data_path, max_lines):
+    """
+    Compare lines/sec of the linear scan, the automaton and the cached lookup.
+
+    The ratios depend on the sample: the linear scan slows down with the share
+    of graph IRIs that match no domain (it tries every domain), and the cache
+    gains with the number of lines per graph IRI. Run it on a slice of the real
+    ``*.nq`` file rather than a generated one before quoting a speedup.
+    """
+    with open(domain_file, "r") as f:
+        domains = [line.strip() for line in f]
+    parts = read_graph_iris(data_path, max_lines)
+    matcher = DomainMatcher(domains)
+
+    start = time.perf_counter()
+    expected = [linear_match(domains, part) for part in parts]
+    linear_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = [matcher.match(part) for part in parts]
+    match_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    looked_up = [matcher.lookup(part) for part in parts]
+    lookup_time = time.perf_counter() - start
+
+    assert matched == expected, "Automaton disagrees with the linear scan"
+    assert [key if ok else None for key, ok in looked_up] == expected
+    n = len(parts)
+    print(f"{domain_file}: {len(matcher.domains)} domains, {n} lines")
+    print(f"linear scan : {n / linear_time:12,.0f} lines/sec")
+    print(f"automaton   : {n / match_time:12,.0f} lines/sec ({linear_time / match_time:.1f}x)")
+    print(f"cached      : {n / lookup_time:12,.0f} lines/sec ({linear_time / lookup_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the domain matcher against the linear scan.")
+    parser.add_argument("domain_file", type=str, help="Path to the domain file.")
+    parser.add_argument("data_path", type=str, help="N-Quads sample to read graph IRIs from.")
+    parser.add_argument("--lines", type=int, default=1_000_000, help="Number of lines to benchmark.")
+    args = parser.parse_args()
+    benchmark(args.domain_file, args.data_path, args.lines)
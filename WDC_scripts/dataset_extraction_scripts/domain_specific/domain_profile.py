@@ -0,0 +1,309 @@
+import argparse
+import glob
+import logging
+import os
+from collections import Counter
+
+import numpy as np
+from joblib import Parallel, delayed
+
+from domain_container import DomainDataset
+
+PROFILE_DIR = ".profile"
+# Resource-to-resource edges kept per domain for the nested counts (about 100 bytes each)
+MAX_LINKS = 5_000_000
+RDF_TYPE = b"http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+
+def profile_dir(dataset_dir):
+    return os.path.join(dataset_dir, PROFILE_DIR)
+
+
+class DomainProfiler:
+    """
+    Streaming class/property profile of the N-Quads lines of one domain.
+
+    Collects, over the union of all graphs, the counts that
+    ``RDFProcessor.query_graph`` computes with SPARQL:
+
+    * ``classes[C]``: distinct instances with ``rdf:type C``,
+    * ``literals[(C, p)]``: distinct instances of ``C`` with a literal value for ``p``,
+    * ``nested[(C, via, p)]``: distinct instances of ``C`` linked by ``via``
+      to a resource with a literal value for ``p``.
+
+    Class and property IRIs are kept without angle brackets. Subjects and
+    objects are interned, but the nested counts need every distinct edge
+    between two resources until the end, since the types of the subject and
+    the literals of the object may come later. The memory held therefore grows
+    with the distinct nodes and resource-to-resource edges of the domain;
+    edges beyond ``max_links`` are ignored, which makes the nested counts of
+    such a domain lower bounds (``truncated`` is set).
+    """
+
+    def __init__(self, max_links=MAX_LINKS):
+        self.nodes = {}
+        self.types = {}
+        self.literal_props = {}
+        self.links = set()
+        self.max_links = max_links
+        self.truncated = False
+        self.tail = b""
+
+    def _node(self, term):
+        node = self.nodes.get(term)
+        if node is None:
+            node = self.nodes[term] = len(self.nodes)
+        return node
+
+    def feed(self, data):
+        """Add a byte string; a line cut at its end is completed by the next call."""
+        lines = (self.tail + data).split(b"\n")
+        self.tail = lines.pop()
+        self._add_lines(lines)
+
+    def _add_lines(self, lines):
+        for line in lines:
+            parts = line.split(b" ", 2)
+            if len(parts) < 3:
+                continue
+            subject, predicate, rest = parts
+            predicate = predicate[1:-1]
+            node = self._node(subject)
+            if rest[:1] == b'"':
+                self.literal_props.setdefault(node, set()).add(predicate)
+                continue
+            # The object is everything before the graph label and the final dot
+            obj = rest.rsplit(b" ", 2)[0]
+            if predicate == RDF_TYPE and obj[:1] == b"<":
+                self.types.setdefault(node, set()).add(obj[1:-1])
+            link = (node, predicate, self._node(obj))
+            if len(self.links) < self.max_links:
+                self.links.add(link)
+            elif link not in self.links:
+                self.truncated = True
+
+    def counts(self):
+        """Return the ``(classes, literals, nested)`` counters with decoded IRIs."""
+        self._add_lines([self.tail])
+        self.tail = b""
+        classes = Counter()
+        literals = Counter()
+        for node, node_classes in self.types.items():
+            props = self.literal_props.get(node, ())
+            for cls in node_classes:
+                classes[cls] += 1
+                for prop in props:
+                    literals[(cls, prop)] += 1
+        nested_instances = set()
+        for node, via, target in self.links:
+            node_classes = self.types.get(node)
+            props = self.literal_props.get(target)
+            if node_classes and props:
+                for cls in node_classes:
+                    for prop in props:
+                        nested_instances.add((cls, via, prop, node))
+        nested = Counter(key[:3] for key in nested_instances)
+        return (
+            Counter({_decode(cls): n for cls, n in classes.items()}),
+            Counter({tuple(map(_decode, key)): n for key, n in literals.items()}),
+            Counter({tuple(map(_decode, key)): n for key, n in nested.items()}),
+        )
+
+
+def _decode(iri):
+    return iri.decode("utf-8", "replace")
+
+
+def _pack_strings(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    data = blob.tobytes()
+    return [data[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def write_profiles(path, profiles):
+    """
+    Store ``{name: (classes, literals, nested)}`` as COO arrays in one ``.npz``:
+    a shared vocabulary of IRIs, the sorted record names, and one int64 row per
+    count (``name, class, [via,] [property,] count``) sorted by name.
+    """
+    vocab = {}
+    term = lambda iri: vocab.setdefault(iri, len(vocab))
+    names = sorted(profiles)
+    class_rows, literal_rows, nested_rows = [], [], []
+    for i, name in enumerate(names):
+        classes, literals, nested = profiles[name]
+        class_rows.extend((i, term(cls), n) for cls, n in classes.items())
+        literal_rows.extend((i, term(cls), term(prop), n) for (cls, prop), n in literals.items())
+        nested_rows.extend((i, term(cls), term(via), term(prop), n) for (cls, via, prop), n in nested.items())
+    names_blob, names_offsets = _pack_strings(names)
+    terms_blob, terms_offsets = _pack_strings(sorted(vocab, key=vocab.get))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez_compressed(
+            f,
+            names_blob=names_blob,
+            names_offsets=names_offsets,
+            terms_blob=terms_blob,
+            terms_offsets=terms_offsets,
+            classes=np.array(class_rows, dtype=np.int64).reshape(-1, 3),
+            literals=np.array(literal_rows, dtype=np.int64).reshape(-1, 4),
+            nested=np.array(nested_rows, dtype=np.int64).reshape(-1, 5),
+        )
+    os.replace(path + ".tmp", path)
+
+
+class ProfileWriter:
+    """Collects the profiles of the domain files written by one worker into ``.profile/<part>.npz``."""
+
+    def __init__(self, dataset_dir, part):
+        self.path = os.path.join(profile_dir(dataset_dir), f"{part}.npz")
+        self.profiles = {}
+
+    def add(self, name, profiler):
+        self.profiles[name] = profiler.counts()
+        if profiler.truncated:
+            logging.warning(f"{name} has more than {profiler.max_links} resource links, its nested counts are lower bounds")
+
+    def track(self, name, chunks):
+        """Pass the byte chunks of the domain file ``name`` through while profiling them."""
+        profiler = DomainProfiler()
+        for chunk in chunks:
+            profiler.feed(chunk)
+            yield chunk
+        self.add(name, profiler)
+
+    def profile(self, name, chunks):
+        for _ in self.track(name, chunks):
+            pass
+
+    def close(self):
+        if self.profiles:
+            write_profiles(self.path, self.profiles)
+
+
+class DatasetProfile:
+    """
+    Read access to the profiles of a domain dataset, by record name (the name
+    without ``.txt`` is accepted too). Profiles cover whole domain files, so
+    the extra sub-shard records of a split domain have none of their own. A
+    name profiled in several parts, like the lines that append mode adds chunk
+    by chunk, gets the sum of their counts.
+    """
+
+    def __init__(self, dataset_dir, parts=None):
+        self.parts = []
+        self.index = {}
+        if parts is None:
+            parts = sorted(glob.glob(os.path.join(profile_dir(dataset_dir), "*.npz")))
+        for path in parts:
+            with np.load(path) as data:
+                part = {key: data[key] for key in data.files}
+            part["terms"] = _unpack_strings(part["terms_blob"], part["terms_offsets"])
+            for i, name in enumerate(_unpack_strings(part["names_blob"], part["names_offsets"])):
+                self.index.setdefault(name, []).append((len(self.parts), i))
+            self.parts.append(part)
+
+    def __bool__(self):
+        return bool(self.index)
+
+    def names(self):
+        return sorted(self.index)
+
+    def resolve(self, name):
+        for candidate in (name, f"{name}.txt"):
+            if candidate in self.index:
+                return candidate
+        return None
+
+    def counts(self, name):
+        """The ``(classes, literals, nested)`` counters of the record ``name``, or None."""
+        record = self.resolve(name)
+        if record is None:
+            return None
+        classes, literals, nested = Counter(), Counter(), Counter()
+        for part_index, i in self.index[record]:
+            part = self.parts[part_index]
+            terms = part["terms"]
+
+            def rows(key):
+                table = part[key]
+                lo, hi = np.searchsorted(table[:, 0], [i, i + 1])
+                return table[lo:hi].tolist()
+
+            classes.update({terms[cls]: n for _, cls, n in rows("classes")})
+            literals.update({(terms[cls], terms[prop]): n for _, cls, prop, n in rows("literals")})
+            nested.update({(terms[cls], terms[via], terms[prop]): n for _, cls, via, prop, n in rows("nested")})
+        return classes, literals, nested
+
+    def combined(self, names):
+        """Summed counts of several records, e.g. of the domains concatenated into a link file."""
+        classes, literals, nested = Counter(), Counter(), Counter()
+        for name in names:
+            counts = self.counts(name)
+            if counts is not None:
+                classes.update(counts[0])
+                literals.update(counts[1])
+                nested.update(counts[2])
+        return classes, literals, nested
+
+
+def clear_profiles(dataset_dir):
+    for path in glob.glob(os.path.join(profile_dir(dataset_dir), "*.npz")):
+        os.remove(path)
+
+
+def drop_profiles(dataset_dir, names, keep_prefix):
+    """
+    Remove the profiles of ``names`` from the parts whose name does not start
+    with ``keep_prefix``, e.g. because a merge rewrote those domain files.
+    Parts left without a profile are deleted.
+    """
+    names = set(names)
+    for path in glob.glob(os.path.join(profile_dir(dataset_dir), "*.npz")):
+        if os.path.basename(path).startswith(keep_prefix):
+            continue
+        part = DatasetProfile(dataset_dir, [path])
+        if names.isdisjoint(part.index):
+            continue
+        kept = {name: part.counts(name) for name in part.names() if name not in names}
+        if kept:
+            write_profiles(path, kept)
+        else:
+            os.remove(path)
+
+
+def _profile_batch(dataset_dir, names, part):
+    dataset = DomainDataset(dataset_dir)
+    writer = ProfileWriter(dataset_dir, part)
+    for name in names:
+        writer.profile(name, (chunk for record in dataset.shard_records(name) for chunk in dataset.iter_chunks(record)))
+    writer.close()
+
+
+def profile_dataset(dataset_dir, n_jobs=-1, batches_per_job=4):
+    """Profile an already written domain dataset, replacing any existing profile."""
+    clear_profiles(dataset_dir)
+    names = DomainDataset(dataset_dir).domain_names()
+    n_batches = max(1, min(len(names), (os.cpu_count() if n_jobs < 0 else n_jobs) * batches_per_job))
+    Parallel(n_jobs=n_jobs)(
+        delayed(_profile_batch)(dataset_dir, names[i::n_batches], f"scan-{i:05d}") for i in range(n_batches)
+    )
+    logging.info(f"Profiled {len(names)} domain files in {dataset_dir}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Compute class/property profiles of a domain dataset.")
+    parser.add_argument("dataset_dir", type=str, help="Domain dataset directory or container.")
+    parser.add_argument("--n_jobs", type=int, default=-1, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    profile_dataset(args.dataset_dir, n_jobs=args.n_jobs)
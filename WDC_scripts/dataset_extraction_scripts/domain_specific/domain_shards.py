@@ -0,0 +1,105 @@
+import json
+import os
+
+MANIFEST_FILE = "shards.json"
+
+
+def shard_name(name, index):
+    """File name of sub-shard ``index`` of the domain file ``name``; shard 0 keeps the name itself."""
+    if index == 0:
+        return name
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.part-{index:05d}{ext}"
+
+
+class ShardSplitter:
+    """
+    Splits the byte stream of one domain file into sub-shards of at most
+    ``max_bytes`` bytes, cutting only after a newline. A single line longer
+    than ``max_bytes`` gets a sub-shard of its own. Input may be cut anywhere;
+    a line is never divided between two sub-shards.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.index = 0
+        self.size = 0
+        self.at_line_start = True
+
+    def split(self, data):
+        """Yield ``(shard index, piece)`` for consecutive pieces of ``data``."""
+        while data:
+            capacity = max(self.max_bytes - self.size, 0)
+            if len(data) <= capacity:
+                cut = len(data)
+            else:
+                cut = data.rfind(b"\n", 0, capacity) + 1
+                if cut == 0:
+                    if self.size and self.at_line_start:
+                        self.index += 1
+                        self.size = 0
+                        continue
+                    # Finish the current line, even if it overflows the shard
+                    cut = data.find(b"\n") + 1 or len(data)
+            piece = data[:cut]
+            self.size += cut
+            self.at_line_start = piece.endswith(b"\n")
+            yield self.index, piece
+            data = data[cut:]
+
+    def names(self, name):
+        return [shard_name(name, i) for i in range(self.index + 1)]
+
+
+class ShardedOutput:
+    """Write-only file that rolls over to numbered sub-shards (``max_bytes=None`` disables splitting)."""
+
+    def __init__(self, output_dir, name, max_bytes=None, mode="wb"):
+        self.output_dir = output_dir
+        self.name = name
+        self.mode = mode
+        self.splitter = ShardSplitter(max_bytes) if max_bytes else None
+        self.current = 0
+        self.file = open(os.path.join(output_dir, name), mode)
+
+    def write(self, data):
+        if self.splitter is None:
+            self.file.write(data)
+            return
+        for index, piece in self.splitter.split(data):
+            if index != self.current:
+                self.file.close()
+                self.current = index
+                self.file = open(os.path.join(self.output_dir, shard_name(self.name, index)), self.mode)
+            self.file.write(piece)
+
+    def names(self):
+        return self.splitter.names(self.name) if self.splitter else [self.name]
+
+    def close(self):
+        self.file.close()
+
+
+def write_manifest(output_dir, shards):
+    """
+    Record the sub-shards of every split domain file in ``shards.json``
+    (``{name: [name, name.part-00001, ...]}``); domains that fit into one file
+    are not listed.
+    """
+    shards = {name: names for name, names in sorted(shards.items()) if len(names) > 1}
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not shards:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(shards, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_manifest(dataset_dir):
+    path = os.path.join(dataset_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
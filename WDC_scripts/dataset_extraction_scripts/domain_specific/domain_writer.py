@@ -0,0 +1,186 @@
+import logging
+import os
+import struct
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from domain_shards import ShardSplitter, ShardedOutput, shard_name, write_manifest
+
+# Spill record header: domain length (bytes), data length (bytes)
+SPILL_HEADER = struct.Struct("<IQ")
+
+
+class DomainWriter:
+    """
+    Buffered per-domain writer with a global memory budget.
+
+    Lines are kept in per-domain buffers until their total size exceeds
+    ``memory_budget`` bytes; the largest buffers are then flushed until half of
+    the budget is free, so peak memory does not depend on the input size.
+    Output files are kept in an LRU pool of at most ``max_open_files`` handles.
+    The first time a file is opened in a run it is truncated (``truncate=True``)
+    or appended to, later opens always append. With ``max_file_bytes`` a domain
+    file that outgrows the limit continues in numbered sub-shards, which are
+    listed in the ``shards.json`` manifest on ``close``.
+    """
+
+    def __init__(
+        self, output_dir, filename_fn, memory_budget=1 << 30, max_open_files=512, truncate=True, max_file_bytes=None
+    ):
+        self.output_dir = output_dir
+        self.filename_fn = filename_fn
+        self.memory_budget = memory_budget
+        self.max_open_files = max_open_files
+        self.truncate = truncate
+        self.buffers = {}
+        self.buffer_sizes = {}
+        self.buffered = 0
+        self.handles = OrderedDict()
+        self.opened_paths = set()
+        self.flushes = 0
+        self.max_file_bytes = max_file_bytes
+        self.splitters = {}
+
+    def path(self, domain, index=0):
+        return os.path.join(self.output_dir, shard_name(self.filename_fn(domain), index))
+
+    def write(self, domain, data):
+        buffer = self.buffers.get(domain)
+        if buffer is None:
+            buffer = self.buffers[domain] = []
+            self.buffer_sizes[domain] = 0
+        buffer.append(data)
+        self.buffer_sizes[domain] += len(data)
+        self.buffered += len(data)
+        if self.buffered > self.memory_budget:
+            self.flush_largest()
+
+    def flush_largest(self):
+        """Flush the largest buffers until at most half of the budget is in use."""
+        target = self.memory_budget // 2
+        for domain in sorted(self.buffer_sizes, key=self.buffer_sizes.get, reverse=True):
+            if self.buffered <= target:
+                break
+            self.flush(domain)
+        self.flushes += 1
+        logging.debug(f"Flushed buffers, {self.buffered} bytes still buffered")
+
+    def flush(self, domain):
+        buffer = self.buffers.pop(domain, None)
+        if not buffer:
+            return
+        self._write(domain, b"".join(buffer))
+        self.buffered -= self.buffer_sizes.pop(domain)
+
+    def _write(self, domain, data):
+        if not self.max_file_bytes:
+            self._handle(domain).write(data)
+            return
+        # Keyed by file name, as several domains may map to the same file
+        name = self.filename_fn(domain)
+        splitter = self.splitters.get(name)
+        if splitter is None:
+            splitter = self.splitters[name] = ShardSplitter(self.max_file_bytes)
+        for index, piece in splitter.split(data):
+            self._handle(domain, index).write(piece)
+
+    def _handle(self, domain, index=0):
+        path = self.path(domain, index)
+        handle = self.handles.get(path)
+        if handle is not None:
+            self.handles.move_to_end(path)
+            return handle
+        if len(self.handles) >= self.max_open_files:
+            _, oldest = self.handles.popitem(last=False)
+            oldest.close()
+        mode = "wb" if self.truncate and path not in self.opened_paths else "ab"
+        self.opened_paths.add(path)
+        handle = self.handles[path] = open(path, mode)
+        return handle
+
+    def close(self):
+        for domain in list(self.buffers):
+            self.flush(domain)
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+        if self.splitters:
+            write_manifest(self.output_dir, {name: splitter.names(name) for name, splitter in self.splitters.items()})
+        if self.opened_paths:
+            logging.info(f"Wrote {len(self.opened_paths)} files with {self.flushes} budget flushes.")
+
+
+class SpillWriter(DomainWriter):
+    """
+    DomainWriter variant for parallel workers that writes all domains into one
+    spill file as (domain, data) records instead of one file per domain.
+    Records of a domain appear in input order; ``merge_spills`` later
+    concatenates them into the per-domain files.
+    """
+
+    def __init__(self, spill_path, memory_budget=1 << 28):
+        super().__init__(os.path.dirname(spill_path), None, memory_budget=memory_budget)
+        self.spill_path = spill_path
+        self.spill = open(spill_path, "wb")
+
+    def _write(self, domain, data):
+        key = domain.encode("utf-8")
+        self.spill.write(SPILL_HEADER.pack(len(key), len(data)))
+        self.spill.write(key)
+        self.spill.write(data)
+
+    def close(self):
+        for domain in list(self.buffers):
+            self.flush(domain)
+        self.spill.close()
+
+
+def read_spill_records(spill_path):
+    """Yield (domain, data offset, data length) for every record of a spill file."""
+    with open(spill_path, "rb") as f:
+        while True:
+            header = f.read(SPILL_HEADER.size)
+            if not header:
+                break
+            key_length, data_length = SPILL_HEADER.unpack(header)
+            domain = f.read(key_length).decode("utf-8")
+            offset = f.tell()
+            f.seek(data_length, os.SEEK_CUR)
+            yield domain, offset, data_length
+
+
+def _read_spill(spill_path, offset, length):
+    with open(spill_path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def merge_spills(spill_paths, output_dir, filename_fn, workers=8, max_file_bytes=None, profile_writer=None):
+    """
+    Write every domain file once by concatenating its spill records in the
+    order of ``spill_paths``. With one spill per consecutive byte range this
+    reproduces the output of a sequential run exactly, including the
+    sub-shards of files larger than ``max_file_bytes``. The bytes of every file
+    pass through ``profile_writer`` (a ``domain_profile.ProfileWriter``) if given.
+    """
+    segments = OrderedDict()
+    for spill_path in spill_paths:
+        for domain, offset, length in read_spill_records(spill_path):
+            segments.setdefault(filename_fn(domain), []).append((spill_path, offset, length))
+
+    def write_file(item):
+        name, parts = item
+        out = ShardedOutput(output_dir, name, max_file_bytes)
+        chunks = (_read_spill(spill_path, offset, length) for spill_path, offset, length in parts)
+        if profile_writer is not None:
+            chunks = profile_writer.track(name, chunks)
+        for chunk in chunks:
+            out.write(chunk)
+        out.close()
+        return name, out.names()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shards = dict(executor.map(write_file, segments.items()))
+    if max_file_bytes:
+        write_manifest(output_dir, shards)
+    logging.info(f"Merged {len(spill_paths)} spill files into {len(segments)} domain files.")
@@ -0,0 +1,150 @@
+import errno
+import fcntl
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+FICLONE = 0x40049409
+BATCH_BYTES = 64 << 20
+BATCH_FILES = 1024
+LOG_EVERY = 10_000
+FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF}
+LINK_MODES = ("copy", "hardlink", "reflink")
+
+
+def _copy_by_read(src_fd, dst_fd, src_offset, dst_offset, length):
+    data = os.pread(src_fd, min(length, 16 << 20), src_offset)
+    return os.pwrite(dst_fd, data, dst_offset) if data else 0
+
+
+def copy_range(src_fd, dst_fd, src_offset, dst_offset, length):
+    """
+    Copy ``length`` bytes between file descriptors at explicit offsets.
+
+    Uses ``copy_file_range`` so the data does not pass through user space (and
+    may be cloned by the filesystem), then ``sendfile``, then pread/pwrite when
+    the kernel or filesystem does not support the faster calls, by an error or
+    by copying nothing.
+    """
+    method = "copy_file_range" if hasattr(os, "copy_file_range") else "sendfile"
+    while length > 0:
+        try:
+            if method == "copy_file_range":
+                n = os.copy_file_range(src_fd, dst_fd, length, src_offset, dst_offset)
+            elif method == "sendfile":
+                os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+                n = os.sendfile(dst_fd, src_fd, src_offset, length)
+            else:
+                n = _copy_by_read(src_fd, dst_fd, src_offset, dst_offset, length)
+        except OSError as e:
+            if e.errno not in FALLBACK_ERRORS or method == "read":
+                raise
+            method = "sendfile" if method == "copy_file_range" else "read"
+            continue
+        if n == 0:
+            # Some filesystems return 0 instead of an error for ranges they cannot copy;
+            # only a plain read returning nothing proves that the source is short
+            if method != "read":
+                method = "sendfile" if method == "copy_file_range" else "read"
+                continue
+            raise IOError(f"Source ended {length} bytes early")
+        src_offset += n
+        dst_offset += n
+        length -= n
+
+
+def _batches(sources):
+    """Group (path, offset, length, dst_offset) tasks into batches of bounded size."""
+    batch, batch_bytes = [], 0
+    for source in sources:
+        batch.append(source)
+        batch_bytes += source[2]
+        if batch_bytes >= BATCH_BYTES or len(batch) >= BATCH_FILES:
+            yield batch
+            batch, batch_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def _copy_batch(destination, batch):
+    dst_fd = os.open(destination, os.O_WRONLY)
+    try:
+        for path, offset, length, dst_offset in batch:
+            src_fd = os.open(path, os.O_RDONLY)
+            try:
+                copy_range(src_fd, dst_fd, offset, dst_offset, length)
+            finally:
+                os.close(src_fd)
+    finally:
+        os.close(dst_fd)
+    return len(batch), sum(length for _, _, length, _ in batch)
+
+
+def concatenate(sources, destination, workers=16):
+    """
+    Write the byte ranges ``sources`` ((path, offset, length) tuples) one after
+    another into ``destination``.
+
+    Output offsets are known up front, so the file is sized once and batches of
+    ranges are copied by a thread pool in any order; the copy syscalls release
+    the GIL. Progress is logged once per ``LOG_EVERY`` files.
+    """
+    tasks = []
+    total = 0
+    for path, offset, length in sources:
+        tasks.append((path, offset, length, total))
+        total += length
+    with open(destination, "wb") as f:
+        f.truncate(total)
+
+    files_done = bytes_done = 0
+    next_log = LOG_EVERY
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for n_files, n_bytes in executor.map(lambda batch: _copy_batch(destination, batch), _batches(tasks)):
+            files_done += n_files
+            bytes_done += n_bytes
+            if files_done >= next_log:
+                logging.info(f"Joined {files_done}/{len(tasks)} files ({bytes_done / 1e9:.2f} GB) into {destination}")
+                next_log += LOG_EVERY
+    logging.info(f"Joined {len(tasks)} files ({total / 1e9:.2f} GB) into {destination}")
+    return total
+
+
+def reflink(source, destination):
+    """Share the data blocks of ``source`` with a new ``destination`` (btrfs, XFS, ...)."""
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place_file(source, destination, mode="copy"):
+    """
+    Create ``destination`` with the content of ``source`` by copying it, hard
+    linking it or cloning it with a reflink. Links that the filesystem refuses
+    fall back to a copy; returns the mode that was used.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    if mode == "hardlink":
+        try:
+            os.link(source, destination)
+            return mode
+        except OSError as e:
+            logging.debug(f"Hard link of {source} failed ({e}), copying instead")
+    elif mode == "reflink":
+        try:
+            reflink(source, destination)
+            return mode
+        except OSError as e:
+            logging.debug(f"Reflink of {source} failed ({e}), copying instead")
+            if os.path.exists(destination):
+                os.remove(destination)
+    shutil.copy2(source, destination)
+    return "copy"
+
+
+def copy_to_file(path, offset, length, destination):
+    """Copy a byte range of ``path`` into a new file ``destination``."""
+    with open(destination, "wb") as f:
+        f.truncate(length)
+    _copy_batch(destination, [(path, offset, length, 0)])
@@ -0,0 +1,168 @@
+import argparse
+import gzip
+import logging
+import os
+import sys
+
+from byte_ranges import BLOCK_SIZE, iter_file_blocks
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+INDEX_SUFFIX = ".gzidx"
+DEFAULT_SPACING = 32 << 20
+READ_SIZE = 16 << 20
+
+
+def index_path(gz_path, index_dir=None):
+    """Location of the cached seek-point index of ``gz_path``."""
+    if index_dir is None:
+        return gz_path + INDEX_SUFFIX
+    return os.path.join(index_dir, os.path.basename(gz_path) + INDEX_SUFFIX)
+
+
+def build_index(gz_path, index_dir=None, spacing=DEFAULT_SPACING):
+    """
+    Build the seek-point index of ``gz_path`` (one full inflate pass) and cache
+    it next to the file, or in ``index_dir``. Existing indexes are reused.
+    """
+    if indexed_gzip is None:
+        raise ImportError("indexed_gzip is required to build gzip indexes")
+    path = index_path(gz_path, index_dir)
+    if os.path.exists(path):
+        return path
+    if index_dir is not None:
+        os.makedirs(index_dir, exist_ok=True)
+    with indexed_gzip.IndexedGzipFile(gz_path, spacing=spacing) as f:
+        f.build_full_index()
+        # Write to a temporary file first so an interrupted build is never picked up
+        f.export_index(path + ".tmp")
+        n_points = len(list(f.seek_points()))
+    os.replace(path + ".tmp", path)
+    logging.info(f"Built index for {gz_path} with {n_points} seek points")
+    return path
+
+
+def open_indexed(gz_path, index_dir=None, spacing=DEFAULT_SPACING):
+    """Open ``gz_path`` as a seekable binary file, building its index if necessary."""
+    path = build_index(gz_path, index_dir, spacing)
+    return indexed_gzip.IndexedGzipFile(gz_path, spacing=spacing, index_file=path)
+
+
+def uncompressed_size(gz_path, index_dir=None):
+    with open_indexed(gz_path, index_dir) as f:
+        return f.seek(0, os.SEEK_END)
+
+
+def split_gz_ranges(gz_path, n_ranges, index_dir=None, min_range_size=64 << 20):
+    """
+    Split the uncompressed data of ``gz_path`` into at most ``n_ranges``
+    contiguous (start, end) byte ranges. Without ``indexed_gzip`` the whole file
+    is returned as a single range, since it can only be read sequentially.
+    """
+    if indexed_gzip is None or n_ranges <= 1:
+        return [(0, None)]
+    size = uncompressed_size(gz_path, index_dir)
+    n_ranges = max(1, min(n_ranges, size // min_range_size))
+    step = size // n_ranges
+    bounds = [i * step for i in range(n_ranges)] + [size]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _skip(f, n_bytes):
+    """Decompress and discard ``n_bytes`` (sequential fallback for seeking)."""
+    while n_bytes > 0:
+        data = f.read(min(n_bytes, READ_SIZE))
+        if not data:
+            break
+        n_bytes -= len(data)
+
+
+def _open_at(gz_path, offset, index_dir=None):
+    """Open ``gz_path`` positioned at uncompressed byte ``offset``."""
+    if indexed_gzip is not None and offset > 0:
+        f = open_indexed(gz_path, index_dir)
+        f.seek(offset)
+    else:
+        f = gzip.open(gz_path, "rb")
+        _skip(f, offset)
+    return f
+
+
+def iter_gz_range_lines(gz_path, start=0, end=None, index_dir=None):
+    """
+    Yield the uncompressed lines (bytes) of ``gz_path`` that start inside
+    ``[start, end)``; ``end=None`` reads to the end of the file.
+
+    Uses the same ownership rule as ``byte_ranges.iter_range_lines``, so
+    consecutive ranges yield every line exactly once and in file order. With
+    ``indexed_gzip`` the reader seeks to ``start`` via the nearest seek point;
+    otherwise the file is inflated from the beginning and skipped.
+    """
+    if end is None:
+        end = float("inf")
+    with _open_at(gz_path, max(start - 1, 0), index_dir) as f:
+        pos = start
+        if start > 0:
+            pos = start - 1 + len(f.readline())
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+
+def iter_gz_range_blocks(gz_path, start=0, end=None, index_dir=None, block_size=BLOCK_SIZE):
+    """Block-wise variant of ``iter_gz_range_lines``, see ``byte_ranges.iter_file_blocks``."""
+    with _open_at(gz_path, max(start - 1, 0), index_dir) as f:
+        yield from iter_file_blocks(f, start, end, block_size)
+
+
+def cat_range(gz_path, start, end, index_dir=None, out=None):
+    out = out or sys.stdout.buffer
+    for line in iter_gz_range_lines(gz_path, start, end, index_dir):
+        out.write(line)
+    out.flush()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Seek-point indexes for random access into .gz files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build and cache indexes for .gz files.")
+    build_parser.add_argument("gz_paths", nargs="+", help="Paths to .gz files.")
+    build_parser.add_argument("--index_dir", type=str, default=None, help="Directory for the index files.")
+    build_parser.add_argument(
+        "--spacing", type=int, default=DEFAULT_SPACING, help="Uncompressed bytes between seek points."
+    )
+
+    ranges_parser = subparsers.add_parser("ranges", help="Print line-aligned chunk boundaries of a .gz file.")
+    ranges_parser.add_argument("gz_path", help="Path to the .gz file.")
+    ranges_parser.add_argument("n_ranges", type=int, help="Number of chunks.")
+    ranges_parser.add_argument("--index_dir", type=str, default=None, help="Directory for the index files.")
+
+    cat_parser = subparsers.add_parser("cat", help="Write the lines of an uncompressed byte range to stdout.")
+    cat_parser.add_argument("gz_path", help="Path to the .gz file.")
+    cat_parser.add_argument("--start", type=int, default=0, help="First uncompressed byte of the range.")
+    cat_parser.add_argument("--end", type=int, default=None, help="End of the range (exclusive).")
+    cat_parser.add_argument("--index_dir", type=str, default=None, help="Directory for the index files.")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        for gz_path in args.gz_paths:
+            build_index(gz_path, args.index_dir, args.spacing)
+    elif args.command == "ranges":
+        for start, end in split_gz_ranges(args.gz_path, args.n_ranges, args.index_dir):
+            print(start, "" if end is None else end)
+    else:
+        try:
+            cat_range(args.gz_path, args.start, args.end, args.index_dir)
+        except BrokenPipeError:
+            # Allow piping into head and similar tools
+            sys.stderr.close()
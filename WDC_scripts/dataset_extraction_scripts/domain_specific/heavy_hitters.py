@@ -0,0 +1,190 @@
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+
+SKETCH_DIR = ".sketches"
+DEFAULT_CAPACITY = 1 << 16
+DEFAULT_KMV_SIZE = 4096
+HASH_RANGE = float(1 << 64)
+
+
+def sketch_dir(dataset_dir):
+    return os.path.join(dataset_dir, SKETCH_DIR)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class DomainSketch:
+    """
+    Mergeable summary of per-domain line counts for choosing the heaviest domains.
+
+    ``counts`` keeps at most ``capacity`` domains as ``[upper, lower]`` bounds
+    of their true line count, and the true count of any untracked domain is at
+    most ``floor`` (SpaceSaving-style bounds, which survive ``merge``). Sketches
+    of parts that may share lines, such as the per-chunk deduplicated counts of
+    shard-mode extraction, are marked ``overlapping``: their upper bounds still
+    add up, but a merged lower bound is only the largest of the parts. A
+    k-minimum-values sketch over the domain hashes estimates the number of
+    distinct domains with a relative standard error of about ``1 / sqrt(kmv_size)``.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, kmv_size=DEFAULT_KMV_SIZE, overlapping=False):
+        self.capacity = capacity
+        self.kmv_size = kmv_size
+        self.overlapping = overlapping
+        self.counts = {}
+        self.floor = 0
+        self.total = 0
+        self.kmv = []
+        # Known only for a sketch made directly from complete counts
+        self.distinct = None
+
+    @classmethod
+    def from_counts(cls, counts, capacity=DEFAULT_CAPACITY, kmv_size=DEFAULT_KMV_SIZE, overlapping=False):
+        """Summarise exact ``{domain: lines}`` counts, e.g. those of one extraction chunk."""
+        sketch = cls(capacity, kmv_size, overlapping)
+        sketch.total = sum(counts.values())
+        sketch.distinct = len(counts)
+        sketch.kmv = heapq.nsmallest(kmv_size, {_hash(domain) for domain in counts})
+        sketch._truncate({domain: [count, count] for domain, count in counts.items()})
+        return sketch
+
+    def _truncate(self, counts):
+        if len(counts) > self.capacity:
+            kept = heapq.nlargest(self.capacity + 1, counts.items(), key=lambda item: item[1][0])
+            self.floor = max(self.floor, kept[-1][1][0])
+            counts = dict(kept[:-1])
+        self.counts = counts
+
+    def merge(self, other):
+        """Combine with the sketch of another part of the data."""
+        overlapping = self.overlapping or other.overlapping
+        counts = {}
+        for domain in self.counts.keys() | other.counts.keys():
+            upper_a, lower_a = self.counts.get(domain, (self.floor, 0))
+            upper_b, lower_b = other.counts.get(domain, (other.floor, 0))
+            lower = max(lower_a, lower_b) if overlapping else lower_a + lower_b
+            counts[domain] = [upper_a + upper_b, lower]
+        self.overlapping = overlapping
+        self.distinct = None
+        self.floor += other.floor
+        self.total += other.total
+        self.kmv = heapq.nsmallest(self.kmv_size, set(self.kmv) | set(other.kmv))
+        self._truncate(counts)
+        return self
+
+    def distinct_estimate(self):
+        """Estimated number of distinct domains and its standard error."""
+        if self.distinct is not None:
+            return self.distinct, 0.0
+        if len(self.kmv) < self.kmv_size:
+            return len(self.kmv), 0.0
+        estimate = (self.kmv_size - 1) / ((self.kmv[-1] + 1) / HASH_RANGE)
+        return estimate, estimate / math.sqrt(self.kmv_size - 2)
+
+    def top(self, fraction=0.01):
+        """
+        Candidates for the ``fraction`` heaviest domains, using the same cut as
+        ``create_linking_dataset.py`` (everything above the ``1 - fraction``
+        quantile of the domains). Returns ``(n_top, candidates, guaranteed)``:
+        every domain that may belong to the top set is a candidate, and the
+        guaranteed ones belong to it whatever the sketch error.
+        """
+        distinct, _ = self.distinct_estimate()
+        distinct = int(round(distinct))
+        n_top = distinct - int((1 - fraction) * distinct)
+        ranked = sorted(self.counts.items(), key=lambda item: item[1][0], reverse=True)
+        if n_top == 0 or not ranked:
+            return n_top, [], []
+        lowers = sorted((lower for _, lower in self.counts.values()), reverse=True)
+        # A domain can be in the top set only if its upper bound reaches the n_top-th largest lower bound
+        cut = lowers[n_top - 1] if n_top <= len(lowers) else 0
+        candidates = [domain for domain, (upper, _) in ranked if upper >= cut]
+        # It is certainly in the top set if its lower bound beats every other domain's upper bound
+        outside = ranked[n_top][1][0] if n_top < len(ranked) else self.floor
+        outside = max(outside, self.floor)
+        guaranteed = [domain for domain, (_, lower) in ranked[:n_top] if lower > outside]
+        return n_top, candidates, guaranteed
+
+    def save(self, path):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "capacity": self.capacity,
+                "kmv_size": self.kmv_size,
+                "overlapping": self.overlapping,
+                "distinct": self.distinct,
+                "floor": self.floor,
+                "total": self.total,
+                "kmv": self.kmv,
+                "counts": self.counts,
+            }, f)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        sketch = cls(state["capacity"], state["kmv_size"], state["overlapping"])
+        sketch.distinct = state["distinct"]
+        sketch.floor = state["floor"]
+        sketch.total = state["total"]
+        sketch.kmv = state["kmv"]
+        sketch.counts = state["counts"]
+        return sketch
+
+
+def merge_sketch_dir(sketch_dir):
+    """Merge all partial sketches of a dataset written so far, or None if there are none."""
+    sketch = None
+    for path in sorted(glob.glob(os.path.join(sketch_dir, "*.json"))):
+        partial = DomainSketch.load(path)
+        sketch = partial if sketch is None else sketch.merge(partial)
+    return sketch
+
+
+def write_plan(sketch, plan_path, fraction=0.01):
+    """Write the approximate top domains with their count bounds for ``create_linking_dataset.py``."""
+    n_top, candidates, guaranteed = sketch.top(fraction)
+    distinct, distinct_error = sketch.distinct_estimate()
+    plan = {
+        "fraction": fraction,
+        "total_lines": sketch.total,
+        "distinct_domains": round(distinct),
+        "distinct_domains_std_error": round(distinct_error),
+        "untracked_max_count": sketch.floor,
+        "n_top": n_top,
+        "guaranteed": guaranteed,
+        "candidates": [
+            {"domain": domain, "upper": sketch.counts[domain][0], "lower": sketch.counts[domain][1]}
+            for domain in candidates
+        ],
+    }
+    with open(plan_path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=1)
+    logging.info(
+        f"Planned top {n_top} of ~{round(distinct)} domains: {len(candidates)} candidates, {len(guaranteed)} guaranteed"
+    )
+    return plan
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Merge partial domain sketches into a linking-dataset plan.")
+    parser.add_argument("dataset_dir", type=str, help="Domain dataset directory containing .sketches.")
+    parser.add_argument("plan_file", type=str, help="Output JSON with the approximate top domains.")
+    parser.add_argument("--fraction", type=float, default=0.01, help="Share of domains to select.")
+    args = parser.parse_args()
+
+    sketch = merge_sketch_dir(sketch_dir(args.dataset_dir))
+    if sketch is None:
+        raise SystemExit(f"No sketches in {sketch_dir(args.dataset_dir)}")
+    write_plan(sketch, args.plan_file, args.fraction)
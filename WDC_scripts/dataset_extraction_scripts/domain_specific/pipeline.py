@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+_DONE = object()
+
+
+class StageTimings:
+    """
+    Busy and waiting time of the stages of a pipeline. A stage that is busy
+    most of the time while the others wait on their queues is the bottleneck.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = {}
+        self.wait = {}
+
+    def add(self, stage, busy=0.0, wait=0.0):
+        with self.lock:
+            self.busy[stage] = self.busy.get(stage, 0.0) + busy
+            self.wait[stage] = self.wait.get(stage, 0.0) + wait
+
+    def merge(self, other):
+        for stage in other.busy:
+            self.add(stage, other.busy[stage], other.wait[stage])
+
+    def __getstate__(self):
+        return {"busy": self.busy, "wait": self.wait}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.busy = state["busy"]
+        self.wait = state["wait"]
+
+    @contextmanager
+    def measure(self, stage, kind="busy"):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add(stage, **{kind: elapsed})
+
+    def summary(self):
+        return ", ".join(
+            f"{stage} busy {self.busy[stage]:.1f}s / waiting {self.wait[stage]:.1f}s" for stage in self.busy
+        )
+
+    def log(self, prefix="Stage timings"):
+        logging.info(f"{prefix}: {self.summary()}")
+
+
+def prefetch(iterable, maxsize, timings, stage, consumer_stage=None):
+    """
+    Iterate ``iterable`` in a background thread, at most ``maxsize`` items
+    ahead of the consumer. Exceptions of the producer are raised in the
+    consumer. Waiting on the full queue is the producer's backpressure; time
+    spent waiting on the empty queue is counted for ``consumer_stage``.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            iterator = iter(iterable)
+            while not stop.is_set():
+                with timings.measure(stage):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                with timings.measure(stage, "wait"):
+                    items.put(item)
+            items.put(_DONE)
+        except BaseException as e:
+            items.put(e)
+
+    thread = threading.Thread(target=produce, name=f"{stage}-thread", daemon=True)
+    thread.start()
+    try:
+        while True:
+            if consumer_stage is None:
+                item = items.get()
+            else:
+                with timings.measure(consumer_stage, "wait"):
+                    item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on the full queue so that it can exit
+        while thread.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+class AsyncWorker:
+    """
+    Runs ``fn(*args)`` for submitted jobs in a background thread, in order.
+    ``submit`` blocks while ``max_pending`` jobs are queued or running, which
+    bounds the memory held by pending jobs. Exceptions of a job are raised by
+    the next ``submit`` or by ``close``.
+    """
+
+    def __init__(self, fn, timings, stage, max_pending=1):
+        self.fn = fn
+        self.timings = timings
+        self.stage = stage
+        self.slots = threading.Semaphore(max_pending)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name=f"{stage}-thread", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            with self.timings.measure(self.stage, "wait"):
+                args = self.jobs.get()
+            if args is _DONE:
+                return
+            try:
+                if self.error is None:
+                    with self.timings.measure(self.stage):
+                        self.fn(*args)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.slots.release()
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, *args):
+        self._raise()
+        self.slots.acquire()
+        self._raise()
+        self.jobs.put(args)
+
+    def close(self):
+        self.jobs.put(_DONE)
+        self.thread.join()
+        self._raise()
@@ -0,0 +1,166 @@
+import heapq
+import logging
+import os
+import shutil
+
+from joblib import Parallel, delayed
+
+from byte_ranges import iter_range_lines
+from domain_container import ContainerWriter, DomainDataset, read_chunks
+from domain_counts import add_counts
+from domain_profile import ProfileWriter
+from domain_shards import ShardedOutput, load_manifest, write_manifest
+from file_assembly import copy_to_file
+
+
+def write_shard(shard_dir, local_output_dict, filename_fn):
+    """
+    Write the lines of one worker as a shard: a container with one record per
+    domain file holding the sorted, deduplicated lines of that domain.
+    ``local_output_dict`` maps domains to lists of byte strings of whole lines.
+    Returns the number of unique lines per domain file.
+    """
+    records = {}
+    for domain, runs in local_output_dict.items():
+        records.setdefault(filename_fn(domain), []).extend(runs)
+    writer = ContainerWriter(shard_dir)
+    line_counts = {}
+    for name in sorted(records):
+        # Sort with the newline attached, as the merge compares whole lines
+        lines = {line + b"\n" for line in b"".join(records[name]).split(b"\n")[:-1]}
+        writer.add(name, [b"".join(sorted(lines))])
+        line_counts[name] = len(lines)
+    writer.close()
+    return line_counts
+
+
+STAGING_DIR = ".merging"
+
+
+def existing_files(output_dir, name, manifest):
+    """The files (sub-shards in order) that an earlier merge wrote for the domain file ``name``."""
+    if name in manifest:
+        return manifest[name]
+    return [name] if os.path.exists(os.path.join(output_dir, name)) else []
+
+
+def plan_merge(shard_dirs, output_dir, manifest):
+    """
+    Map every domain file name to the (path, offset, length, lines) records of
+    all shards, in shard order, followed by the files an earlier merge wrote
+    for it (``lines`` is None for those).
+    """
+    plan = {}
+    for shard_dir in shard_dirs:
+        dataset = DomainDataset(shard_dir)
+        for name in dataset.names():
+            plan.setdefault(name, []).append(dataset.location(name) + (dataset.line_count(name),))
+    for name, records in plan.items():
+        for existing in existing_files(output_dir, name, manifest):
+            path = os.path.join(output_dir, existing)
+            records.append((path, 0, os.path.getsize(path), None))
+    return plan
+
+
+def _install(output_dir, staging_dir, names, old_names):
+    """Move the merged files of one domain over its old files, removing old sub-shards that are no longer used."""
+    for name in names:
+        os.replace(os.path.join(staging_dir, name), os.path.join(output_dir, name))
+    for name in set(old_names) - set(names):
+        os.remove(os.path.join(output_dir, name))
+
+
+def merge_records(output_dir, items, max_file_bytes=None, profile_part=None, manifest=None):
+    """
+    K-way merge the sorted records of each (name, records) item into
+    ``<output_dir>/<name>``, split into sub-shards above ``max_file_bytes``.
+    The records may include the files of an earlier merge (listed in
+    ``manifest`` when split); such a domain is merged in a staging directory
+    and only then moved over its old files. With ``profile_part`` the
+    class/property profile of every file is written to
+    ``.profile/<profile_part>.npz``. Returns the per-file counts and the
+    sub-shard names of every file.
+    """
+    counts = {}
+    shards = {}
+    manifest = manifest or {}
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    profiles = ProfileWriter(output_dir, profile_part) if profile_part is not None else None
+    for name, records in items:
+        old_names = existing_files(output_dir, name, manifest)
+        if not old_names and len(records) == 1 and (not max_file_bytes or records[0][2] <= max_file_bytes):
+            # A domain seen by a single worker is already sorted and unique
+            path, offset, length, lines = records[0]
+            copy_to_file(path, offset, length, os.path.join(output_dir, name))
+            if profiles is not None:
+                # Read back from the page cache right after the copy
+                profiles.profile(name, read_chunks(path, offset, length))
+            add_counts(counts, name, lines, length)
+            shards[name] = [name]
+            continue
+        sources = [iter_range_lines(path, offset, offset + length) for path, offset, length, _ in records]
+        lines = size = 0
+        previous = None
+        out = ShardedOutput(staging_dir if old_names else output_dir, name, max_file_bytes)
+        merged = heapq.merge(*sources)
+        if profiles is not None:
+            merged = profiles.track(name, merged)
+        for line in merged:
+            if line != previous:
+                if previous is not None and line < previous:
+                    out.close()
+                    raise ValueError(
+                        f"{name} in {output_dir} is not sorted; shard mode only merges into the files of an earlier shard merge"
+                    )
+                out.write(line)
+                lines += 1
+                size += len(line)
+                previous = line
+        out.close()
+        if old_names:
+            _install(output_dir, staging_dir, out.names(), old_names)
+        add_counts(counts, name, lines, size)
+        shards[name] = out.names()
+    if profiles is not None:
+        profiles.close()
+    return counts, shards
+
+
+def merge_shards(
+    shard_dirs, output_dir, n_jobs=-1, batches_per_job=8, max_file_bytes=None, profile=False, profile_prefix="merge"
+):
+    """
+    Write every domain file exactly once as the sorted union of its shard
+    records and of the file an earlier merge wrote for it, so runs on further
+    input files add to the dataset. Each file is written by one worker only
+    and its content does not depend on the number of workers or on the order
+    in which shards were produced; merging the same shards twice gives the
+    same files. With ``profile`` the merge also writes the class/property
+    profiles of the domain files (see ``domain_profile``) to parts named
+    ``<profile_prefix>-<batch>``. Returns the counts of the merged files.
+    """
+    manifest = load_manifest(output_dir)
+    plan = plan_merge(shard_dirs, output_dir, manifest)
+    names = sorted(plan)
+    n_batches = max(1, min(len(names), (os.cpu_count() if n_jobs < 0 else n_jobs) * batches_per_job))
+    batches = [names[i::n_batches] for i in range(n_batches)]
+    logging.info(f"Merging {len(shard_dirs)} shards into {len(names)} domain files in {n_batches} batches")
+    os.makedirs(os.path.join(output_dir, STAGING_DIR), exist_ok=True)
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(merge_records)(
+            output_dir,
+            [(name, plan[name]) for name in batch],
+            max_file_bytes,
+            f"{profile_prefix}-{i:05d}" if profile else None,
+            {name: manifest[name] for name in batch if name in manifest},
+        )
+        for i, batch in enumerate(batches)
+    )
+    shutil.rmtree(os.path.join(output_dir, STAGING_DIR))
+    counts = {}
+    for partial_counts, partial_shards in results:
+        for name, (lines, size) in partial_counts.items():
+            add_counts(counts, name, lines, size)
+        manifest.update(partial_shards)
+    write_manifest(output_dir, manifest)
+    return counts
@@ -0,0 +1,82 @@
+import logging
+import os
+import random
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DICTIONARY_FILE = "dictionary.zstd"
+DEFAULT_DICT_SIZE = 112 << 10
+DEFAULT_LEVEL = 9
+SAMPLE_BYTES = 64 << 20
+RECORD_SAMPLE_BYTES = 64 << 10
+
+
+def dictionary_path(dataset_dir):
+    return os.path.join(dataset_dir, DICTIONARY_FILE)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstandard is required for zstd-compressed domain datasets")
+
+
+def collect_samples(names, read_head, sample_bytes=SAMPLE_BYTES, seed=0):
+    """
+    Training samples for a dictionary: the first lines (up to
+    ``RECORD_SAMPLE_BYTES``) of randomly chosen records, until ``sample_bytes``
+    are collected. ``read_head(name, n)`` returns at least the first ``n``
+    bytes of a record, or all of it if it is shorter.
+    """
+    names = list(names)
+    random.Random(seed).shuffle(names)
+    samples = []
+    total = 0
+    for name in names:
+        head = read_head(name, RECORD_SAMPLE_BYTES)
+        if len(head) > RECORD_SAMPLE_BYTES:
+            head = head[:head.rfind(b"\n", 0, RECORD_SAMPLE_BYTES) + 1] or head[:RECORD_SAMPLE_BYTES]
+        if not head:
+            continue
+        samples.append(head)
+        total += len(head)
+        if total >= sample_bytes:
+            break
+    return samples
+
+
+def train_dictionary(samples, dict_size=DEFAULT_DICT_SIZE):
+    """Train a zstd dictionary on byte string samples."""
+    _require_zstandard()
+    dictionary = zstandard.train_dictionary(dict_size, samples)
+    logging.info(f"Trained a {len(dictionary.as_bytes()) >> 10} KB dictionary on {len(samples)} samples")
+    return dictionary
+
+
+def write_dictionary(dataset_dir, dictionary):
+    path = dictionary_path(dataset_dir)
+    with open(path + ".tmp", "wb") as f:
+        f.write(dictionary.as_bytes())
+    os.replace(path + ".tmp", path)
+
+
+def load_dictionary(dataset_dir):
+    """The dictionary of a compressed dataset, or None if the dataset is not compressed."""
+    path = dictionary_path(dataset_dir)
+    if not os.path.exists(path):
+        return None
+    _require_zstandard()
+    with open(path, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+def compressor(dictionary, level=DEFAULT_LEVEL):
+    _require_zstandard()
+    return zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+
+
+def decompressor(dictionary):
+    # Decompressors are not safe for concurrent use, so readers create one per record
+    return zstandard.ZstdDecompressor(dict_data=dictionary)
@@ -6,12 +6,50 @@ LOG_DIR="$OUTPUT_DIR/logs"
 TRAIN_DIR="$OUTPUT_DIR/train"
 TEST_DIR="$OUTPUT_DIR/test"
 VAL_DIR="$OUTPUT_DIR/val"
+SKETCH_DIR="$OUTPUT_DIR/sketches"
+# Per-job directory for the train entity fingerprints and completion markers of the ranks
+SYNC_DIR="$OUTPUT_DIR/sync_${SLURM_JOB_ID:-local}"
+# Directory of the Python helpers (the working directory, like SOURCE_DIR); under sbatch
+# $0 is a copy in the spool directory, so it cannot be used to find them
+SCRIPT_DIR="${SCRIPT_DIR:-.}"
+SPLIT_SCRIPT="${SPLIT_SCRIPT:-$SCRIPT_DIR/train_test_val/split_dataset.py}"
+HLL_SCRIPT="${HLL_SCRIPT:-$SCRIPT_DIR/compressed_data/hyperloglog.py}"
+SPLIT_WORKERS="${SLURM_CPUS_PER_TASK:-1}"
+# Set SPLIT_SEED for another reproducible split; set FILTER_UNSEEN=1 to drop test/val
+# triples with an entity that occurs in no train split of any rank
+SPLIT_SEED="${SPLIT_SEED:-0}"
+# Seconds a rank waits for the others before giving up
+SYNC_TIMEOUT="${SYNC_TIMEOUT:-86400}"
+SYNC_POLL="${SYNC_POLL:-10}"
 
-mkdir -p "$LOG_DIR" "$TRAIN_DIR" "$TEST_DIR" "$VAL_DIR"
+mkdir -p "$LOG_DIR" "$TRAIN_DIR" "$TEST_DIR" "$VAL_DIR" "$SKETCH_DIR" "$SYNC_DIR"
 
 LOG_FILE="$LOG_DIR/mpi_process_$SLURM_PROCID.log"
 echo "Process $SLURM_PROCID started at $(date)" > "$LOG_FILE"
 
+# Every exit path leaves a marker, so the other ranks never wait on a rank that is gone:
+# done_<rank> after a successful split, failed_<rank> otherwise
+rm -f "$SYNC_DIR/done_$SLURM_PROCID" "$SYNC_DIR/failed_$SLURM_PROCID" "$SYNC_DIR/train_entities_$SLURM_PROCID.npy"
+trap '[ -e "$SYNC_DIR/done_$SLURM_PROCID" ] || touch "$SYNC_DIR/failed_$SLURM_PROCID"' EXIT
+
+# Ranks with a file in SYNC_DIR named like the regex $1 (ending in the rank) or a failure marker
+ranks_reported() {
+    ls "$SYNC_DIR" | grep -E "^($1|failed_[0-9]+)$" | sed -E 's/^[a-z_]+_([0-9]+).*/\1/' | sort -un
+}
+
+# Wait until every rank wrote a file matching $1 or failed; returns 1 after SYNC_TIMEOUT seconds
+wait_for_ranks() {
+    local waited=0
+    while [ "$(ranks_reported "$1" | wc -l)" -lt "$SLURM_NTASKS" ]; do
+        if [ "$waited" -ge "$SYNC_TIMEOUT" ]; then
+            echo "Timed out after ${waited}s waiting for $1 markers; ranks reported: $(ranks_reported "$1" | tr '\n' ' ')" >> "$LOG_FILE"
+            return 1
+        fi
+        sleep "$SYNC_POLL"
+        waited=$((waited + SYNC_POLL))
+    done
+}
+
 FILE_NAME="combined_file_$SLURM_PROCID.txt"
 FILE_PATH="$SOURCE_DIR/$FILE_NAME"
 
@@ -22,34 +60,57 @@ if [ ! -f "$FILE_PATH" ]; then
     exit 1
 fi
 
-TOTAL_LINES=$(wc -l < "$FILE_PATH")
-TRAIN_LINES=$((TOTAL_LINES * 80 / 100))
-TEST_LINES=$((TOTAL_LINES * 10 / 100))
-VAL_LINES=$((TOTAL_LINES - TRAIN_LINES - TEST_LINES))
+TRAIN_FILE="$TRAIN_DIR/train_$SLURM_PROCID.txt"
+TEST_FILE="$TEST_DIR/test_$SLURM_PROCID.txt"
+VAL_FILE="$VAL_DIR/val_$SLURM_PROCID.txt"
+SKETCH_FILE="$SKETCH_DIR/sketch_$SLURM_PROCID.npz"
+rm -f "$SKETCH_FILE"
 
-# shuf "$FILE_PATH" | tee >(head -n $TRAIN_LINES > "$TRAIN_DIR/train_$SLURM_PROCID.txt") \
-#      | tail -n +$(($TRAIN_LINES + 1)) | head -n $TEST_LINES > "$TEST_DIR/test_$SLURM_PROCID.txt" \
-#      | tail -n +$(($TRAIN_LINES + $TEST_LINES + 1)) > "$VAL_DIR/val_$SLURM_PROCID.txt"
+# Each triple goes to train/test/val (80/10/10) by a seeded hash of the triple, so the
+# split is shuffled, reproducible and independent of the rank; the triple counts and
+# HyperLogLog sketches of the entities and relations of each split are built in the same pass
+if [ -n "$FILTER_UNSEEN" ]; then
+    python "$SPLIT_SCRIPT" split "$FILE_PATH" --train "$TRAIN_FILE" --test "$TEST_FILE" --val "$VAL_FILE" \
+        --seed "$SPLIT_SEED" --workers "$SPLIT_WORKERS" --sketch "$SKETCH_FILE" \
+        --train_entities "$SYNC_DIR/train_entities_$SLURM_PROCID.npy" 2>> "$LOG_FILE" || exit 1
 
-head -n $TRAIN_LINES "$FILE_PATH" > "$TRAIN_DIR/train_$SLURM_PROCID.txt"
-tail -n +$(($TRAIN_LINES + 1)) | head -n $TEST_LINES "$FILE_PATH" > "$TEST_DIR/test_$SLURM_PROCID.txt"
-tail -n $VAL_LINES "$FILE_PATH" > "$VAL_DIR/val_$SLURM_PROCID.txt"
+    # The filter needs the train entities of every rank; failed ranks are left out of
+    # the final train split too, so the filter does not wait for them
+    wait_for_ranks "train_entities_[0-9]+\.npy" || exit 1
+    python "$SPLIT_SCRIPT" filter --test "$TEST_FILE" --val "$VAL_FILE" \
+        --train_entities "$SYNC_DIR/train_entities_*.npy" --workers "$SPLIT_WORKERS" --sketch "$SKETCH_FILE" 2>> "$LOG_FILE" || exit 1
+else
+    python "$SPLIT_SCRIPT" split "$FILE_PATH" --train "$TRAIN_FILE" --test "$TEST_FILE" --val "$VAL_FILE" \
+        --seed "$SPLIT_SEED" --workers "$SPLIT_WORKERS" --sketch "$SKETCH_FILE" 2>> "$LOG_FILE" || exit 1
+fi
+touch "$SYNC_DIR/done_$SLURM_PROCID"
 
 echo "Process $SLURM_PROCID completed at $(date)" >> "$LOG_FILE"
 
 wait
 
 if [ $SLURM_PROCID -eq 0 ]; then
-    cat "${TRAIN_DIR}/train_"*.txt > "${OUTPUT_DIR}/final_train.txt"
-    cat "${TEST_DIR}/test_"*.txt > "${OUTPUT_DIR}/final_test.txt"
-    cat "${VAL_DIR}/val_"*.txt > "${OUTPUT_DIR}/final_val.txt"
+    wait_for_ranks "done_[0-9]+"
+    # Only the splits of ranks that finished are combined; the others are reported
+    DONE_RANKS=$(ls "$SYNC_DIR" | sed -nE 's/^done_([0-9]+)$/\1/p' | sort -n)
+    if [ "$(echo "$DONE_RANKS" | grep -c .)" -lt "$SLURM_NTASKS" ]; then
+        echo "Combining the splits of ranks $(echo $DONE_RANKS) only; the other ranks failed or timed out" >> "$LOG_FILE"
+        COMBINE_STATUS=1
+    fi
+
+    for rank in $DONE_RANKS; do cat "${TRAIN_DIR}/train_$rank.txt"; done > "${OUTPUT_DIR}/final_train.txt"
+    for rank in $DONE_RANKS; do cat "${TEST_DIR}/test_$rank.txt"; done > "${OUTPUT_DIR}/final_test.txt"
+    for rank in $DONE_RANKS; do cat "${VAL_DIR}/val_$rank.txt"; done > "${OUTPUT_DIR}/final_val.txt"
 
+    # Merging the per-rank sketches replaces re-reading the final files for the statistics
+    python "$HLL_SCRIPT" merge $(for rank in $DONE_RANKS; do echo "$SKETCH_DIR/sketch_$rank.npz"; done) \
+        -o "$OUTPUT_DIR/split_stats.json" 2>> "$LOG_FILE"
     for dtype in train test val
     do
-        awk '{print $1; print $3}' "$OUTPUT_DIR/final_${dtype}.txt" | sort | uniq > "$OUTPUT_DIR/unique_entities_${dtype}.txt"
-        awk '{print $2}' "$OUTPUT_DIR/final_${dtype}.txt" | sort | uniq > "$OUTPUT_DIR/unique_relations_${dtype}.txt"
-        wc -l "$OUTPUT_DIR/final_${dtype}.txt" > "$OUTPUT_DIR/total_triples_${dtype}.txt"
+        python -c "import json, sys; print(json.load(open(sys.argv[1]))[sys.argv[2]]['triples'])" \
+            "$OUTPUT_DIR/split_stats.json" "$dtype" > "$OUTPUT_DIR/total_triples_${dtype}.txt"
     done
 
     echo "Datasets combined and unique items calculated." >> "$LOG_FILE"
+    exit "${COMBINE_STATUS:-0}"
 fi
@@ -0,0 +1,337 @@
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from hyperloglog import DEFAULT_PRECISION, TripleSketch, hash_items, load_sketches, save_sketches, summarize  # noqa: E402
+from transform_triples import BLOCK_SIZE, imap_bounded, iter_blocks  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+SPLITS = ("train", "test", "val")
+DEFAULT_RATIOS = (80, 10, 10)
+DEFAULT_SEED = 0
+# Train entity fingerprints buffered before they are merged into the sorted set
+COMPACT_EVERY = 1 << 25
+
+
+def _split_lines(block):
+    lines = block.split(b"\n")
+    if block.endswith(b"\n"):
+        lines.pop()
+    return lines
+
+
+def _join_lines(lines):
+    return b"\n".join(lines) + b"\n" if lines else b""
+
+
+class HashSplitter:
+    """
+    Assigns each line to train, test or val by a keyed 64-bit blake2b hash of
+    the line, with the hash range cut in proportion to ``ratios``. The split
+    of a triple depends only on the triple and the seed, not on its position,
+    file or rank, so ranks split their files without coordination, results are
+    reproducible, and duplicates of a triple always land in the same split.
+    """
+
+    def __init__(self, ratios=DEFAULT_RATIOS, seed=DEFAULT_SEED):
+        if len(ratios) != len(SPLITS) or min(ratios) < 0 or not sum(ratios):
+            raise ValueError(f"Expected {len(SPLITS)} non-negative ratios for {', '.join(SPLITS)}, got {ratios}")
+        cumulative = np.cumsum(ratios)[:-1] / sum(ratios)
+        self.bounds = np.array([min(int(c * 2.0**64), 2**64 - 1) for c in cumulative], dtype=np.uint64)
+        self.key = seed.to_bytes(8, "little")
+
+    def assign(self, lines):
+        """Split index (into ``SPLITS``) of each line."""
+        digests = b"".join(hashlib.blake2b(line, digest_size=8, key=self.key).digest() for line in lines)
+        return np.searchsorted(self.bounds, np.frombuffer(digests, dtype="<u8"), side="right")
+
+
+def sketch_lines(lines, sketch):
+    """
+    Add triple lines, split into fields like ``awk``, to ``sketch``; returns
+    the 64-bit hashes of their distinct entities (columns 1 and 3).
+    """
+    entities, relations = set(), set()
+    for line in lines:
+        fields = line.split(None, 3)
+        if not fields:
+            continue
+        sketch.triples += 1
+        entities.add(fields[0])
+        if len(fields) > 1:
+            relations.add(fields[1])
+        if len(fields) > 2:
+            entities.add(fields[2])
+    hashes = hash_items(entities)
+    sketch.entities.add_hashes(hashes)
+    sketch.relations.add_hashes(hash_items(relations))
+    return hashes
+
+
+class EntityFingerprints:
+    """
+    Sorted, distinct 64-bit hashes of the train entities, 8 bytes per entity.
+    With 10^9 entities, the chance that an unseen entity collides with a train
+    entity is below 10^-10 per lookup.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.buffered = 0
+        self.known = np.zeros(0, dtype=np.uint64)
+
+    def add(self, hashes):
+        self.parts.append(hashes)
+        self.buffered += len(hashes)
+        if self.buffered >= COMPACT_EVERY:
+            self.compact()
+
+    def compact(self):
+        if self.parts:
+            self.known = np.unique(np.concatenate([self.known, *self.parts]))
+            self.parts = []
+            self.buffered = 0
+        return self.known
+
+    def contains(self, hashes):
+        known = self.compact()
+        if not len(known):
+            return np.zeros(len(hashes), dtype=bool)
+        index = np.minimum(np.searchsorted(known, hashes), len(known) - 1)
+        return known[index] == hashes
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, self.compact())
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, patterns):
+        """Union of the fingerprint files matching ``patterns``, e.g. those of all ranks."""
+        fingerprints = cls()
+        paths = sorted(path for pattern in patterns for path in glob.glob(pattern))
+        for path in paths:
+            fingerprints.add(np.load(path))
+        logging.info(f"Loaded {len(fingerprints.compact())} train entities from {len(paths)} files")
+        return fingerprints
+
+
+_splitter = None
+_precision = None
+_sketched = None
+_collect = False
+# Set before the filter pool forks, so workers share it instead of receiving a copy
+_fingerprints = None
+
+
+def _init_split_worker(splitter, precision, sketched, collect):
+    global _splitter, _precision, _sketched, _collect
+    _splitter = splitter
+    _precision = precision
+    _sketched = sketched
+    _collect = collect
+
+
+def _split_block(block):
+    lines = _split_lines(block)
+    parts = tuple([] for _ in SPLITS)
+    for line, split in zip(lines, _splitter.assign(lines).tolist()):
+        parts[split].append(line)
+    sketches = {}
+    train_entities = None
+    for name, part in zip(SPLITS, parts):
+        if name in _sketched:
+            sketches[name] = TripleSketch(_precision)
+            hashes = sketch_lines(part, sketches[name])
+            if name == "train" and _collect:
+                train_entities = np.sort(hashes)
+    return len(block), [_join_lines(part) for part in parts], sketches, train_entities
+
+
+def split_files(paths, outputs, splitter, workers=1, precision=DEFAULT_PRECISION, sketched=SPLITS,
+                collect_train_entities=False):
+    """
+    Split the triples of ``paths`` into the files ``outputs`` (train, test,
+    val) in one pass, with at most ``2 * workers`` blocks in flight. The
+    workers sketch the triples of the ``sketched`` splits on the way. Returns
+    ``({split: TripleSketch}, EntityFingerprints of train or None)``.
+    """
+    blocks = ((block,) for path in paths for block in iter_blocks(path, BLOCK_SIZE))
+    initargs = (splitter, precision, sketched, collect_train_entities)
+    sketches = {name: TripleSketch(precision) for name in sketched}
+    fingerprints = EntityFingerprints() if collect_train_entities else None
+    files = [open(path, "wb") for path in outputs]
+    try:
+        with tqdm(unit="B", unit_scale=True, desc="Splitting") as progress:
+
+            def write(size, parts, block_sketches, train_entities):
+                for f, part in zip(files, parts):
+                    f.write(part)
+                for name, sketch in block_sketches.items():
+                    sketches[name].merge(sketch)
+                if train_entities is not None:
+                    fingerprints.add(train_entities)
+                progress.update(size)
+
+            if workers <= 1:
+                _init_split_worker(*initargs)
+                for block in blocks:
+                    write(*_split_block(*block))
+            else:
+                with Pool(workers, initializer=_init_split_worker, initargs=initargs) as pool:
+                    for result in imap_bounded(pool, _split_block, blocks, 2 * workers):
+                        write(*result)
+    finally:
+        for f in files:
+            f.close()
+    return sketches, fingerprints
+
+
+def _filter_block(block, precision):
+    lines = _split_lines(block)
+    heads, tails = [], []
+    for line in lines:
+        fields = line.split(None, 3)
+        head = fields[0] if fields else b""
+        heads.append(head)
+        tails.append(fields[2] if len(fields) > 2 else head)
+    seen = _fingerprints.contains(hash_items(heads)) & _fingerprints.contains(hash_items(tails))
+    kept = [line for line, keep in zip(lines, seen.tolist()) if keep]
+    sketch = TripleSketch(precision)
+    sketch_lines(kept, sketch)
+    return len(block), _join_lines(kept), len(lines) - len(kept), sketch
+
+
+def filter_unseen(path, fingerprints, workers=1, precision=DEFAULT_PRECISION):
+    """
+    Drop the triples of ``path`` whose head or tail entity is not among the
+    train ``fingerprints``, in place. Returns ``(TripleSketch of the kept
+    triples, number of dropped triples)``.
+    """
+    global _fingerprints
+    _fingerprints = fingerprints
+    fingerprints.compact()
+    blocks = ((block, precision) for block in iter_blocks(path, BLOCK_SIZE))
+    sketch = TripleSketch(precision)
+    dropped = 0
+    with open(path + ".tmp", "wb") as out, tqdm(unit="B", unit_scale=True, desc=f"Filtering {path}") as progress:
+
+        def write(size, kept, n_dropped, block_sketch):
+            nonlocal dropped
+            out.write(kept)
+            sketch.merge(block_sketch)
+            dropped += n_dropped
+            progress.update(size)
+
+        if workers <= 1:
+            for block in blocks:
+                write(*_filter_block(*block))
+        else:
+            with Pool(workers) as pool:
+                for result in imap_bounded(pool, _filter_block, blocks, 2 * workers):
+                    write(*result)
+    os.replace(path + ".tmp", path)
+    return sketch, dropped
+
+
+def store_sketches(path, sketches):
+    """Add ``{split: TripleSketch}`` to the sketch file ``path``, replacing the sketches of the same splits."""
+    stored = load_sketches(path) if os.path.exists(path) else {}
+    stored.update(sketches)
+    save_sketches(path, stored)
+
+
+def log_summary(sketches):
+    for name, counts in summarize(sketches).items():
+        logging.info(
+            f"{name}: {counts['triples']} triples, ~{counts['unique_entities']} unique entities, "
+            f"~{counts['unique_relations']} unique relations "
+            f"(relative standard error {counts['relative_standard_error']:.2%})"
+        )
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Split triples into train/test/val by a seeded hash, with per-split statistics."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split", help="Split triple files in one pass.")
+    split_parser.add_argument("files", nargs="+", help="Triple files (.gz or plain).")
+    split_parser.add_argument("--ratios", type=float, nargs=3, default=DEFAULT_RATIOS, help="Train, test and val ratios.")
+    split_parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the split hash.")
+    split_parser.add_argument(
+        "--filter_unseen",
+        action="store_true",
+        help="Drop test/val triples with an entity that is not in train, using the train entities of these files.",
+    )
+    split_parser.add_argument(
+        "--train_entities", help="Store the train entity fingerprints (.npy) for a later 'filter' across files."
+    )
+
+    filter_parser = subparsers.add_parser(
+        "filter", help="Drop test/val triples with an entity that is not in the train entities of any file."
+    )
+    filter_parser.add_argument(
+        "--train_entities", nargs="+", required=True, help="Train entity fingerprint files or glob patterns."
+    )
+
+    for sub in (split_parser, filter_parser):
+        if sub is split_parser:
+            sub.add_argument("--train", required=True, help="Output train file.")
+        sub.add_argument("--test", required=True, help="Test file.")
+        sub.add_argument("--val", required=True, help="Validation file.")
+        sub.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of processes.")
+        sub.add_argument("--sketch", help="Store HyperLogLog sketches of the splits (see hyperloglog.py merge).")
+        sub.add_argument(
+            "--precision", type=int, default=DEFAULT_PRECISION, help="log2 of the register count of the sketches."
+        )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    to_filter = {"test": args.test, "val": args.val}
+    sketches = {}
+    if args.command == "split":
+        splitter = HashSplitter(args.ratios, args.seed)
+        # Filtered splits are sketched in the filter pass, which writes their final content
+        deferred = args.filter_unseen or args.train_entities
+        sketches, fingerprints = split_files(
+            args.files,
+            [args.train, args.test, args.val],
+            splitter,
+            workers=args.workers,
+            precision=args.precision,
+            sketched=("train",) if deferred else SPLITS,
+            collect_train_entities=bool(deferred),
+        )
+        if args.train_entities:
+            fingerprints.save(args.train_entities)
+        if not args.filter_unseen:
+            to_filter = {}
+    else:
+        fingerprints = EntityFingerprints.load(args.train_entities)
+    for name, path in to_filter.items():
+        sketches[name], dropped = filter_unseen(path, fingerprints, args.workers, args.precision)
+        logging.info(f"{name}: dropped {dropped} triples with entities not in train")
+    if args.sketch and sketches:
+        store_sketches(args.sketch, sketches)
+    log_summary(sketches)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,13 @@ import time
 import pandas as pd
 import xml.etree.ElementTree as ET
 import xml.dom.minidom as minidom
+import sys
+
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "dataset_extraction_scripts")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from domain_container import DomainDataset  # noqa: E402
+from domain_profile import DatasetProfile  # noqa: E402
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s',)
 
@@ -70,7 +77,7 @@ class RDFProcessor:
         Executes a SPARQL query with retry logic.
     process_directory(directory, class_set)
         Processes all files in a directory.
-    process_file(file_path, class_set)
+    process_file(file_path, class_set, profile_counts=None)
         Processes a single RDF file.
     create_xml(source_class, target_class, idx, file_path, use_property_mapping)
         Creates an XML configuration file for LIMES.
@@ -78,6 +85,8 @@ class RDFProcessor:
         Saves an XML element to a file with pretty formatting.
     query_graph(graph, class_uri)
         Queries a graph to get instance counts and property coverage.
+    query_profile(profile_counts, class_uri)
+        Reads instance counts and property coverage from a precomputed profile.
     query_target_graph(target_class)
         Queries the target graph or Wikidata to get instance counts and property coverage.
     compare_dictionaries(original_dict, updated_dict)
@@ -306,20 +315,32 @@ class RDFProcessor:
 
     def process_directory(self, directory, class_set):
         """
-        Processes all RDF files in the given directory.
+        Processes all RDF files in the given directory or domain container.
 
         Parameters
         ----------
         directory : str
-            The directory containing RDF files.
+            The directory containing RDF files, or a container with an index.tsv.
         class_set : list of tuple, None
             A list of tuples containing source and target classes.
         """
-        files = [f for f in os.listdir(directory) if f.endswith('.txt') or f.endswith('.nt')]
-        for filename in tqdm(files, desc=f"Processing files in {directory}"):
-            self.process_file(os.path.join(directory, filename), class_set)
-
-    def process_file(self, file_path, class_set):
+        dataset = DomainDataset(directory)
+        # Class/property profiles written during extraction spare loading every graph
+        profile = DatasetProfile(directory)
+        if profile:
+            logging.info(f"Using precomputed profiles of {len(profile.names())} files in {directory}")
+        for filename in tqdm(dataset.names(), desc=f"Processing files in {directory}"):
+            file_path = dataset.local_path(filename)
+            if file_path is None:
+                # LIMES reads the source as a file, so container records are extracted on demand
+                extract_dir = os.path.join(directory, "extracted")
+                os.makedirs(extract_dir, exist_ok=True)
+                file_path = os.path.join(extract_dir, filename)
+                if not os.path.exists(file_path):
+                    dataset.extract(filename, file_path)
+            self.process_file(file_path, class_set, profile_counts=profile.counts(filename))
+
+    def process_file(self, file_path, class_set, profile_counts=None):
         """
         Processes a single RDF file and generates configuration files.
 
@@ -329,15 +350,20 @@ class RDFProcessor:
             The path to the RDF file.
         class_set : list of tuple, None
             A list of tuples containing source and target classes.
+        profile_counts : tuple of collections.Counter, optional
+            The precomputed class/property profile of the file. If provided, the
+            file is not loaded and the profile is used instead of SPARQL queries.
         """
-        g = rdflib.ConjunctiveGraph()
-        try:
-            logging.info(f"Loading source graph {os.path.basename(file_path)}...")
-            g.parse(file_path, format='nquads')
-            logging.info(f"Loaded successfully: {file_path}")
-        except Exception as e:
-            logging.error(f"Failed to load RDF file {file_path}: {str(e)}")
-            return
+        g = None
+        if profile_counts is None:
+            g = rdflib.ConjunctiveGraph()
+            try:
+                logging.info(f"Loading source graph {os.path.basename(file_path)}...")
+                g.parse(file_path, format='nquads')
+                logging.info(f"Loaded successfully: {file_path}")
+            except Exception as e:
+                logging.error(f"Failed to load RDF file {file_path}: {str(e)}")
+                return
         
         self.class_properties_source = {}
         self.coverage_dict_source = {}
@@ -376,7 +402,10 @@ class RDFProcessor:
 
             if not use_property_mapping:
                 # SOURCE
-                total_count, properties_info, nested_prop = self.query_graph(g, source_class)
+                if g is None:
+                    total_count, properties_info, nested_prop = self.query_profile(profile_counts, source_class)
+                else:
+                    total_count, properties_info, nested_prop = self.query_graph(g, source_class)
                 if total_count > 0:
                     sorted_props = sorted(properties_info.items(), key=lambda x: x[1], reverse=True)
                     logging.debug(f"Found instances for class {source_class}")
@@ -710,7 +739,47 @@ class RDFProcessor:
                 properties_info[str(result.property)] = int(result.propCount)
             return total_count, properties_info, nested_prop_dict
 
-        
+    def query_profile(self, profile_counts, class_uri):
+        """
+        Reads the total instance count and property coverage for a given class
+        from a profile computed during domain extraction (see ``domain_profile``).
+
+        The profile holds the counts of the SPARQL queries in ``query_graph``.
+        A property reached both directly and through intermediate properties is
+        reported with the largest of its counts.
+
+        Parameters
+        ----------
+        profile_counts : tuple of collections.Counter
+            The class, literal property and nested property counts of the file.
+        class_uri : str
+            The IRI of the class to query.
+
+        Returns
+        -------
+        total_count : int
+            The total number of instances of the class.
+        properties_info : dict
+            A dictionary mapping property IRIs to their occurrence counts.
+        nested_prop_dict : dict
+            A dictionary of nested properties.
+        """
+        classes, literals, nested = profile_counts
+        total_count = classes.get(class_uri, 0)
+        properties_info = {}
+        nested_prop_dict = {}
+        if total_count == 0:
+            # query_graph's fallback results are not used for classes without instances
+            return total_count, properties_info, nested_prop_dict
+        for (cls, prop), count in literals.items():
+            if cls == class_uri:
+                properties_info[prop] = max(count, properties_info.get(prop, 0))
+        for (cls, via, prop), count in nested.items():
+            if cls == class_uri:
+                nested_prop_dict.setdefault(self.replace_with_prefix(via), set()).add(self.replace_with_prefix(prop))
+                properties_info[prop] = max(count, properties_info.get(prop, 0))
+        return total_count, properties_info, nested_prop_dict
+
     def query_target_graph(self, target_class):
         """
         Queries the target graph or Wikidata to get instance counts and property coverage for a given class.
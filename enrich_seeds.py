@@ -0,0 +1,270 @@
+import argparse
+import logging
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from seed_store import FrontCodedSeedSet, QidSeedSet, open_seed_set, read_seed_file
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+ENDPOINTS = {
+    "dbpedia": "http://dbpedia.org/sparql",
+    "wikidata": "https://query.wikidata.org/sparql",
+}
+
+# Label, description and type properties per dataset
+PROPERTIES = {
+    "dbpedia": (
+        "http://www.w3.org/2000/01/rdf-schema#label",
+        "http://www.w3.org/2000/01/rdf-schema#comment",
+        "http://www.w3.org/1999/02/22-rdf-syntax-ns#type",
+    ),
+    "wikidata": (
+        "http://www.w3.org/2000/01/rdf-schema#label",
+        "http://schema.org/description",
+        "http://www.wikidata.org/prop/direct/P31",
+    ),
+}
+
+# Entities of blocks that still failed after the retries (a rerun retries them) and malformed IRIs
+FAILED_FILE = "failed_entities.txt"
+ENRICHED_STORE = "enriched.fc"
+# Characters that cannot appear in a SPARQL IRIREF (https://www.w3.org/TR/sparql11-query/#rIRIREF)
+INVALID_IRI = re.compile(r'[<>"{}|^`\\\x00-\x20]')
+
+SCHEMA = pa.schema(
+    [
+        ("entity", pa.string()),
+        ("label", pa.string()),
+        ("description", pa.string()),
+        ("types", pa.list_(pa.string())),
+    ]
+)
+
+
+def is_valid_iri(entity):
+    """Whether ``entity`` can be written as ``<entity>`` in a query."""
+    return bool(entity) and INVALID_IRI.search(entity) is None
+
+
+def get_values_query(dataset, entities):
+    """Build one query enriching a whole block of entities through a VALUES clause."""
+    invalid = [entity for entity in entities if not is_valid_iri(entity)]
+    if invalid:
+        raise ValueError(f"Cannot query {len(invalid)} malformed IRIs, e.g. {invalid[0]!r}")
+    label_property, description_property, type_property = PROPERTIES[dataset]
+    values = " ".join(f"<{entity}>" for entity in entities)
+    return f"""
+    SELECT ?entity ?label ?description ?type WHERE {{
+        VALUES ?entity {{ {values} }}
+        OPTIONAL {{ ?entity <{label_property}> ?label FILTER(LANG(?label) = "en") }}
+        OPTIONAL {{ ?entity <{description_property}> ?description FILTER(LANG(?description) = "en") }}
+        OPTIONAL {{ ?entity <{type_property}> ?type }}
+    }}
+    """
+
+
+def create_session(workers):
+    """A single HTTP session shared by all worker threads, with one pooled connection per worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(
+        {
+            "Accept": "application/sparql-results+json",
+            "User-Agent": "WHALE-seed-enrichment/1.0 (https://github.com/dice-group/WHALE)",
+        }
+    )
+    return session
+
+
+def safe_post(session, endpoint, query, retries=5, base_delay=1, timeout=300):
+    """POST a query, backing off exponentially (or per Retry-After) on rate limiting and server errors."""
+    for attempt in range(retries):
+        try:
+            response = session.post(endpoint, data={"query": query}, timeout=timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after = response.headers.get("Retry-After", "")
+                sleep_time = int(retry_after) if retry_after.isdigit() else base_delay * 2 ** attempt
+                logging.info(f"HTTP {response.status_code}; retrying in {sleep_time} seconds...")
+                time.sleep(sleep_time)
+                continue
+            response.raise_for_status()
+            return response.json()
+        except (requests.ConnectionError, requests.Timeout, ValueError) as e:
+            logging.error(f"Query failed on attempt {attempt + 1}: {e}")
+            time.sleep(base_delay * 2 ** attempt)
+    raise RuntimeError(f"Query failed after {retries} attempts")
+
+
+def enrich_block(session, endpoint, dataset, entities):
+    """Query one block of entities and return one row per entity (missing values stay None)."""
+    results = safe_post(session, endpoint, get_values_query(dataset, entities))
+    rows = {entity: {"entity": entity, "label": None, "description": None, "types": []} for entity in entities}
+    for binding in results["results"]["bindings"]:
+        row = rows.get(binding["entity"]["value"])
+        if row is None:
+            continue
+        if "label" in binding and row["label"] is None:
+            row["label"] = binding["label"]["value"]
+        if "description" in binding and row["description"] is None:
+            row["description"] = binding["description"]["value"]
+        if "type" in binding and binding["type"]["value"] not in row["types"]:
+            row["types"].append(binding["type"]["value"])
+    return list(rows.values())
+
+
+def load_enriched_entities(dataset, output_dir):
+    """
+    Seed set of the entities already present in the part files of a previous
+    run: a ``QidSeedSet`` for Wikidata, a ``FrontCodedSeedSet`` stored in
+    ``output_dir`` for DBpedia.
+    """
+    entities = []
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.endswith(".parquet"):
+            table = pq.read_table(os.path.join(output_dir, filename), columns=["entity"])
+            if dataset == "wikidata":
+                entities.append(QidSeedSet.from_iris(table.column("entity").to_pylist()).ids)
+            else:
+                entities.append(table.column("entity"))
+    if dataset == "wikidata":
+        return QidSeedSet.from_qids(np.concatenate(entities) if entities else [])
+    column = pc.unique(pa.chunked_array([chunk for part in entities for chunk in part.chunks], type=pa.string()))
+    column = column.take(pc.sort_indices(column))
+    return FrontCodedSeedSet.build(
+        os.path.join(output_dir, ENRICHED_STORE), (entity.encode("utf-8") for entity in column.to_pylist())
+    )
+
+
+def write_part(output_dir, rows):
+    """Write rows as a new Parquet part; the rename makes each part appear atomically."""
+    part_path = os.path.join(output_dir, f"part-{time.time_ns()}.parquet")
+    pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), f"{part_path}.tmp")
+    os.replace(f"{part_path}.tmp", part_path)
+
+
+def read_seeds(seed_path):
+    if seed_path.endswith((".npy", ".fc")):
+        return iter(open_seed_set(seed_path))
+    return read_seed_file(seed_path)
+
+
+def iter_blocks(seeds, enriched, block_size, reject):
+    """Blocks of the seeds not yet enriched; malformed IRIs are passed to ``reject`` instead."""
+    block = []
+    for entity in seeds:
+        if entity in enriched:
+            continue
+        if not is_valid_iri(entity):
+            reject(entity)
+            continue
+        block.append(entity)
+        if len(block) == block_size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def enrich_seeds(dataset, seed_path, output_dir, block_size=250, workers=8, rows_per_part=100_000):
+    os.makedirs(output_dir, exist_ok=True)
+    enriched = load_enriched_entities(dataset, output_dir)
+    logging.info(f"Skipping {len(enriched)} entities already enriched in {output_dir}")
+    # Every entity missing from the parts is retried, so the failures of earlier runs are obsolete
+    failed_path = os.path.join(output_dir, FAILED_FILE)
+    if os.path.exists(failed_path):
+        os.remove(failed_path)
+
+    endpoint = ENDPOINTS[dataset]
+    session = create_session(workers)
+    rows = []
+    requests_sent = entities_done = entities_failed = entities_rejected = 0
+
+    def reject(entity):
+        # One malformed IRI would break the query of its whole block, so it is never sent
+        nonlocal entities_rejected
+        logging.warning(f"Skipping malformed IRI {entity!r}")
+        with open(failed_path, "a", encoding="utf-8") as f:
+            f.write(entity + "\n")
+        entities_rejected += 1
+
+    blocks = iter_blocks(read_seeds(seed_path), enriched, block_size, reject)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(
+            desc="Enriching entities", unit=" entities"
+        ) as progress:
+            pending = {}
+            while True:
+                # Keep a bounded window of in-flight requests instead of queueing every block
+                for block in blocks:
+                    pending[executor.submit(enrich_block, session, endpoint, dataset, block)] = block
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    block = pending.pop(future)
+                    requests_sent += 1
+                    try:
+                        block_rows = future.result()
+                    except (requests.RequestException, RuntimeError) as e:
+                        # The entities are not in any part file, so the next run retries them
+                        logging.error(f"Giving up on a block of {len(block)} entities: {e}")
+                        with open(failed_path, "a", encoding="utf-8") as f:
+                            f.writelines(entity + "\n" for entity in block)
+                        entities_failed += len(block)
+                        continue
+                    rows.extend(block_rows)
+                    entities_done += len(block_rows)
+                    progress.update(len(block_rows))
+                if len(rows) >= rows_per_part:
+                    write_part(output_dir, rows)
+                    rows = []
+    finally:
+        # Keep the rows of the finished blocks even if the run is interrupted
+        if rows:
+            write_part(output_dir, rows)
+        if isinstance(enriched, FrontCodedSeedSet):
+            enriched.close()
+
+    logging.info(f"Enriched {entities_done} entities with {requests_sent} requests ({block_size} entities per request).")
+    if entities_failed:
+        logging.warning(
+            f"{entities_failed} entities failed and were logged to {failed_path}; "
+            "rerun to retry them."
+        )
+    if entities_rejected:
+        logging.warning(f"{entities_rejected} malformed IRIs were skipped and logged to {failed_path}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich seed entities with labels, descriptions and types.")
+    parser.add_argument("dataset", choices=["dbpedia", "wikidata"])
+    parser.add_argument("seed_file", help="Seed file from fetch_seed_data.py or a seed store (.npy/.fc).")
+    parser.add_argument("output_dir", help="Directory receiving the Parquet part files.")
+    parser.add_argument("--block_size", type=int, default=250, help="Entities per VALUES block.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests.")
+    parser.add_argument("--rows_per_part", type=int, default=100_000, help="Rows per Parquet part file.")
+    args = parser.parse_args()
+
+    enrich_seeds(args.dataset, args.seed_file, args.output_dir, args.block_size, args.workers, args.rows_per_part)
+
+
+if __name__ == "__main__":
+    main()
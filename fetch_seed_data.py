@@ -18,6 +18,18 @@ parser.add_argument(
     choices=["dbpedia", "wikidata"],
     help="The dataset to fetch data from ('dbpedia' or 'wikidata').",
 )
+parser.add_argument(
+    "--dump",
+    type=str,
+    nargs="+",
+    help="Local N-Triples dump(s) (optionally .gz/.bz2) to extract seeds from instead of the endpoint.",
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=os.cpu_count(),
+    help="Number of worker processes for the offline (--dump) mode.",
+)
 args = parser.parse_args()
 
 # Setting dataset-specific parameters based on user input
@@ -152,16 +164,30 @@ def fetch_entities_and_save(dataset, endpoint, last_fetched_uri, filename):
         )
 
 
-# Read the last URI from the seed.txt file and count the existing entries
-last_fetched_uri, initial_entry_count = read_last_uri_and_count_entries(seed_file_path)
-logging.info(
-    f"Starting with {initial_entry_count} entries already in {seed_file_path}."
-)
-
-try:
-    fetch_entities_and_save(
-        args.dataset, sparql_endpoint, last_fetched_uri, seed_file_path
+if args.dump:
+    # Offline mode: compute the same seed set from local dumps, no endpoint needed
+    import tempfile
+
+    from offline_seed_extraction import extract_seeds, write_seed_file
+
+    try:
+        with tempfile.TemporaryDirectory() as spill_dir:
+            seeds = extract_seeds(args.dataset, args.dump, args.workers, spill_dir)
+            write_seed_file(args.dataset, seeds, seed_file_path)
+        logging.info("Finished extracting and saving all entities.")
+    except Exception as e:
+        logging.error("An error occurred", exc_info=True)
+else:
+    # Read the last URI from the seed.txt file and count the existing entries
+    last_fetched_uri, initial_entry_count = read_last_uri_and_count_entries(seed_file_path)
+    logging.info(
+        f"Starting with {initial_entry_count} entries already in {seed_file_path}."
     )
-    logging.info("Finished fetching and saving all entities.")
-except Exception as e:
-    logging.error("An error occurred", exc_info=True)
+
+    try:
+        fetch_entities_and_save(
+            args.dataset, sparql_endpoint, last_fetched_uri, seed_file_path
+        )
+        logging.info("Finished fetching and saving all entities.")
+    except Exception as e:
+        logging.error("An error occurred", exc_info=True)
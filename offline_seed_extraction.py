@@ -0,0 +1,389 @@
+import argparse
+import bz2
+import gzip
+import heapq
+import logging
+import os
+import sys
+import tempfile
+import uuid
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from seed_store import WIKIDATA_ENTITY_PREFIX, FrontCodedSeedSet, QidSeedSet
+
+# Helper modules of the dataset extraction scripts; appended, so nothing on the path is shadowed
+EXTRACTION_SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "WDC_scripts", "dataset_extraction_scripts")
+sys.path.extend(os.path.join(EXTRACTION_SCRIPTS, name) for name in ("domain_specific", "compressed_data"))
+from byte_ranges import iter_range_lines, split_byte_ranges  # noqa: E402
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+RDF_TYPE = b"<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+RDFS_LABEL = b"<http://www.w3.org/2000/01/rdf-schema#label>"
+OWL_CLASS = b"<http://www.w3.org/2002/07/owl#Class>"
+DBO_PREFIX = b"<http://dbpedia.org/ontology/"
+WDT_P31 = b"<http://www.wikidata.org/prop/direct/P31>"
+WDT_P279 = b"<http://www.wikidata.org/prop/direct/P279>"
+WD_CLASS = b"<http://www.wikidata.org/entity/Q16889133>"
+WD_ENTITY_Q = b"<http://www.wikidata.org/entity/Q"
+ENGLISH_LABEL_SUFFIX = b'"@en'
+# Q-ids buffered in Python lists before they are deduplicated into numpy arrays, and
+# DBpedia IRIs buffered in a set before they are spilled as a sorted run
+SCAN_BATCH = 1 << 20
+# Sorted runs merged at once, bounding the open files
+MERGE_FANIN = 256
+
+
+def open_dump(path):
+    """Open a (optionally gzip/bz2 compressed) N-Triples dump in binary mode."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def iter_dump_lines(path, start=0, end=None):
+    """
+    Yield the lines of ``path`` that start inside ``[start, end)`` (see
+    ``byte_ranges.iter_range_lines``). Compressed dumps cannot be split and are
+    always read as a whole (``end`` is None).
+    """
+    if end is None:
+        with open_dump(path) as f:
+            yield from f
+        return
+    yield from iter_range_lines(path, start, end)
+
+
+def plan_tasks(dump_paths, workers):
+    """Byte-range tasks for uncompressed dumps, whole-file tasks for compressed ones."""
+    tasks = []
+    for path in dump_paths:
+        if path.endswith((".gz", ".bz2")):
+            tasks.append((path, 0, None))
+        else:
+            tasks.extend((path, start, end) for start, end in split_byte_ranges(path, workers))
+    return tasks
+
+
+def split_triple(line):
+    """Split an N-Triples line into (subject, predicate, object) byte strings."""
+    parts = line.split(b" ", 2)
+    if len(parts) < 3:
+        return None
+    obj = parts[2].rstrip()
+    if obj.endswith(b"."):
+        obj = obj[:-1].rstrip()
+    return parts[0], parts[1], obj
+
+
+def qid_of(term):
+    """Integer Q-id of a ``<http://www.wikidata.org/entity/Q..>`` term, or None."""
+    if term.startswith(WD_ENTITY_Q) and term.endswith(b">"):
+        digits = term[len(WD_ENTITY_Q):-1]
+        if digits.isdigit():
+            return int(digits)
+    return None
+
+
+def scan_wikidata_schema(task):
+    """Collect the class roots (instances of Q16889133) and wdt:P279 edges of a range."""
+    roots, children, parents = [], [], []
+    for line in iter_dump_lines(*task):
+        triple = split_triple(line)
+        if triple is None:
+            continue
+        s, p, o = triple
+        if p == WDT_P279:
+            child, parent = qid_of(s), qid_of(o)
+            if child is not None and parent is not None:
+                children.append(child)
+                parents.append(parent)
+        elif p == WDT_P31 and o == WD_CLASS:
+            qid = qid_of(s)
+            if qid is not None:
+                roots.append(qid)
+    return (
+        np.asarray(roots, dtype=np.uint64),
+        np.asarray(children, dtype=np.uint64),
+        np.asarray(parents, dtype=np.uint64),
+    )
+
+
+def subclass_closure(roots, children, parents):
+    """All classes reachable from ``roots`` through inverse subclass edges (``wdt:P279*``)."""
+    closure = np.unique(roots)
+    frontier = closure
+    while frontier.size:
+        reached = np.unique(children[np.isin(parents, frontier)])
+        frontier = np.setdiff1d(reached, closure, assume_unique=True)
+        closure = np.union1d(closure, frontier)
+    return closure
+
+
+_classes = None
+_spill_dir = None
+
+
+def _init_classes(classes, spill_dir=None):
+    global _classes, _spill_dir
+    _classes = classes
+    _spill_dir = spill_dir
+
+
+class QidAccumulator:
+    """
+    Distinct Q-ids added in batches. Each batch is deduplicated on arrival and
+    the batches are merged whenever they outgrow the merged set, so memory
+    follows the number of distinct Q-ids rather than the number of triples.
+    """
+
+    def __init__(self):
+        self.seeds = QidSeedSet.from_qids([])
+        self.pending = []
+        self.n_pending = 0
+
+    def add(self, qids):
+        qids = np.unique(np.asarray(qids, dtype=np.uint64))
+        self.pending.append(qids)
+        self.n_pending += len(qids)
+        if self.n_pending > max(len(self.seeds), SCAN_BATCH):
+            self.compact()
+
+    def compact(self):
+        if self.pending:
+            self.seeds = QidSeedSet.from_qids(np.concatenate([self.seeds.ids, *self.pending]))
+            self.pending = []
+            self.n_pending = 0
+        return self.seeds
+
+
+def scan_wikidata_instances(task):
+    """Collect entities typed with a closure class and entities with an English label, as ``QidSeedSet``s."""
+    classes = QidSeedSet(_classes)
+    typed, labelled = QidAccumulator(), QidAccumulator()
+    typed_entities, typed_classes, labelled_batch = [], [], []
+
+    def flush_typed():
+        entities = np.asarray(typed_entities, dtype=np.uint64)
+        typed.add(entities[classes.contains_many(typed_classes)])
+        typed_entities.clear()
+        typed_classes.clear()
+
+    for line in iter_dump_lines(*task):
+        triple = split_triple(line)
+        if triple is None:
+            continue
+        s, p, o = triple
+        if p == WDT_P31:
+            entity, cls = qid_of(s), qid_of(o)
+            if entity is not None and cls is not None:
+                typed_entities.append(entity)
+                typed_classes.append(cls)
+                if len(typed_entities) >= SCAN_BATCH:
+                    flush_typed()
+        elif p == RDFS_LABEL and o.endswith(ENGLISH_LABEL_SUFFIX):
+            entity = qid_of(s)
+            if entity is not None:
+                labelled_batch.append(entity)
+                if len(labelled_batch) >= SCAN_BATCH:
+                    labelled.add(labelled_batch)
+                    labelled_batch.clear()
+    flush_typed()
+    labelled.add(labelled_batch)
+    return typed.compact(), labelled.compact()
+
+
+def scan_dbpedia_schema(task):
+    """Collect the ``owl:Class`` resources in the DBpedia ontology namespace."""
+    classes = set()
+    for line in iter_dump_lines(*task):
+        triple = split_triple(line)
+        if triple is None:
+            continue
+        s, p, o = triple
+        if p == RDF_TYPE and o == OWL_CLASS and s.startswith(DBO_PREFIX):
+            classes.add(s)
+    return classes
+
+
+class RunSpiller:
+    """
+    Distinct IRIs (without angle brackets) collected in a set of at most
+    ``SCAN_BATCH`` entries, which is written to ``spill_dir`` as a sorted
+    ``FrontCodedSeedSet`` run whenever it fills up.
+    """
+
+    def __init__(self, spill_dir, kind):
+        self.spill_dir = spill_dir
+        self.kind = kind
+        self.batch = set()
+        self.runs = []
+
+    def add(self, term):
+        self.batch.add(term.strip(b"<>"))
+        if len(self.batch) >= SCAN_BATCH:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            path = os.path.join(self.spill_dir, f"{self.kind}_{uuid.uuid4().hex}{FrontCodedSeedSet.suffix}")
+            FrontCodedSeedSet.build(path, sorted(self.batch)).close()
+            self.runs.append(path)
+            self.batch = set()
+        return self.runs
+
+
+def merge_runs(runs, path):
+    """Merge sorted run files into the ``FrontCodedSeedSet`` ``path``, ``MERGE_FANIN`` at a time, removing the runs."""
+    runs = list(runs)
+    while len(runs) > MERGE_FANIN or not runs:
+        group, runs = runs[:MERGE_FANIN], runs[MERGE_FANIN:]
+        merged = f"{path}.{uuid.uuid4().hex}"
+        _merge_group(group, merged)
+        runs.append(merged)
+    _merge_group(runs, path)
+    return FrontCodedSeedSet(path)
+
+
+def _merge_group(runs, path):
+    sets = [FrontCodedSeedSet(run) for run in runs]
+    try:
+        FrontCodedSeedSet.build(path, heapq.merge(*(seeds.iter_bytes() for seeds in sets))).close()
+    finally:
+        for seeds in sets:
+            seeds.close()
+    for run in runs:
+        os.remove(run)
+
+
+def scan_dbpedia_instances(task):
+    """
+    Collect entities typed with a DBpedia ontology class and entities with an
+    English label, as lists of sorted run files in the spill directory.
+    """
+    typed, labelled = RunSpiller(_spill_dir, "typed"), RunSpiller(_spill_dir, "labelled")
+    for line in iter_dump_lines(*task):
+        triple = split_triple(line)
+        if triple is None:
+            continue
+        s, p, o = triple
+        if p == RDF_TYPE and o in _classes:
+            typed.add(s)
+        elif p == RDFS_LABEL and o.endswith(ENGLISH_LABEL_SUFFIX):
+            labelled.add(s)
+    return typed.flush(), labelled.flush()
+
+
+def _run(function, tasks, workers, desc, initargs=()):
+    with Pool(workers, initializer=_init_classes, initargs=initargs or (None,)) as pool:
+        yield from tqdm(pool.imap_unordered(function, tasks), total=len(tasks), desc=desc)
+
+
+def extract_wikidata_seeds(dump_paths, workers):
+    tasks = plan_tasks(dump_paths, workers)
+    roots, children, parents = [], [], []
+    for r, c, p in _run(scan_wikidata_schema, tasks, workers, "Scanning subclass index"):
+        roots.append(r)
+        children.append(c)
+        parents.append(p)
+    classes = subclass_closure(
+        np.concatenate(roots), np.concatenate(children), np.concatenate(parents)
+    )
+    logging.info(f"Class closure contains {len(classes)} classes")
+
+    typed, labelled = QidAccumulator(), QidAccumulator()
+    for t, l in _run(scan_wikidata_instances, tasks, workers, "Scanning instances", (classes,)):
+        typed.add(t.ids)
+        labelled.add(l.ids)
+    return typed.compact().intersection(labelled.compact())
+
+
+def extract_dbpedia_seeds(dump_paths, workers, spill_dir):
+    tasks = plan_tasks(dump_paths, workers)
+    classes = set()
+    for found in _run(scan_dbpedia_schema, tasks, workers, "Scanning ontology classes"):
+        classes.update(found)
+    logging.info(f"Found {len(classes)} DBpedia ontology classes")
+
+    typed_runs, labelled_runs = [], []
+    for t, l in _run(scan_dbpedia_instances, tasks, workers, "Scanning instances", (classes, spill_dir)):
+        typed_runs.extend(t)
+        labelled_runs.extend(l)
+    typed = merge_runs(typed_runs, os.path.join(spill_dir, "typed.fc"))
+    labelled = merge_runs(labelled_runs, os.path.join(spill_dir, "labelled.fc"))
+    try:
+        return typed.intersection(labelled, os.path.join(spill_dir, "seeds.fc"))
+    finally:
+        typed.close()
+        labelled.close()
+        os.remove(typed.path)
+        os.remove(labelled.path)
+
+
+def extract_seeds(dataset, dump_paths, workers=None, spill_dir=None):
+    """
+    Compute the seed set of ``fetch_seed_data.get_query`` from local dumps.
+
+    Returns a ``QidSeedSet`` for Wikidata and a ``FrontCodedSeedSet`` for
+    DBpedia. The DBpedia scan spills sorted runs of IRIs to ``spill_dir``
+    (a new temporary directory by default, left to the caller to remove),
+    which also holds the returned set.
+    """
+    workers = workers or os.cpu_count()
+    for path in dump_paths:
+        logging.info(f"Using dump {path} ({os.path.getsize(path) / (1024 ** 3):.2f} GB)")
+    if dataset == "wikidata":
+        seeds = extract_wikidata_seeds(dump_paths, workers)
+    else:
+        seeds = extract_dbpedia_seeds(dump_paths, workers, spill_dir or tempfile.mkdtemp(prefix="dbpedia_seeds_"))
+    logging.info(f"Extracted {len(seeds)} seeds from local dumps")
+    return seeds
+
+
+def write_seed_file(dataset, seeds, file_path, store_path=None):
+    """Write seeds in the endpoint's ``ORDER BY ?entity`` order and optionally as a seed store."""
+    if dataset == "wikidata":
+        qids = np.asarray(seeds.ids)
+        order = np.argsort(qids.astype(np.str_), kind="stable")
+        iris = (f"{WIKIDATA_ENTITY_PREFIX}{int(qid)}" for qid in qids[order])
+    else:
+        iris = iter(seeds)
+    with open(file_path, "w", encoding="utf-8") as file:
+        for iri in iris:
+            file.write(iri + "\n")
+    logging.info(f"Wrote {len(seeds)} seeds to {file_path}")
+
+    if store_path:
+        if dataset == "wikidata":
+            seeds.save(store_path)
+        else:
+            FrontCodedSeedSet.build(store_path, seeds.iter_bytes()).close()
+        logging.info(f"Wrote seed store {store_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract seed entities from local dumps.")
+    parser.add_argument("dataset", choices=["dbpedia", "wikidata"])
+    parser.add_argument("dumps", nargs="+", help="N-Triples dump files (.nt, .nt.gz or .nt.bz2).")
+    parser.add_argument("--output", help="Seed file to write (default: seed_<dataset>.txt).")
+    parser.add_argument("--store", help="Also write a seed store (.npy or .fc, see seed_store.py).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--spill_dir", help="Directory for the sorted DBpedia IRI runs (default: system temp).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.spill_dir) as spill_dir:
+        seeds = extract_seeds(args.dataset, args.dumps, args.workers, spill_dir)
+        write_seed_file(args.dataset, seeds, args.output or f"seed_{args.dataset}.txt", args.store)
+        if args.dataset == "dbpedia":
+            seeds.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+import argparse
+import heapq
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+from tqdm import tqdm
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+WIKIDATA_ENTITY_PREFIX = "http://www.wikidata.org/entity/Q"
+
+# Front-coded file layout: data blocks, block offsets (uint64), footer.
+FC_MAGIC = b"WHALEFC1"
+FC_FOOTER = struct.Struct("<QQQQ8s")  # n_strings, block_size, n_blocks, offsets_pos, magic
+
+
+def strip_iri(iri):
+    """Return the bare IRI without surrounding whitespace and angle brackets."""
+    return iri.strip().strip("<>")
+
+
+def parse_qid(iri):
+    """Convert a Wikidata entity IRI (or a bare ``Q123``) into its integer id, or None."""
+    iri = strip_iri(iri)
+    if iri.startswith(WIKIDATA_ENTITY_PREFIX):
+        iri = iri[len(WIKIDATA_ENTITY_PREFIX):]
+    elif iri.startswith("Q"):
+        iri = iri[1:]
+    return int(iri) if iri.isdigit() else None
+
+
+def read_seed_file(file_path):
+    """Yield the IRIs of a seed file written by ``fetch_seed_data.py``, one per line."""
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = strip_iri(line)
+            if line:
+                yield line
+
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class QidSeedSet:
+    """
+    Wikidata seed set stored as a sorted, deduplicated ``uint64`` array of Q-ids.
+
+    The array is saved as a plain ``.npy`` file and opened memory-mapped, so
+    membership is a binary search over the mapped pages and many processes can
+    share the same file without loading it.
+    """
+
+    suffix = ".npy"
+
+    def __init__(self, ids, path=None):
+        self.ids = ids
+        self.path = path
+
+    @classmethod
+    def from_qids(cls, qids):
+        return cls(np.unique(np.asarray(qids, dtype=np.uint64)))
+
+    @classmethod
+    def from_iris(cls, iris):
+        qids = []
+        skipped = 0
+        for iri in iris:
+            qid = parse_qid(iri)
+            if qid is None:
+                skipped += 1
+            else:
+                qids.append(qid)
+        if skipped:
+            logging.warning(f"Skipped {skipped} IRIs that are not Wikidata Q-ids")
+        return cls.from_qids(qids)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path, mmap_mode="r"), path)
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.ids, dtype=np.uint64))
+        os.replace(tmp_path, path)
+        return QidSeedSet.load(path)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for qid in self.ids:
+            yield f"{WIKIDATA_ENTITY_PREFIX}{int(qid)}"
+
+    def __contains__(self, item):
+        qid = item if isinstance(item, (int, np.integer)) else parse_qid(item)
+        if qid is None or len(self.ids) == 0:
+            return False
+        idx = np.searchsorted(self.ids, np.uint64(qid))
+        return idx < len(self.ids) and self.ids[idx] == qid
+
+    def contains_many(self, qids):
+        """Vectorised membership test for an array of Q-ids."""
+        qids = np.asarray(qids, dtype=np.uint64)
+        if len(self.ids) == 0:
+            return np.zeros(len(qids), dtype=bool)
+        idx = np.searchsorted(self.ids, qids)
+        idx[idx == len(self.ids)] = len(self.ids) - 1
+        return self.ids[idx] == qids
+
+    def _result(self, ids, path):
+        result = QidSeedSet(ids)
+        return result.save(path) if path else result
+
+    def union(self, other, path=None):
+        return self._result(np.union1d(self.ids, other.ids), path)
+
+    def intersection(self, other, path=None):
+        return self._result(np.intersect1d(self.ids, other.ids, assume_unique=True), path)
+
+    def difference(self, other, path=None):
+        return self._result(np.setdiff1d(self.ids, other.ids, assume_unique=True), path)
+
+    def merge(self, iris, path=None):
+        """Merge a new batch of IRIs into the set and return the merged set."""
+        return self.union(QidSeedSet.from_iris(iris), path)
+
+
+class FrontCodedSeedSet:
+    """
+    Seed set of arbitrary IRIs stored as a front-coded, sorted dictionary.
+
+    Strings are sorted by their UTF-8 bytes and grouped into blocks of
+    ``block_size``. The first string of a block is stored in full, the others
+    as (shared prefix length, suffix). The block offsets allow a binary search
+    over the block heads, so membership costs O(log n) block-head decodes plus
+    one short block scan. DBpedia IRIs share long prefixes, so the file is a
+    fraction of the plain text size.
+    """
+
+    suffix = ".fc"
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        if size < FC_FOOTER.size:
+            raise ValueError(f"{path} is not a front-coded seed file")
+        n_strings, block_size, n_blocks, offsets_pos, magic = FC_FOOTER.unpack_from(
+            self._data, size - FC_FOOTER.size
+        )
+        if magic != FC_MAGIC:
+            raise ValueError(f"{path} is not a front-coded seed file")
+        self.n_strings = n_strings
+        self.block_size = block_size
+        self.offsets = np.frombuffer(
+            self._data, dtype=np.uint64, count=n_blocks + 1, offset=offsets_pos
+        )
+
+    @classmethod
+    def build(cls, path, sorted_strings, block_size=16):
+        """Write strictly increasing byte strings to ``path`` and open the result."""
+        tmp_path = f"{path}.tmp"
+        offsets = []
+        n_strings = 0
+        previous = None
+        pos = 0
+        block = bytearray()
+        with open(tmp_path, "wb") as f:
+            for string in sorted_strings:
+                if previous is not None and string <= previous:
+                    if string == previous:
+                        continue
+                    raise ValueError("Strings must be sorted to build a front-coded set")
+                if n_strings % block_size == 0:
+                    if block:
+                        f.write(block)
+                        pos += len(block)
+                        block = bytearray()
+                    offsets.append(pos)
+                    _write_varint(block, len(string))
+                    block += string
+                else:
+                    shared = 0
+                    limit = min(len(previous), len(string))
+                    while shared < limit and previous[shared] == string[shared]:
+                        shared += 1
+                    _write_varint(block, shared)
+                    _write_varint(block, len(string) - shared)
+                    block += string[shared:]
+                previous = string
+                n_strings += 1
+            f.write(block)
+            pos += len(block)
+            offsets.append(pos)
+            f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            f.write(FC_FOOTER.pack(n_strings, block_size, len(offsets) - 1, pos, FC_MAGIC))
+        os.replace(tmp_path, path)
+        return cls(path)
+
+    @classmethod
+    def from_iris(cls, path, iris, block_size=16):
+        strings = sorted({strip_iri(iri).encode("utf-8") for iri in iris})
+        return cls.build(path, strings, block_size)
+
+    @classmethod
+    def load(cls, path):
+        return cls(path)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self.offsets = None
+            self._data.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.n_strings
+
+    def _block_head(self, block):
+        pos = int(self.offsets[block])
+        length, pos = _read_varint(self._data, pos)
+        return self._data[pos:pos + length]
+
+    def _iter_block(self, block):
+        pos = int(self.offsets[block])
+        end = int(self.offsets[block + 1])
+        length, pos = _read_varint(self._data, pos)
+        current = self._data[pos:pos + length]
+        pos += length
+        yield current
+        while pos < end:
+            shared, pos = _read_varint(self._data, pos)
+            length, pos = _read_varint(self._data, pos)
+            current = current[:shared] + self._data[pos:pos + length]
+            pos += length
+            yield current
+
+    def iter_bytes(self):
+        for block in range(len(self.offsets) - 1):
+            yield from self._iter_block(block)
+
+    def __iter__(self):
+        for string in self.iter_bytes():
+            yield string.decode("utf-8")
+
+    def contains_bytes(self, key):
+        n_blocks = len(self.offsets) - 1
+        if n_blocks == 0:
+            return False
+        lo, hi = 0, n_blocks - 1
+        # Find the last block whose head is <= key.
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._block_head(mid) <= key:
+                lo = mid
+            else:
+                hi = mid - 1
+        for string in self._iter_block(lo):
+            if string >= key:
+                return string == key
+        return False
+
+    def __contains__(self, iri):
+        if isinstance(iri, str):
+            iri = strip_iri(iri).encode("utf-8")
+        return self.contains_bytes(iri)
+
+    def contains_many(self, iris):
+        return np.fromiter((iri in self for iri in iris), dtype=bool)
+
+    def union(self, other, path):
+        return FrontCodedSeedSet.build(
+            path, heapq.merge(self.iter_bytes(), other.iter_bytes()), self.block_size
+        )
+
+    def intersection(self, other, path):
+        return FrontCodedSeedSet.build(
+            path, merge_join(self.iter_bytes(), other.iter_bytes(), keep_common=True),
+            self.block_size,
+        )
+
+    def difference(self, other, path):
+        return FrontCodedSeedSet.build(
+            path, merge_join(self.iter_bytes(), other.iter_bytes(), keep_common=False),
+            self.block_size,
+        )
+
+    def merge(self, iris, path=None):
+        """Merge a new batch of IRIs into the set; replaces the file unless ``path`` is given."""
+        batch = sorted({strip_iri(iri).encode("utf-8") for iri in iris})
+        target = path or self.path
+        result_path = f"{target}.merge"
+        FrontCodedSeedSet.build(result_path, heapq.merge(self.iter_bytes(), batch), self.block_size).close()
+        if target == self.path:
+            self.close()
+        os.replace(result_path, target)
+        return FrontCodedSeedSet(target)
+
+
+def merge_join(left, right, keep_common):
+    """Stream the intersection (or difference) of two sorted, unique iterators."""
+    right = iter(right)
+    current = next(right, None)
+    for item in left:
+        while current is not None and current < item:
+            current = next(right, None)
+        if (current == item) == keep_common:
+            yield item
+
+
+def open_seed_set(path):
+    """Open a seed store written by this module, choosing the format from the file suffix."""
+    if path.endswith(QidSeedSet.suffix):
+        return QidSeedSet.load(path)
+    if path.endswith(FrontCodedSeedSet.suffix):
+        return FrontCodedSeedSet.load(path)
+    raise ValueError(f"Unknown seed store format: {path}")
+
+
+def build_seed_store(dataset, seed_file, store_path):
+    iris = tqdm(read_seed_file(seed_file), desc=f"Reading {seed_file}", unit=" IRIs")
+    if dataset == "wikidata":
+        store = QidSeedSet.from_iris(iris).save(store_path)
+    else:
+        store = FrontCodedSeedSet.from_iris(store_path, iris)
+    logging.info(f"Stored {len(store)} unique seeds in {store_path}")
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query compact seed stores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build a seed store from a seed text file.")
+    build.add_argument("dataset", choices=["dbpedia", "wikidata"])
+    build.add_argument("seed_file", help="Seed file written by fetch_seed_data.py.")
+    build.add_argument("store", help="Output store (.npy for Wikidata, .fc for DBpedia).")
+
+    merge = subparsers.add_parser("merge", help="Merge a new batch of IRIs into a store.")
+    merge.add_argument("store")
+    merge.add_argument("batch_file")
+
+    for operation in ("union", "intersection", "difference"):
+        op_parser = subparsers.add_parser(operation, help=f"Write the {operation} of two stores.")
+        op_parser.add_argument("left")
+        op_parser.add_argument("right")
+        op_parser.add_argument("output")
+
+    contains = subparsers.add_parser("contains", help="Test IRIs for membership.")
+    contains.add_argument("store")
+    contains.add_argument("iris", nargs="+")
+
+    export = subparsers.add_parser("export", help="Write a store back to a seed text file.")
+    export.add_argument("store")
+    export.add_argument("output")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_seed_store(args.dataset, args.seed_file, args.store)
+    elif args.command == "merge":
+        store = open_seed_set(args.store)
+        before = len(store)
+        store = store.merge(read_seed_file(args.batch_file), args.store)
+        logging.info(f"Merged {len(store) - before} new seeds; {len(store)} seeds in {args.store}")
+    elif args.command in ("union", "intersection", "difference"):
+        left, right = open_seed_set(args.left), open_seed_set(args.right)
+        if type(left) is not type(right):
+            parser.error("Both stores must have the same format")
+        result = getattr(left, args.command)(right, args.output)
+        logging.info(f"Wrote {len(result)} seeds to {args.output}")
+    elif args.command == "contains":
+        store = open_seed_set(args.store)
+        for iri in args.iris:
+            print(f"{iri}\t{iri in store}")
+    elif args.command == "export":
+        store = open_seed_set(args.store)
+        with open(args.output, "w", encoding="utf-8") as f:
+            for iri in tqdm(store, total=len(store), desc="Exporting seeds"):
+                f.write(iri + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+from offline_seed_extraction import iter_dump_lines, plan_tasks, split_triple
+from seed_store import FrontCodedSeedSet, merge_join, open_seed_set, read_seed_file, strip_iri
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+BLOOM_HEADER = struct.Struct("<QQ")  # number of bits, number of hash functions
+
+
+def _bloom_hashes(key, n_bits, n_hashes):
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % n_bits for i in range(n_hashes)]
+
+
+class BloomFilter:
+    """Memory-mapped Bloom filter used to reject most non-members before the exact lookup."""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.n_bits, self.n_hashes = BLOOM_HEADER.unpack_from(self._data, 0)
+
+    @classmethod
+    def build(cls, path, keys, n_keys, fp_rate=0.01):
+        n_keys = max(n_keys, 1)
+        n_bits = max(64, int(-n_keys * math.log(fp_rate) / math.log(2) ** 2))
+        n_hashes = max(1, round(n_bits / n_keys * math.log(2)))
+        bits = np.zeros((n_bits + 7) // 8, dtype=np.uint8)
+        positions = []
+        for key in keys:
+            positions.extend(_bloom_hashes(key, n_bits, n_hashes))
+            if len(positions) >= 1 << 20:
+                cls._set_bits(bits, positions)
+                positions = []
+        cls._set_bits(bits, positions)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(BLOOM_HEADER.pack(n_bits, n_hashes))
+            f.write(bits.tobytes())
+        os.replace(f"{path}.tmp", path)
+        return cls(path)
+
+    @staticmethod
+    def _set_bits(bits, positions):
+        positions = np.asarray(positions, dtype=np.uint64)
+        np.bitwise_or.at(bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    def __contains__(self, key):
+        data = self._data
+        offset = BLOOM_HEADER.size
+        for pos in _bloom_hashes(key, self.n_bits, self.n_hashes):
+            if not data[offset + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+class Frontier:
+    """
+    Exact front-coded node set with a Bloom filter in front of it. Both files
+    stay memory-mapped until ``close``; use it as a context manager where the
+    frontier is only needed briefly.
+    """
+
+    def __init__(self, path):
+        self.nodes = FrontCodedSeedSet(f"{path}.fc")
+        self.bloom = BloomFilter(f"{path}.bloom")
+
+    @classmethod
+    def build(cls, path, sorted_nodes, fp_rate=0.01):
+        nodes = FrontCodedSeedSet.build(f"{path}.fc", sorted_nodes)
+        BloomFilter.build(f"{path}.bloom", nodes.iter_bytes(), len(nodes), fp_rate).close()
+        nodes.close()
+        return cls(path)
+
+    def close(self):
+        self.nodes.close()
+        self.bloom.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.bloom and self.nodes.contains_bytes(node)
+
+
+def node_of(term):
+    """The node key of an IRI or blank node term, or None for literals."""
+    if term.startswith(b"<") and term.endswith(b">"):
+        return term[1:-1]
+    if term.startswith(b"_:"):
+        return term
+    return None
+
+
+_frontier = None
+_visited = None
+
+
+def _init_worker(frontier_path, visited_path):
+    global _frontier, _visited
+    _frontier = Frontier(frontier_path)
+    _visited = Frontier(visited_path) if visited_path else None
+
+
+def scan_range(args):
+    """
+    Write the triples of one byte range that touch the frontier and were not
+    emitted by an earlier hop, and return the sorted new neighbour nodes.
+    """
+    task, triples_path, nodes_path = args
+    neighbours = set()
+    kept = 0
+    with open(triples_path, "wb") as out:
+        for line in iter_dump_lines(*task):
+            triple = split_triple(line)
+            if triple is None:
+                continue
+            s, o = node_of(triple[0]), node_of(triple[2])
+            s_in = s is not None and s in _frontier
+            o_in = o is not None and o in _frontier
+            if not (s_in or o_in):
+                continue
+            # Triples touching an earlier hop's nodes were already written by that hop
+            if _visited is not None and ((s is not None and s in _visited) or (o is not None and o in _visited)):
+                continue
+            out.write(line if line.endswith(b"\n") else line + b"\n")
+            kept += 1
+            if s is not None and not s_in:
+                neighbours.add(s)
+            if o is not None and not o_in:
+                neighbours.add(o)
+    with open(nodes_path, "wb") as out:
+        for node in sorted(neighbours):
+            out.write(node + b"\n")
+    return kept
+
+
+def _iter_sorted_file(path):
+    with open(path, "rb") as f:
+        for line in f:
+            yield line.rstrip(b"\n")
+
+
+def _unique(sorted_items):
+    previous = None
+    for item in sorted_items:
+        if item != previous:
+            yield item
+            previous = item
+
+
+def load_seed_nodes(seed_path):
+    """Sorted, unique seed node keys from a seed file or seed store."""
+    if seed_path.endswith((".npy", ".fc")):
+        seeds = open_seed_set(seed_path)
+        return sorted(iri.encode("utf-8") for iri in seeds)
+    return sorted({strip_iri(iri).encode("utf-8") for iri in read_seed_file(seed_path)})
+
+
+def extract_subgraph(dump_paths, seed_path, output_dir, hops=1, workers=None, fp_rate=0.01):
+    workers = workers or os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = plan_tasks(dump_paths, workers)
+
+    frontier_path = os.path.join(output_dir, "frontier_0")
+    frontier = Frontier.build(frontier_path, load_seed_nodes(seed_path), fp_rate)
+    logging.info(f"Hop 0 frontier: {len(frontier)} seed nodes")
+    visited, visited_path = None, None
+
+    try:
+        for hop in range(1, hops + 1):
+            hop_dir = os.path.join(output_dir, f"triples_{hop}")
+            os.makedirs(hop_dir, exist_ok=True)
+            jobs = [
+                (task, os.path.join(hop_dir, f"part-{i:05d}.nt"), os.path.join(hop_dir, f"nodes-{i:05d}.tmp"))
+                for i, task in enumerate(tasks)
+            ]
+            kept = 0
+            with Pool(workers, initializer=_init_worker, initargs=(frontier_path, visited_path)) as pool:
+                for count in tqdm(pool.imap_unordered(scan_range, jobs), total=len(jobs), desc=f"Hop {hop}"):
+                    kept += count
+            logging.info(f"Hop {hop}: kept {kept} triples in {hop_dir}")
+
+            # visited_h = visited_{h-1} | frontier_{h-1}; the handles of hop h-1 are closed once merged
+            visited_path = os.path.join(output_dir, f"visited_{hop}")
+            previous = visited.nodes.iter_bytes() if visited else iter(())
+            new_visited = Frontier.build(
+                visited_path, _unique(heapq.merge(previous, frontier.nodes.iter_bytes())), fp_rate
+            )
+            if visited:
+                visited.close()
+            visited = new_visited
+
+            # frontier_h = neighbours found in this hop that were never visited
+            neighbours = _unique(heapq.merge(*(_iter_sorted_file(nodes_path) for _, _, nodes_path in jobs)))
+            frontier_path = os.path.join(output_dir, f"frontier_{hop}")
+            new_frontier = Frontier.build(
+                frontier_path,
+                merge_join(neighbours, visited.nodes.iter_bytes(), keep_common=False),
+                fp_rate,
+            )
+            frontier.close()
+            frontier = new_frontier
+            for _, _, nodes_path in jobs:
+                os.remove(nodes_path)
+            logging.info(f"Hop {hop} frontier: {len(frontier)} new nodes")
+            if len(frontier) == 0:
+                break
+    finally:
+        frontier.close()
+        if visited:
+            visited.close()
+    return frontier_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the k-hop neighbourhood of seed entities from triple dumps.")
+    parser.add_argument("seed_file", help="Seed file from fetch_seed_data.py or a seed store (.npy/.fc).")
+    parser.add_argument("output_dir", help="Directory for the per-hop triples and frontiers.")
+    parser.add_argument("dumps", nargs="+", help="N-Triples dumps, e.g. mpi_combined_file.txt.")
+    parser.add_argument("--hops", type=int, default=1, help="Number of hops (k).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--fp_rate", type=float, default=0.01, help="Bloom filter false-positive rate.")
+    args = parser.parse_args()
+
+    extract_subgraph(args.dumps, args.seed_file, args.output_dir, args.hops, args.workers, args.fp_rate)
+
+
+if __name__ == "__main__":
+    main()